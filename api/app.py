@@ -4,19 +4,28 @@ Author: Koketso Diale
 Date: 2024-07-22
 """
 from __future__ import annotations
+from typing import Optional
 from routes.auth import auth
 from flask import Flask
 from flask_cors import CORS
 from config import Config
 from models import db
+from models.aggregates import aggregate_registry
+from models.metric import Metric
+from models.storage import get_backend
 from flask_jwt_extended import JWTManager
 from routes.devices import devices
 from routes.data import data
+from routes.system import system
+from routes.events import events
 from services.mqtt_handler import init_mqtt_handler
+from services.event_hub import event_hub
+from services.response_cache import response_cache
+from services.retention_scheduler import init_retention_scheduler
 
 
 # define function to instantiate all the parts of the API
-def create_app():
+def create_app(start_mqtt: Optional[bool] = None):
     app = Flask(__name__)
     app.config.from_object(Config)  # config file with .env vars
     db.init_app(app)  # init the db
@@ -27,11 +36,25 @@ def create_app():
     app.register_blueprint(auth, url_prefix='/api/auth')
     app.register_blueprint(devices, url_prefix='/api')
     app.register_blueprint(data, url_prefix='/api')
+    app.register_blueprint(system, url_prefix='/api')
+    app.register_blueprint(events, url_prefix='/api')
+    response_cache.configure(app.config['RESPONSE_CACHE_MAX_BYTES'],
+                             app.config['RESPONSE_CACHE_TTL'])
+    event_hub.configure(app.config['EVENT_BUFFER_SIZE'])
+
+    # Ingest runs in this process unless dedicated workers are configured
+    if start_mqtt is None:
+        start_mqtt = not app.config.get('MQTT_INGEST_WORKERS')
 
     with app.app_context():
         # db context for app & access for mqtt
         db.create_all()
-        init_mqtt_handler(app)
+        aggregate_registry.discover()  # stats views usable by routing
+        get_backend().maintain(Metric.__table__)
+        if start_mqtt:
+            init_mqtt_handler(app)
+        if app.config['RETENTION_ENABLED']:
+            init_retention_scheduler(app)
     
     return app
 
@@ -0,0 +1,3 @@
+"""
+Ingest and query benchmarks, run against the database in SQLALCHEMY_DATABASE_URI
+"""
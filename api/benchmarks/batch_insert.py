@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compare Metric.batch_insert throughput for COPY and INSERT paths.
+
+Usage (from the api directory):
+    python -m benchmarks.batch_insert [--rounds 5] [--format text]
+
+Rows are written for a throwaway user/device and removed afterwards.
+"""
+from __future__ import annotations
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List
+from flask import Flask
+from config import Config
+from models import db
+from models.device import Device
+from models.metric import Metric, MetricType
+from models.pg_copy import supports_copy
+from models.user import User
+
+
+BATCH_SIZES = (100, 1000, 10000)
+
+
+def create_bench_app() -> Flask:
+    """Minimal app with the database only (no MQTT)"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    return app
+
+
+def make_rows(device_id: int, metric_type_id: int,
+              count: int, start: datetime) -> List[Dict[str, Any]]:
+    """Build ``count`` synthetic readings one second apart"""
+    return [{
+        'device_id': device_id,
+        'metric_type_id': metric_type_id,
+        'timestamp': start + timedelta(seconds=i),
+        'value': 20.0 + (i % 100) / 10.0,
+        'quality': 1.0,
+        'metric_metadata': {'firmware_version': '1.0.0',
+                            'battery_voltage': 3.1,
+                            'wifi_strength': -61}
+    } for i in range(count)]
+
+
+def run(rounds: int, copy_format: str) -> None:
+    """Insert each batch size with both methods and print rows/s"""
+    suffix = uuid.uuid4().hex[:8]
+    user = User(username=f"bench{suffix}", email=f"bench{suffix}@example.com",
+                password=uuid.uuid4().hex)
+    db.session.add(user)
+    db.session.flush()
+    device = Device(device_key=f"bench-{suffix}", user=user)
+    metric_type = MetricType(name=f"bench_{suffix}")
+    db.session.add_all([device, metric_type])
+    db.session.commit()
+
+    methods = ['insert']
+    if supports_copy(db.session.connection()):
+        methods.append('copy')
+    else:
+        print("COPY is not available on this database, "
+              "benchmarking INSERT only")
+
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    print(f"{'method':<8}{'batch':>8}{'rows/s':>14}")
+    try:
+        for batch_size in BATCH_SIZES:
+            for method in methods:
+                elapsed = 0.0
+                for _ in range(rounds):
+                    rows = make_rows(device.id, metric_type.id,
+                                     batch_size, start)
+                    start += timedelta(seconds=batch_size)
+                    began = time.perf_counter()
+                    Metric.batch_insert(rows, method=method,
+                                        copy_format=copy_format)
+                    elapsed += time.perf_counter() - began
+                rate = batch_size * rounds / elapsed
+                print(f"{method:<8}{batch_size:>8}{rate:>14,.0f}")
+    finally:
+        db.session.rollback()
+        db.session.delete(device)
+        db.session.delete(metric_type)
+        db.session.delete(user)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='batches per size and method')
+    parser.add_argument('--format', choices=('text', 'binary'),
+                        default='text', help='COPY format')
+    args = parser.parse_args()
+
+    with create_bench_app().app_context():
+        run(args.rounds, args.format)
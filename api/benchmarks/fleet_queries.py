@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Check that Device.fleet_summary issues a fixed number of queries.
+
+Usage (from the api directory):
+    python -m benchmarks.fleet_queries [--sizes 1 10 100]
+
+Builds throwaway fleets of each size, counts the SQL statements of one
+summary and exits non-zero when the count grows with the fleet (N+1).
+"""
+from __future__ import annotations
+import argparse
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+from sqlalchemy import event
+from models import db
+from models.device import Device
+from models.latest_metric import LatestMetric
+from models.metric import Metric, MetricType
+from models.user import User
+from benchmarks.batch_insert import create_bench_app, make_rows
+
+
+def count_queries(user_id: int) -> int:
+    """Run one fleet summary and return the statements it executed"""
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.expire_all()
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        Device.fleet_summary(user_id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def run(sizes: List[int]) -> bool:
+    """Print the query count per fleet size; True when all are equal"""
+    metric_type = MetricType(name=f"bench_{uuid.uuid4().hex[:8]}")
+    db.session.add(metric_type)
+    db.session.commit()
+    start = datetime.now(timezone.utc) - timedelta(hours=2)
+    counts = []
+    users = []
+    try:
+        for size in sizes:
+            suffix = uuid.uuid4().hex[:8]
+            user = User(username=f"bench{suffix}",
+                        email=f"bench{suffix}@example.com",
+                        password=uuid.uuid4().hex)
+            users.append(user)
+            db.session.add(user)
+            db.session.flush()
+            devices = [Device(device_key=f"bench-{suffix}-{i}", user=user)
+                       for i in range(size)]
+            db.session.add_all(devices)
+            db.session.flush()
+            for device in devices:
+                rows = make_rows(device.id, metric_type.id, 10, start)
+                Metric.batch_insert(rows, commit=False)
+                LatestMetric.upsert(rows, commit=False)
+            db.session.commit()
+
+            began = time.perf_counter()
+            queries = count_queries(user.id)
+            elapsed = time.perf_counter() - began
+            counts.append(queries)
+            print(f"{size:>6} devices {queries:>4} queries "
+                  f"{elapsed * 1000:>9.1f} ms")
+    finally:
+        db.session.rollback()
+        for user in users:
+            db.session.delete(user)
+        db.session.delete(metric_type)
+        db.session.commit()
+    return len(set(counts)) == 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1, 10, 100], help='fleet sizes to compare')
+    args = parser.parse_args()
+
+    with create_bench_app().app_context():
+        fixed = run(args.sizes)
+    if not fixed:
+        print("Query count depends on fleet size (N+1)")
+    sys.exit(0 if fixed else 1)
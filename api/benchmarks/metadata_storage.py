@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Compare metric storage with a JSONB document per row and with shared metadata.
+
+Usage (from the api directory):
+    python -m benchmarks.metadata_storage [--rows 100000]
+
+Writes the same readings into scratch tables in three layouts and
+prints bytes per reading and readings inserted per second:
+    jsonb       metric_metadata document on every row (the old layout)
+    dictionary  metadata_id into metadata_documents
+    promoted    dictionary, with battery_voltage and wifi_strength
+                stored as readings of their own
+Requires PostgreSQL. Documents written to metadata_documents are kept;
+they are deduplicated like any others.
+"""
+from __future__ import annotations
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+from sqlalchemy import (BigInteger, Column, DateTime, Float, Integer,
+                        MetaData, Table, func, select, text)
+from sqlalchemy.dialects.postgresql import JSONB
+from models import db
+from models.metadata_document import metadata_dictionary, promote_fields
+from benchmarks.batch_insert import create_bench_app
+
+
+PROMOTED = {'battery_voltage': 1, 'wifi_strength': 2}
+BATCH_SIZE = 1000
+
+
+def make_readings(count: int) -> List[Dict[str, Any]]:
+    """Readings whose metadata repeats firmware data with slow drift"""
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    return [{
+        'device_id': i % 10,
+        'metric_type_id': 3,
+        'timestamp': start + timedelta(seconds=i),
+        'value': 20.0 + (i % 100) / 10.0,
+        'quality': 1.0,
+        'metric_metadata': {'firmware_version': '1.0.0',
+                            'battery_voltage': round(3.0 + i % 50 / 100, 2),
+                            'wifi_strength': -50 - i % 30}
+    } for i in range(count)]
+
+
+def bench_table(name: str, metadata_column: Column) -> Table:
+    """Scratch table with the metrics columns and one metadata column"""
+    return Table(name, MetaData(),
+                 Column('id', BigInteger, primary_key=True),
+                 Column('device_id', Integer, nullable=False),
+                 Column('metric_type_id', Integer, nullable=False),
+                 Column('timestamp', DateTime(timezone=True),
+                        nullable=False),
+                 Column('value', Float, nullable=False),
+                 Column('quality', Float),
+                 metadata_column)
+
+
+def insert(table: Table, readings: List[Dict[str, Any]],
+           layout: str) -> float:
+    """Insert readings in batches and return the elapsed seconds"""
+    began = time.perf_counter()
+    for offset in range(0, len(readings), BATCH_SIZE):
+        rows = readings[offset:offset + BATCH_SIZE]
+        if layout == 'promoted':
+            rows, _ = promote_fields(rows, PROMOTED, PROMOTED.get)
+        if layout != 'jsonb':
+            rows = metadata_dictionary.encode_rows(rows)
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    return time.perf_counter() - began
+
+
+def run(count: int) -> int:
+    """Benchmark every layout and print one line per layout"""
+    if db.engine.dialect.name != 'postgresql':
+        print("This benchmark needs PostgreSQL")
+        return 1
+    readings = make_readings(count)
+    layouts = {
+        'jsonb': bench_table('bench_metrics_jsonb',
+                             Column('metric_metadata', JSONB)),
+        'dictionary': bench_table('bench_metrics_dictionary',
+                                  Column('metadata_id', BigInteger)),
+        'promoted': bench_table('bench_metrics_promoted',
+                                Column('metadata_id', BigInteger)),
+    }
+    print(f"{'layout':<12}{'rows':>10}{'bytes/reading':>16}"
+          f"{'row bytes':>12}{'readings/s':>14}")
+    try:
+        for layout, table in layouts.items():
+            table.create(db.engine)
+            elapsed = insert(table, readings, layout)
+            rows = db.session.execute(
+                select(func.count()).select_from(table)).scalar()
+            total = db.session.execute(
+                text("SELECT pg_total_relation_size("
+                     "CAST(:name AS regclass))"),
+                {'name': table.name}).scalar()
+            row_bytes = db.session.execute(
+                text(f"SELECT avg(pg_column_size(t.*)) FROM {table.name} t")
+            ).scalar()
+            print(f"{layout:<12}{rows:>10}{total / count:>16.1f}"
+                  f"{float(row_bytes):>12.1f}{count / elapsed:>14,.0f}")
+    finally:
+        db.session.rollback()
+        for table in layouts.values():
+            table.drop(db.engine, checkfirst=True)
+    print(f"metadata dictionary: {metadata_dictionary.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='readings written per layout')
+    args = parser.parse_args()
+
+    with create_bench_app().app_context():
+        sys.exit(run(args.rows))
@@ -14,3 +14,85 @@ class Config:
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=60)
     MQTT_BROKER = '127.0.0.1'
     MQTT_PORT = 1883
+    # 'shared' subscribes once on wildcard topics, 'per_device' keeps
+    # the legacy one-client-per-device behaviour.
+    MQTT_INGEST_MODE = os.getenv('MQTT_INGEST_MODE', 'shared')
+    MQTT_SUBSCRIBER_POOL_SIZE = int(os.getenv('MQTT_SUBSCRIBER_POOL_SIZE', 1))
+    MQTT_SHARED_GROUP = os.getenv('MQTT_SHARED_GROUP', 'autoswitch-ingest')
+    MQTT_USERNAME = os.getenv('MQTT_USERNAME')
+    MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
+    # Ingest writer: flush after MQTT_BATCH_SIZE rows or MQTT_FLUSH_INTERVAL
+    # milliseconds, whichever comes first
+    MQTT_BATCH_SIZE = int(os.getenv('MQTT_BATCH_SIZE', 100))
+    MQTT_FLUSH_INTERVAL = int(os.getenv('MQTT_FLUSH_INTERVAL', 1000))
+    MQTT_QUEUE_SIZE = int(os.getenv('MQTT_QUEUE_SIZE', 10000))
+    # Device/metric type snapshots used by ingest (TTL in seconds)
+    LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', 10000))
+    LOOKUP_CACHE_TTL = int(os.getenv('LOOKUP_CACHE_TTL', 300))
+    # Per-user cache of polled API responses (bytes, TTL in seconds)
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES',
+                                             16 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+    # Server-sent events: per-client buffer (events) and keepalive (s)
+    EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 1000))
+    EVENT_KEEPALIVE = float(os.getenv('EVENT_KEEPALIVE', 15.0))
+    # EventSource cannot send headers, so /api/events takes ?token=
+    JWT_QUERY_STRING_NAME = 'token'
+    # Retention tiers ('raw' or a stats interval : age or 'forever'),
+    # applied every RETENTION_INTERVAL seconds; batched deletes (no
+    # TimescaleDB) stop after RETENTION_MAX_SECONDS per tier. Retention
+    # deletes data, so it is off until RETENTION_ENABLED=true is set
+    RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'false').lower() \
+        in ('1', 'true', 'yes')
+    RETENTION_TIERS = os.getenv(
+        'RETENTION_TIERS',
+        'raw:30 days,1 minute:30 days,1 hour:365 days,1 day:forever')
+    RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 10000))
+    RETENTION_MAX_SECONDS = float(os.getenv('RETENTION_MAX_SECONDS', 60))
+    # Raw readings past retention are archived to compressed per
+    # device-day files under ARCHIVE_PATH before being deleted; set
+    # ARCHIVE_ENABLED=true alongside RETENTION_ENABLED to keep them
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'false').lower() \
+        in ('1', 'true', 'yes')
+    ARCHIVE_PATH = os.getenv('ARCHIVE_PATH', 'archive')
+    # Numeric metadata fields stored as readings of the metric type with
+    # the same name (e.g. 'battery_voltage,rssi'); the rest of the
+    # metadata is deduplicated into metadata_documents
+    METADATA_PROMOTED_FIELDS = [
+        field.strip() for field in
+        os.getenv('METADATA_PROMOTED_FIELDS', '').split(',')
+        if field.strip()]
+    # Metric storage: 'timescale', 'portable' (plain PostgreSQL, optionally
+    # partitioned by week, or SQLite) or 'auto' to detect a hypertable
+    METRIC_STORAGE_BACKEND = os.getenv('METRIC_STORAGE_BACKEND', 'auto')
+    # Bulk insert path: 'auto' uses COPY on PostgreSQL, 'insert' forces
+    # parameterised INSERTs; COPY format is 'text' or 'binary'
+    METRIC_INSERT_METHOD = os.getenv('METRIC_INSERT_METHOD', 'auto')
+    METRIC_COPY_FORMAT = os.getenv('METRIC_COPY_FORMAT', 'text')
+    # Overload control: policy is 'block', 'drop_oldest',
+    # 'drop_lowest_quality' or 'sample'; watermarks are fractions of
+    # MQTT_QUEUE_SIZE at which broker reads pause and resume
+    MQTT_OVERFLOW_POLICY = os.getenv('MQTT_OVERFLOW_POLICY', 'block')
+    MQTT_HIGH_WATERMARK = float(os.getenv('MQTT_HIGH_WATERMARK', 0.8))
+    MQTT_LOW_WATERMARK = float(os.getenv('MQTT_LOW_WATERMARK', 0.5))
+    MQTT_SAMPLE_EVERY = int(os.getenv('MQTT_SAMPLE_EVERY', 4))
+    MQTT_BLOCK_TIMEOUT = float(os.getenv('MQTT_BLOCK_TIMEOUT', 5.0))
+    # Duplicate suppression: keys of the last MQTT_DEDUP_WINDOW readings
+    # per device (for up to MQTT_DEDUP_DEVICES devices), 0 to disable
+    MQTT_DEDUP_WINDOW = int(os.getenv('MQTT_DEDUP_WINDOW', 512))
+    MQTT_DEDUP_DEVICES = int(os.getenv('MQTT_DEDUP_DEVICES', 10000))
+    # On-disk spool for batches written while the database is unavailable;
+    # rejected batches go to its quarantine/ subdirectory. Empty disables it
+    MQTT_SPOOL_DIR = os.getenv('MQTT_SPOOL_DIR', 'spool')
+    MQTT_SPOOL_NAME = os.getenv('MQTT_SPOOL_NAME', 'default')
+    MQTT_SPOOL_SEGMENT_BYTES = int(os.getenv('MQTT_SPOOL_SEGMENT_BYTES',
+                                             64 * 1024 * 1024))
+    MQTT_SPOOL_REPLAY_BATCH = int(os.getenv('MQTT_SPOOL_REPLAY_BATCH', 5000))
+    MQTT_SPOOL_REPLAY_INTERVAL = float(
+        os.getenv('MQTT_SPOOL_REPLAY_INTERVAL', 5.0))
+    # Number of sharded ingest worker processes run by
+    # services.ingest_supervisor; 0 ingests inside the API process
+    MQTT_INGEST_WORKERS = int(os.getenv('MQTT_INGEST_WORKERS', 0))
+    MQTT_WORKER_REPORT_INTERVAL = float(
+        os.getenv('MQTT_WORKER_REPORT_INTERVAL', 10.0))
@@ -0,0 +1,11 @@
+-- Per-device data watermark used for ETag/If-None-Match on the data and
+-- device routes. New databases get these columns from db.create_all();
+-- apply this to existing ones with:
+--     psql -d autoswitch -f migrations/001_device_data_version.sql
+BEGIN;
+
+ALTER TABLE devices
+    ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS data_updated_at TIMESTAMPTZ;
+
+COMMIT;
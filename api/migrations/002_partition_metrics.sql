@@ -0,0 +1,55 @@
+-- Plain PostgreSQL without TimescaleDB: turn metrics into a table
+-- partitioned by week so stats queries prune partitions and retention
+-- drops whole weeks (models/storage.py creates upcoming partitions).
+-- Do not apply this to a TimescaleDB hypertable. Apply with:
+--     psql -d autoswitch -f migrations/002_partition_metrics.sql
+BEGIN;
+
+ALTER TABLE metrics RENAME TO metrics_unpartitioned;
+ALTER INDEX idx_metrics_device_timestamp
+    RENAME TO idx_metrics_unpartitioned_device_timestamp;
+ALTER INDEX idx_metrics_type_timestamp
+    RENAME TO idx_metrics_unpartitioned_type_timestamp;
+-- Keep the id sequence when the old table is dropped
+ALTER SEQUENCE metrics_id_seq OWNED BY NONE;
+
+CREATE TABLE metrics (LIKE metrics_unpartitioned INCLUDING DEFAULTS)
+    PARTITION BY RANGE (timestamp);
+-- The partition key must be part of the primary key
+ALTER TABLE metrics ADD PRIMARY KEY (id, timestamp);
+ALTER TABLE metrics
+    ADD FOREIGN KEY (device_id) REFERENCES devices (id),
+    ADD FOREIGN KEY (metric_type_id) REFERENCES metric_types (id);
+CREATE INDEX idx_metrics_device_timestamp ON metrics (device_id, timestamp);
+CREATE INDEX idx_metrics_type_timestamp ON metrics (metric_type_id, timestamp);
+ALTER SEQUENCE metrics_id_seq OWNED BY metrics.id;
+
+-- Weekly partitions aligned like time_bucket (Monday 2000-01-03 origin)
+-- covering existing rows and the next two weeks
+DO $$
+DECLARE
+    origin CONSTANT timestamptz := '2000-01-03 00:00:00+00';
+    week timestamptz;
+    last_week timestamptz;
+BEGIN
+    SELECT origin + floor(extract(epoch FROM
+                (coalesce(min(timestamp), now()) - origin)) / 604800)
+                * interval '1 week'
+      INTO week FROM metrics_unpartitioned;
+    last_week := greatest(
+        (SELECT max(timestamp) FROM metrics_unpartitioned), now())
+        + interval '2 weeks';
+    WHILE week < last_week LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF metrics FOR VALUES FROM (%L) TO (%L)',
+            'metrics_p' || to_char(week AT TIME ZONE 'UTC', 'YYYYMMDD'),
+            week, week + interval '1 week');
+        week := week + interval '1 week';
+    END LOOP;
+END $$;
+CREATE TABLE metrics_default PARTITION OF metrics DEFAULT;
+
+INSERT INTO metrics SELECT * FROM metrics_unpartitioned;
+DROP TABLE metrics_unpartitioned;
+
+COMMIT;
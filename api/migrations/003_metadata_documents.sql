@@ -0,0 +1,36 @@
+-- Replace the metric_metadata document stored on every reading with a
+-- reference to a deduplicated metadata_documents row. Apply with:
+--     psql -d autoswitch -f migrations/003_metadata_documents.sql
+-- On TimescaleDB, decompress compressed chunks first: the backfill
+-- updates existing rows.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS metadata_documents (
+    id BIGSERIAL PRIMARY KEY,
+    digest VARCHAR(40) NOT NULL UNIQUE,
+    document JSONB NOT NULL
+);
+
+ALTER TABLE metrics
+    ADD COLUMN IF NOT EXISTS metadata_id BIGINT
+        REFERENCES metadata_documents (id);
+
+-- Existing documents are keyed by md5 of their jsonb text. New ones get
+-- the SHA-1 of canonical JSON computed by the API, so a document may
+-- appear twice: once from the backfill and once from new ingest.
+INSERT INTO metadata_documents (digest, document)
+SELECT DISTINCT 'pg:' || md5(metric_metadata::text), metric_metadata
+  FROM metrics
+ WHERE metric_metadata IS NOT NULL AND metric_metadata <> '{}'::jsonb
+ON CONFLICT (digest) DO NOTHING;
+
+UPDATE metrics m
+   SET metadata_id = d.id
+  FROM metadata_documents d
+ WHERE m.metric_metadata IS NOT NULL
+   AND m.metric_metadata <> '{}'::jsonb
+   AND d.digest = 'pg:' || md5(m.metric_metadata::text);
+
+ALTER TABLE metrics DROP COLUMN metric_metadata;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Enforce one reading per (device_id, metric_type_id, timestamp) so
+-- redelivered MQTT messages are skipped by ON CONFLICT DO NOTHING.
+-- Existing duplicates are removed first, keeping the oldest row. Apply
+-- with:
+--     psql -d autoswitch -f migrations/004_metrics_natural_key.sql
+-- On TimescaleDB, decompress compressed chunks first.
+BEGIN;
+
+DELETE FROM metrics newer
+ USING metrics older
+ WHERE newer.device_id = older.device_id
+   AND newer.metric_type_id = older.metric_type_id
+   AND newer.timestamp = older.timestamp
+   AND newer.id > older.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_metrics_natural_key
+    ON metrics (device_id, metric_type_id, timestamp);
+
+COMMIT;
@@ -0,0 +1,152 @@
+"""
+    Registry of continuous aggregate views over the metrics hypertable
+"""
+from __future__ import annotations
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import DateTime, Float, Integer, column, table, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import TableClause
+from models import db
+
+
+INTERVAL_PATTERN = re.compile(
+    r'^\s*(\d+)\s*(second|minute|hour|day|week)s?\s*$', re.IGNORECASE)
+
+# time_bucket aligns sub-month buckets to this origin (a Monday)
+BUCKET_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+
+def parse_interval(interval: str) -> Optional[timedelta]:
+    """Parse a fixed-length interval such as '15 minutes' or '1 day'"""
+    match = INTERVAL_PATTERN.match(interval)
+    if not match:
+        return None  # months/years have no fixed length
+    count, unit = int(match.group(1)), match.group(2).lower()
+    return timedelta(**{f"{unit}s": count})
+
+
+def align_down(moment: datetime, bucket: timedelta) -> datetime:
+    """Start of the bucket containing ``moment``"""
+    return moment - (moment - BUCKET_ORIGIN) % bucket
+
+
+def align_up(moment: datetime, bucket: timedelta) -> datetime:
+    """First bucket boundary at or after ``moment``"""
+    floor = align_down(moment, bucket)
+    return floor if floor == moment else floor + bucket
+
+
+@dataclass(frozen=True)
+class AggregateView:
+    """A continuous aggregate holding sum/min/max/count per bucket"""
+    name: str
+    interval: str
+
+    @property
+    def bucket(self) -> timedelta:
+        return parse_interval(self.interval)
+
+    @property
+    def table(self) -> TableClause:
+        return table(self.name,
+                     column('bucket', DateTime(timezone=True)),
+                     column('device_id', Integer),
+                     column('metric_type_id', Integer),
+                     column('sum_value', Float),
+                     column('min_value', Float),
+                     column('max_value', Float),
+                     column('sample_count', Integer))
+
+
+STATS_VIEWS = (
+    AggregateView('metrics_stats_1m', '1 minute'),
+    AggregateView('metrics_stats_1h', '1 hour'),
+    AggregateView('metrics_stats_1d', '1 day'),
+)
+
+# Buckets behind now that the refresh policy re-materializes; older
+# readings only reach an aggregate through an explicit refresh
+REFRESH_BUCKETS = 3
+
+
+class AggregateRegistry:
+    """Aggregate views known to exist, and routing of stats queries"""
+
+    def __init__(self):
+        self._views: Dict[str, AggregateView] = {}
+        self._lock = threading.Lock()
+
+    def register(self, view: AggregateView) -> None:
+        with self._lock:
+            self._views[view.name] = view
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._views.pop(name, None)
+
+    def views(self) -> List[AggregateView]:
+        """Registered views, finest bucket first"""
+        with self._lock:
+            return sorted(self._views.values(), key=lambda v: v.bucket)
+
+    def discover(self) -> List[AggregateView]:
+        """Register the STATS_VIEWS that exist in the database"""
+        try:
+            existing = {row[0] for row in db.session.execute(text(
+                "SELECT view_name FROM "
+                "timescaledb_information.continuous_aggregates"))}
+        except SQLAlchemyError:
+            db.session.rollback()
+            existing = set()  # no TimescaleDB: always read raw rows
+
+        with self._lock:
+            self._views = {view.name: view for view in STATS_VIEWS
+                           if view.name in existing}
+        return self.views()
+
+    def route(self, interval: timedelta) -> Optional[AggregateView]:
+        """
+        Pick the coarsest view whose buckets tile ``interval`` exactly
+
+        Returns:
+            The view to read from, or None to read raw rows
+        """
+        for view in reversed(self.views()):
+            if view.bucket <= interval and interval % view.bucket \
+               == timedelta(0):
+                return view
+        return None
+
+
+aggregate_registry = AggregateRegistry()
+
+
+def is_hypertable(relation: str) -> bool:
+    """Whether drop_chunks can be used on ``relation``"""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    try:
+        return db.session.execute(text("""
+            SELECT 1 FROM timescaledb_information.hypertables
+            WHERE hypertable_name = :name
+            UNION ALL
+            SELECT 1 FROM timescaledb_information.continuous_aggregates
+            WHERE view_name = :name
+        """), {'name': relation}).first() is not None
+    except SQLAlchemyError:
+        db.session.rollback()
+        return False
+
+
+def drop_chunks(relation: str, older_than: datetime) -> Dict[str, Any]:
+    """Drop whole chunks of a hypertable or continuous aggregate"""
+    dropped = db.session.execute(
+        text("SELECT drop_chunks(CAST(:relation AS regclass), "
+             "older_than => :older_than)"),
+        {'relation': relation, 'older_than': older_than}).fetchall()
+    db.session.commit()
+    return {'method': 'drop_chunks', 'chunks_dropped': len(dropped)}
@@ -0,0 +1,244 @@
+"""
+    Columnar cold storage of metrics older than the retention window
+
+Each archived device-day is one compressed NumPy file holding, per metric
+type, the readings' epoch-second timestamps, values and qualities in time
+order (metric_metadata is not archived). archive_segments indexes the
+files by device, metric type and day with the time range, row count and
+value range of each series, so reads open only the files they need.
+"""
+from __future__ import annotations
+import os
+import shutil
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import mapped_column, Mapped
+from models import db
+from models.aggregates import BUCKET_ORIGIN
+
+
+ARCHIVE_DAY = timedelta(days=1)
+
+Series = Tuple[np.ndarray, np.ndarray, np.ndarray]
+BucketStats = Dict[datetime, Tuple[float, float, float, int]]
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def _aware(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+class ArchiveSegment(db.Model):
+    """
+    Index entry of one archived series for one device-day.
+    ------------------------------------------------------
+    Attributes:
+        device_id: Device the readings belong to
+        metric_type_id: Metric type of the readings
+        day: UTC day covered by the file
+        path: File path relative to ARCHIVE_PATH
+        row_count: Readings of this series in the file
+        start_time: Oldest reading
+        end_time: Newest reading
+        min_value: Smallest value
+        max_value: Largest value
+    """
+    __tablename__ = 'archive_segments'
+
+    device_id: Mapped[int] = mapped_column(
+        db.Integer, db.ForeignKey('devices.id', ondelete='CASCADE'),
+        primary_key=True)
+    metric_type_id: Mapped[int] = mapped_column(
+        db.Integer, db.ForeignKey('metric_types.id'), primary_key=True)
+    day: Mapped[date] = mapped_column(db.Date, primary_key=True)
+    path: Mapped[str] = mapped_column(db.String(255), nullable=False)
+    row_count: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    start_time: Mapped[datetime] = mapped_column(db.DateTime(timezone=True),
+                                                 nullable=False)
+    end_time: Mapped[datetime] = mapped_column(db.DateTime(timezone=True),
+                                               nullable=False)
+    min_value: Mapped[float] = mapped_column(db.Float, nullable=False)
+    max_value: Mapped[float] = mapped_column(db.Float, nullable=False)
+
+    @staticmethod
+    def root() -> str:
+        """Directory holding the archive files"""
+        return current_app.config['ARCHIVE_PATH']
+
+    @classmethod
+    def archived_days(cls, device_ids: Iterable[int])\
+            -> Set[Tuple[int, date]]:
+        """(device_id, day) pairs that already have an archive file"""
+        device_ids = list(device_ids)
+        if not device_ids:
+            return set()
+        return set(db.session.execute(
+            select(cls.device_id, cls.day).distinct()
+            .where(cls.device_id.in_(device_ids))).all())
+
+    @classmethod
+    def remove_files(cls, device_id: int) -> None:
+        """Delete the archive files of a deleted device"""
+        shutil.rmtree(os.path.join(cls.root(), str(device_id)),
+                      ignore_errors=True)
+
+    @classmethod
+    def boundary(cls, device_id: int) -> Optional[datetime]:
+        """
+        End of the newest archived day of a device
+
+        Readings before it are served from the archive only; raw rows in
+        that range are removed by retention after being archived.
+        """
+        newest = db.session.query(func.max(cls.day))\
+            .filter(cls.device_id == device_id).scalar()
+        return _day_start(newest) + ARCHIVE_DAY if newest else None
+
+    @classmethod
+    def write_day(cls, device_id: int, day: date,
+                  rows: Sequence) -> int:
+        """
+        Archive one device-day and index it
+
+        Args:
+            device_id: Device the readings belong to
+            day: UTC day of the readings
+            rows: (metric_type_id, timestamp, value, quality) rows ordered
+                by metric type and timestamp
+
+        Returns:
+            Number of readings archived
+        """
+        if not rows:
+            return 0
+        type_ids = np.fromiter((r[0] for r in rows), dtype=np.int64,
+                               count=len(rows))
+        times = np.fromiter((_aware(r[1]).timestamp() for r in rows),
+                            dtype=np.float64, count=len(rows))
+        values = np.fromiter((r[2] for r in rows), dtype=np.float64,
+                             count=len(rows))
+        qualities = np.fromiter((1.0 if r[3] is None else r[3]
+                                 for r in rows),
+                                dtype=np.float64, count=len(rows))
+
+        path = os.path.join(str(device_id), f"{day.isoformat()}.npz")
+        arrays: Dict[str, np.ndarray] = {}
+        segments = []
+        # rows are grouped by metric type, so each type is one slice
+        starts = np.flatnonzero(np.r_[True, type_ids[1:] != type_ids[:-1]])
+        for begin, end in zip(starts, np.r_[starts[1:], len(rows)]):
+            type_id = int(type_ids[begin])
+            arrays[f"{type_id}_timestamp"] = times[begin:end]
+            arrays[f"{type_id}_value"] = values[begin:end]
+            arrays[f"{type_id}_quality"] = qualities[begin:end]
+            segments.append(cls(
+                device_id=device_id, metric_type_id=type_id, day=day,
+                path=path, row_count=int(end - begin),
+                start_time=datetime.fromtimestamp(times[begin],
+                                                  timezone.utc),
+                end_time=datetime.fromtimestamp(times[end - 1],
+                                                timezone.utc),
+                min_value=float(values[begin:end].min()),
+                max_value=float(values[begin:end].max())))
+
+        target = os.path.join(cls.root(), path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        partial = f"{target}.partial"
+        with open(partial, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(partial, target)
+
+        for segment in segments:
+            db.session.merge(segment)
+        db.session.commit()
+        return len(rows)
+
+    @classmethod
+    def read(cls, device_id: int, metric_type_ids: Optional[List[int]],
+             start_time: Optional[datetime],
+             end_time: Optional[datetime]) -> Dict[int, Series]:
+        """
+        Load archived readings in [start_time, end_time)
+
+        Args:
+            device_id: Device to read
+            metric_type_ids: Metric types to read, None for all
+            start_time: Inclusive start, None for unbounded
+            end_time: Exclusive end, None for unbounded
+
+        Returns:
+            (timestamps, values, qualities) arrays in time order per
+            metric type id
+        """
+        query = cls.query.filter(cls.device_id == device_id)
+        if metric_type_ids is not None:
+            query = query.filter(cls.metric_type_id.in_(metric_type_ids))
+        if start_time is not None:
+            query = query.filter(cls.end_time >= start_time)
+        if end_time is not None:
+            query = query.filter(cls.start_time < end_time)
+        segments = query.order_by(cls.metric_type_id, cls.day).all()
+
+        low = start_time.timestamp() if start_time else -np.inf
+        high = end_time.timestamp() if end_time else np.inf
+        parts: Dict[int, List[Series]] = {}
+        files: Dict[str, np.lib.npyio.NpzFile] = {}
+        try:
+            for segment in segments:
+                if segment.path not in files:
+                    files[segment.path] = np.load(
+                        os.path.join(cls.root(), segment.path))
+                data = files[segment.path]
+                prefix = segment.metric_type_id
+                times = data[f"{prefix}_timestamp"]
+                keep = (times >= low) & (times < high)
+                parts.setdefault(segment.metric_type_id, []).append((
+                    times[keep], data[f"{prefix}_value"][keep],
+                    data[f"{prefix}_quality"][keep]))
+        finally:
+            for data in files.values():
+                data.close()
+
+        return {type_id: tuple(np.concatenate(column)
+                               for column in zip(*series))
+                for type_id, series in parts.items()}
+
+
+def bucket_stats(times: np.ndarray, values: np.ndarray,
+                 bucket: timedelta) -> BucketStats:
+    """
+    Sum, min, max and count per time bucket, aligned like time_bucket
+
+    Args:
+        times: Epoch seconds in ascending order
+        values: Values of the readings
+        bucket: Bucket width
+
+    Returns:
+        Mapping of bucket start to (sum, min, max, count)
+    """
+    if not len(times):
+        return {}
+    origin = BUCKET_ORIGIN.timestamp()
+    width = bucket.total_seconds()
+    index = np.floor((times - origin) / width).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    counts = np.diff(np.r_[starts, len(index)])
+    sums = np.add.reduceat(values, starts)
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    return {
+        datetime.fromtimestamp(origin + int(index[i]) * width,
+                               timezone.utc):
+            (float(s), float(lo), float(hi), int(n))
+        for i, s, lo, hi, n in zip(starts, sums, mins, maxs, counts)
+    }
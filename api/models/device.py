@@ -4,14 +4,18 @@
 from __future__ import annotations
 from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import List, Dict, Optional
-from sqlalchemy import event, text
+from typing import Any, Iterable, List, Dict, Optional, Union
+from sqlalchemy import (bindparam, case, event, func, or_, select, text,
+                        update)
 from sqlalchemy.orm import (mapped_column, relationship,
                             validates, Mapped, query)
-from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.hybrid import hybrid_property
 from models import db
+from models.storage import JSONDocument, UTCDateTime
+from models.archive import ArchiveSegment
+from models.latest_metric import LatestMetric, latest_values
 from models.metric import Metric
+from models.status_tracker import StatusTracker
 from typing import TYPE_CHECKING
 
 
@@ -40,6 +44,8 @@ class Device(db.Model):
             last_seen: Last time device was active
             device_metadata: Additional device information
             configuration: Device-specific settings
+            data_version: Watermark bumped with every batch of readings
+            data_updated_at: Commit time of the newest batch of readings
             metrics: Associated metrics
     """
     __tablename__ = 'devices'
@@ -52,14 +58,20 @@ class Device(db.Model):
     status: Mapped[str] = mapped_column(db.String(20),
                                         default=DeviceStatus.UNKNOWN)
     last_seen: Mapped[datetime] = mapped_column(
-        db.DateTime(timezone=True),
+        UTCDateTime,
         default=lambda: datetime.now(timezone.utc))
-    device_metadata: Mapped[Dict] = mapped_column(JSONB, default_factory=dict)
+    device_metadata: Mapped[Dict] = mapped_column(JSONDocument,
+                                                  default_factory=dict)
     configuration: Mapped[Dict] = mapped_column(
-    JSONB, 
+    JSONDocument, 
     default_factory=dict,
     nullable=False
     )
+    data_version: Mapped[int] = mapped_column(db.BigInteger, default=0,
+                                              server_default=text('0'),
+                                              nullable=False)
+    data_updated_at: Mapped[Optional[datetime]] = mapped_column(
+        db.DateTime(timezone=True), default=None)
 
 
     # Relationships
@@ -75,6 +87,8 @@ class Device(db.Model):
     # Validation thresholds
     INACTIVITY_THRESHOLD = timedelta(minutes=30)
     CHANGE_THRESHOLD = 0.1
+    # Smallest last_seen movement worth writing back from ingest
+    LAST_SEEN_RESOLUTION = timedelta(minutes=1)
 
 
     def __init__(self, device_key: str, user: "User",
@@ -156,7 +170,8 @@ class Device(db.Model):
             metrics.append(metric)
 
         db.session.bulk_save_objects(metrics)
-        self._update_status(metrics[-1])  # Update based on latest metric
+        for metric in metrics:
+            self._update_status(metric)
         self.last_seen = metrics[-1].timestamp
         db.session.commit()
         return metrics
@@ -165,7 +180,9 @@ class Device(db.Model):
                     metric_type_id: Optional[int] = None,
                     start_time: Optional[datetime] = None,
                     end_time: Optional[datetime] = None,
-                    limit: Optional[int] = None) -> query.Query:
+                    limit: Optional[int] = None,
+                    include_archive: bool = False)\
+            -> Union[query.Query, List[Dict[str, Any]]]:
         """
         Get device metrics with optional filtering
 
@@ -174,9 +191,13 @@ class Device(db.Model):
             start_time: Start of time range
             end_time: End of time range
             limit: Maximum number of results
+            include_archive: Also return archived readings when the range
+                reaches back past the archive boundary
 
         Returns:
-            Query object for metrics
+            Query object for metrics, or metric dictionaries (newest
+            first) merged with archived readings when include_archive is
+            set and the range needs them
         """
         query = self.metrics
 
@@ -191,10 +212,44 @@ class Device(db.Model):
 
         query = query.order_by(Metric.timestamp.desc())
 
-        if limit is not None:
-            query = query.limit(limit)
+        boundary = ArchiveSegment.boundary(self.id) \
+            if include_archive else None
+        if boundary is None or (start_time is not None and
+                                start_time >= boundary):
+            return query.limit(limit) if limit is not None else query
 
-        return query
+        # Raw rows before the boundary are gone; read those from files
+        live = query.filter(Metric.timestamp >= boundary)
+        if limit is not None:
+            live = live.limit(limit)
+        metrics = [metric.to_dict() for metric in live]
+        if limit is not None and len(metrics) >= limit:
+            return metrics
+
+        archive_end = boundary if end_time is None else \
+            min(end_time + timedelta(microseconds=1), boundary)
+        series = ArchiveSegment.read(
+            self.id, None if metric_type_id is None else [metric_type_id],
+            start_time, archive_end)
+        archived = [
+            (ts, type_id, value, quality)
+            for type_id, (times, values, qualities) in series.items()
+            for ts, value, quality in zip(times.tolist(), values.tolist(),
+                                          qualities.tolist())]
+        archived.sort(reverse=True)
+        if limit is not None:
+            archived = archived[:limit - len(metrics)]
+        metrics.extend({
+            'id': None,
+            'device_id': self.id,
+            'metric_type_id': type_id,
+            'timestamp': datetime.fromtimestamp(
+                ts, timezone.utc).isoformat(),
+            'value': value,
+            'metric_metadata': {},
+            'quality': quality
+        } for ts, type_id, value, quality in archived)
+        return metrics
 
     def get_metric_statistics(self,
                               metric_type_id: int,
@@ -224,22 +279,182 @@ class Device(db.Model):
         )
 
     def _update_status(self, latest_metric: Metric) -> None:
-        """Update device status based on recent metrics"""
-        recent_metrics = self.get_metrics(
-            metric_type_id=latest_metric.metric_type_id,
-            start_time=datetime.now(timezone.utc) - self.INACTIVITY_THRESHOLD
-        ).all()
-
-        if len(recent_metrics) > 1:
-            first_value = recent_metrics[0].value
-            last_value = recent_metrics[-1].value
-            avg_change = abs((last_value - first_value)
-                             / first_value)
-
-            if avg_change >= self.CHANGE_THRESHOLD:
-                self.status = DeviceStatus.OFF
-            else:
-                self.status = DeviceStatus.ON
+        """Update device status from the rolling window of recent metrics"""
+        status = self._status_for_change(status_tracker.observe(
+            self.id, latest_metric.metric_type_id,
+            latest_metric.timestamp, latest_metric.value))
+
+        if status is not None and self.status != status:
+            self.status = status
+
+    @classmethod
+    def _status_for_change(cls,
+                           change: Optional[float]) -> Optional[DeviceStatus]:
+        """Map the relative change across the window to a status"""
+        if change is None:
+            return None
+        if change >= cls.CHANGE_THRESHOLD:
+            return DeviceStatus.OFF
+        return DeviceStatus.ON
+
+    @classmethod
+    def record_readings(cls,
+                        rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Update status and last_seen for metric rows written in bulk
+
+        Status is derived in constant time per reading and device rows
+        are only written when status changes or last_seen has moved by
+        at least LAST_SEEN_RESOLUTION. last_seen never moves backwards,
+        so late or replayed readings cannot make a device look stale.
+
+        Args:
+            rows: Metric mappings that were just inserted
+
+        Returns:
+            Mappings written to device rows: id, last_seen and status
+            when it was derived from these readings
+        """
+        latest: Dict[int, Dict[str, Any]] = {}
+        for row in rows:
+            device_id = row['device_id']
+            state = latest.setdefault(device_id, {'id': device_id,
+                                                  'last_seen': None})
+            status = cls._status_for_change(status_tracker.observe(
+                device_id, row['metric_type_id'],
+                row['timestamp'], row['value']))
+            if status is not None:
+                state['status'] = status
+            if state['last_seen'] is None or \
+               row['timestamp'] > state['last_seen']:
+                state['last_seen'] = row['timestamp']
+
+        updates = [
+            state for state in latest.values()
+            if status_tracker.needs_write(state['id'], state.get('status'),
+                                          state['last_seen'],
+                                          cls.LAST_SEEN_RESOLUTION)
+        ]
+        if not updates:
+            return []
+
+        table = cls.__table__
+        seen = bindparam('seen', type_=table.c.last_seen.type)
+        statement = update(table).where(table.c.id == bindparam('device'))
+        newest = case((or_(table.c.last_seen.is_(None),
+                           table.c.last_seen < seen), seen),
+                      else_=table.c.last_seen)
+        with_status = [{'device': state['id'], 'seen': state['last_seen'],
+                        'new_status': state['status']}
+                       for state in updates if 'status' in state]
+        seen_only = [{'device': state['id'], 'seen': state['last_seen']}
+                     for state in updates if 'status' not in state]
+        if with_status:
+            db.session.execute(statement.values(
+                last_seen=newest, status=bindparam('new_status')),
+                with_status)
+        if seen_only:
+            db.session.execute(statement.values(last_seen=newest),
+                               seen_only)
+        db.session.commit()
+        for state in updates:
+            status_tracker.mark_written(state['id'], state.get('status'),
+                                        state['last_seen'])
+        return updates
+
+    @classmethod
+    def bump_data_versions(cls, device_ids: Iterable[int]) -> None:
+        """
+        Advance the data watermark of devices that received readings
+
+        Runs in the caller's transaction so the watermark only moves
+        when the readings themselves are committed.
+
+        Args:
+            device_ids: Devices whose readings are being written
+        """
+        device_ids = sorted(set(device_ids))
+        if not device_ids:
+            return
+        db.session.execute(
+            update(cls).where(cls.id.in_(device_ids)).values(
+                data_version=cls.data_version + 1,
+                data_updated_at=datetime.now(timezone.utc)),
+            execution_options={'synchronize_session': False})
+
+    @classmethod
+    def rebuild_status_tracker(cls) -> None:
+        """Reload the status window and written device state from the DB"""
+        since = datetime.now(timezone.utc) - cls.INACTIVITY_THRESHOLD
+        readings = db.session.query(
+            Metric.device_id, Metric.metric_type_id,
+            Metric.timestamp, Metric.value
+        ).filter(
+            Metric.timestamp >= since
+        ).order_by(Metric.timestamp).yield_per(10000)
+        devices = db.session.query(cls.id, cls.status, cls.last_seen)
+        status_tracker.rebuild(readings, devices)
+
+    @classmethod
+    def fleet_summary(cls, user_id: int,
+                      window: timedelta = timedelta(hours=24)) -> List[Dict]:
+        """
+        Summarise every device of a user in a fixed number of queries
+
+        One query loads the devices, one the latest readings (none when
+        the last-value mirror is live) and one grouped query, routed to
+        the hourly aggregate where possible, the min/max of ``window``.
+
+        Args:
+            user_id: Owner of the devices
+            window: Period covered by the min/max/count figures
+
+        Returns:
+            Device dictionaries with latest readings and window stats
+        """
+        devices = cls.query.filter_by(user_id=user_id)\
+            .order_by(cls.id).all()
+        latest = LatestMetric.for_devices([d.id for d in devices])
+
+        # Readings in the window always updated the last-value store,
+        # so it names every (device, metric type) pair worth querying
+        window_stats: Dict[tuple, Any] = {}
+        end = datetime.now(timezone.utc)
+        device_ids = sorted({r['device_id'] for r in latest
+                             if datetime.fromisoformat(r['timestamp'])
+                             >= end - window})
+        if device_ids:
+            buckets = Metric.stats_select(
+                device_ids, sorted({r['metric_type_id'] for r in latest}),
+                end - window, end, '1 hour').subquery()
+            rows = db.session.execute(select(
+                buckets.c.device_id, buckets.c.metric_type_id,
+                func.min(buckets.c.min_value).label('min_value'),
+                func.max(buckets.c.max_value).label('max_value'),
+                func.sum(buckets.c.sample_count).label('sample_count')
+            ).group_by(buckets.c.device_id, buckets.c.metric_type_id))
+            window_stats = {(r.device_id, r.metric_type_id): r
+                            for r in rows}
+
+        by_device: Dict[int, List[Dict]] = {}
+        for reading in latest:
+            by_device.setdefault(reading['device_id'], []).append(reading)
+            stats = window_stats.get((reading['device_id'],
+                                      reading['metric_type_id']))
+            reading['window'] = {
+                'min': float(stats.min_value) if stats else None,
+                'max': float(stats.max_value) if stats else None,
+                'count': int(stats.sample_count) if stats else 0
+            }
+
+        return [{
+            'id': device.id,
+            'device_key': device.device_key,
+            'status': device.status,
+            'last_seen': device.last_seen.isoformat(),
+            'is_active': device.is_active,
+            'latest_metrics': by_device.get(device.id, [])
+        } for device in devices]
 
     @staticmethod
     def _get_default_configuration() -> Dict:
@@ -264,12 +479,28 @@ class Device(db.Model):
                 setattr(self, field, value)
         db.session.commit()
 
-    def to_dict(self, include_metrics: bool = False) -> Dict:
+    def delete(self) -> None:
+        """Delete the device and its metrics"""
+        db.session.delete(self)
+        db.session.commit()
+        status_tracker.forget(self.id)
+        latest_values.forget(self.id)
+        ArchiveSegment.remove_files(self.id)
+
+    def to_dict(self, include_metrics: bool = False,
+                latest_metrics: Optional[List[Dict]] = None,
+                recent_metrics: Optional[List[Metric]] = None) -> Dict:
         """
         Convert device to dictionary
 
         Args:
-            include_metrics: Whether to include recent metrics
+            include_metrics: Whether to include the latest reading of
+                each metric type (latest_metrics) and the ten newest
+                readings (recent_metrics)
+            latest_metrics: Latest readings already fetched for a whole
+                fleet with LatestMetric.for_devices
+            recent_metrics: Newest readings already fetched for a whole
+                fleet with Metric.recent_for_devices
 
         Returns:
             Dictionary representation of device
@@ -286,14 +517,25 @@ class Device(db.Model):
         }
 
         if include_metrics:
+            if latest_metrics is None:
+                latest_metrics = LatestMetric.for_devices([self.id])
+            device_dict['latest_metrics'] = [
+                latest for latest in latest_metrics
+                if latest['device_id'] == self.id
+            ]
+            if recent_metrics is None:
+                recent_metrics = Metric.recent_for_devices([self.id])
             device_dict['recent_metrics'] = [
-                metric.to_dict() for metric in
-                self.get_metrics(limit=10)
+                metric.to_dict() for metric in recent_metrics
+                if metric.device_id == self.id
             ]
 
         return device_dict
 
 
+status_tracker = StatusTracker(window=Device.INACTIVITY_THRESHOLD)
+
+
 # Event listeners
 @event.listens_for(Device, 'before_delete')
 def cleanup_device_data(mapper, connection, target):
@@ -303,3 +545,11 @@ def cleanup_device_data(mapper, connection, target):
         text("DELETE FROM metrics WHERE device_id = :device_id"),
         {"device_id": target.id}
     )
+    connection.execute(
+        text("DELETE FROM latest_metrics WHERE device_id = :device_id"),
+        {"device_id": target.id}
+    )
+    connection.execute(
+        text("DELETE FROM archive_segments WHERE device_id = :device_id"),
+        {"device_id": target.id}
+    )
@@ -0,0 +1,107 @@
+"""
+    Chart-sized downsampling of streamed metric series
+
+Series arrive as (timestamps, values) NumPy chunks in time order, with
+timestamps in epoch seconds. The range is cut into equal time buckets so
+that only the bucket being decided and the one after it are held in
+memory, and gaps such as outages stay visible as gaps.
+"""
+from __future__ import annotations
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+
+Chunk = Tuple[np.ndarray, np.ndarray]
+Point = Tuple[float, float]
+
+
+def iter_buckets(chunks: Iterable[Chunk], start: float, end: float,
+                 count: int) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Group chunks into ``count`` equal time buckets over [start, end)
+
+    Only non-empty buckets are yielded, once the stream has moved past them.
+    """
+    width = (end - start) / count
+    current = -1
+    times: List[np.ndarray] = []
+    values: List[np.ndarray] = []
+    for ts, vs in chunks:
+        if not len(ts):
+            continue
+        index = np.clip(((ts - start) // width).astype(np.int64),
+                        0, count - 1)
+        # Positions where the bucket index changes inside this chunk
+        cuts = np.flatnonzero(np.diff(index)) + 1
+        for lo, hi in zip(np.r_[0, cuts], np.r_[cuts, len(ts)]):
+            bucket = int(index[lo])
+            if bucket != current and times:
+                yield current, np.concatenate(times), np.concatenate(values)
+                times, values = [], []
+            current = bucket
+            times.append(ts[lo:hi])
+            values.append(vs[lo:hi])
+    if times:
+        yield current, np.concatenate(times), np.concatenate(values)
+
+
+def lttb(chunks: Iterable[Chunk], start: float, end: float,
+         points: int) -> List[Point]:
+    """
+    Largest-Triangle-Three-Buckets over a streamed series
+
+    Keeps the first and last points plus one point per bucket, chosen to
+    maximise the triangle it forms with the previously kept point and the
+    mean of the next bucket. Returns at most ``points`` points.
+    """
+    if points < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    selected: List[Point] = []
+    pending = None
+    last: Point = None
+    for _, ts, vs in iter_buckets(chunks, start, end, points - 2):
+        if not selected:
+            selected.append((float(ts[0]), float(vs[0])))
+            ts, vs = ts[1:], vs[1:]
+            if not len(ts):
+                continue
+        last = (float(ts[-1]), float(vs[-1]))
+        if pending is not None:
+            selected.append(_largest_triangle(
+                selected[-1], pending, (ts.mean(), vs.mean())))
+        pending = (ts, vs)
+
+    if pending is not None:
+        ts, vs = pending
+        if len(ts) > 1:
+            # The final point is kept anyway, so it anchors the last bucket
+            selected.append(_largest_triangle(
+                selected[-1], (ts[:-1], vs[:-1]), last))
+        selected.append(last)
+    return selected
+
+
+def _largest_triangle(a: Point, bucket: Chunk, c: Point) -> Point:
+    ts, vs = bucket
+    area = np.abs((a[0] - c[0]) * (vs - a[1]) - (a[0] - ts) * (c[1] - a[1]))
+    i = int(np.argmax(area))
+    return float(ts[i]), float(vs[i])
+
+
+def min_max(chunks: Iterable[Chunk], start: float, end: float,
+            points: int) -> List[Point]:
+    """
+    Keep the minimum and maximum of every bucket, in time order
+
+    Uses ``points // 2`` buckets so at most ``points`` points are returned.
+    """
+    if points < 2:
+        raise ValueError("min/max needs at least 2 points")
+    selected: List[Point] = []
+    for _, ts, vs in iter_buckets(chunks, start, end, points // 2):
+        lo, hi = int(np.argmin(vs)), int(np.argmax(vs))
+        for i in sorted({lo, hi}):
+            selected.append((float(ts[i]), float(vs[i])))
+    return selected
+
+
+METHODS = {'lttb': lttb, 'minmax': min_max}
@@ -0,0 +1,195 @@
+"""
+    Module for the last-value store of every device and metric type
+"""
+from __future__ import annotations
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import mapped_column, Mapped
+from models import db
+from models.metric import MetricType
+from models.storage import UTCDateTime
+
+
+class LatestMetric(db.Model):
+    """
+    Latest reading per (device, metric type).
+    -----------------------------------------
+    Upserted by the ingest writer in the same transaction as the readings,
+    so "current value" lookups never have to sort the metrics hypertable.
+
+    Attributes:
+        device_id: Device the reading belongs to
+        metric_type_id: Metric type of the reading
+        timestamp: Time of the newest reading seen
+        value: Value of that reading
+        quality: Quality of that reading
+    """
+    __tablename__ = 'latest_metrics'
+
+    device_id: Mapped[int] = mapped_column(
+        db.Integer, db.ForeignKey('devices.id', ondelete='CASCADE'),
+        primary_key=True)
+    metric_type_id: Mapped[int] = mapped_column(
+        db.Integer, db.ForeignKey('metric_types.id'), primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
+    value: Mapped[float] = mapped_column(db.Float, nullable=False)
+    quality: Mapped[float] = mapped_column(db.Float, default=1.0)
+
+    @staticmethod
+    def newest(rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[int, int],
+                                                       Dict[str, Any]]:
+        """Reduce metric rows to the newest one per (device, metric type)"""
+        newest: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for row in rows:
+            key = (row['device_id'], row['metric_type_id'])
+            current = newest.get(key)
+            if current is None or row['timestamp'] > current['timestamp']:
+                newest[key] = row
+        return newest
+
+    @classmethod
+    def upsert(cls, rows: List[Dict[str, Any]],
+               commit: bool = True) -> List[Dict[str, Any]]:
+        """
+        Record the newest reading of each (device, metric type) in rows
+
+        Older readings (e.g. replayed from the spool) never overwrite a
+        newer stored value.
+
+        Args:
+            rows: Metric mappings that are being inserted
+            commit: Commit the session, False to leave the transaction
+                open for the caller
+
+        Returns:
+            The mappings that were offered to the table
+        """
+        values = [{
+            'device_id': row['device_id'],
+            'metric_type_id': row['metric_type_id'],
+            'timestamp': row['timestamp'],
+            'value': row['value'],
+            'quality': row.get('quality', 1.0)
+        } for row in cls.newest(rows).values()]
+        if not values:
+            return values
+
+        dialect = postgresql if db.session.get_bind().dialect.name \
+            == 'postgresql' else sqlite
+        statement = dialect.insert(cls).values(values)
+        excluded = statement.excluded
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[cls.device_id, cls.metric_type_id],
+            set_={'timestamp': excluded.timestamp,
+                  'value': excluded.value,
+                  'quality': excluded.quality},
+            where=cls.timestamp < excluded.timestamp))
+        if commit:
+            db.session.commit()
+        return values
+
+    @classmethod
+    def for_devices(cls, device_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        Latest readings of several devices from one indexed read
+
+        Served from the in-process mirror when this process runs ingest.
+
+        Args:
+            device_ids: Devices to look up
+
+        Returns:
+            Reading dictionaries ordered by device and metric type
+        """
+        if latest_values.live:
+            return latest_values.for_devices(device_ids)
+        if not device_ids:
+            return []
+        rows = db.session.query(cls, MetricType.name)\
+            .join(MetricType, MetricType.id == cls.metric_type_id)\
+            .filter(cls.device_id.in_(device_ids))\
+            .order_by(cls.device_id, cls.metric_type_id)
+        return [latest.to_dict(name) for latest, name in rows]
+
+    def to_dict(self, metric_type: Optional[str] = None) -> Dict[str, Any]:
+        """Convert the reading to a dictionary"""
+        timestamp = self.timestamp
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return {
+            'device_id': self.device_id,
+            'metric_type_id': self.metric_type_id,
+            'metric_type': metric_type,
+            'timestamp': timestamp.isoformat(),
+            'value': float(self.value),
+            'quality': float(self.quality)
+        }
+
+
+class LatestValues:
+    """
+    In-process mirror of latest_metrics.
+    ------------------------------------
+    Loaded from the table when ingest starts in this process and updated
+    by the writer after each commit, so fleet lookups cost no query.
+    Processes without ingest leave it dormant and read the table.
+    """
+
+    def __init__(self):
+        self.live = False
+        self._values: Dict[int, Dict[int, LatestMetric]] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Fill the mirror from the table and start serving from it"""
+        rows = db.session.query(LatestMetric, MetricType.name)\
+            .join(MetricType, MetricType.id == LatestMetric.metric_type_id)
+        with self._lock:
+            self._values.clear()
+            for latest, name in rows:
+                db.session.expunge(latest)
+                self._values.setdefault(latest.device_id, {})[
+                    latest.metric_type_id] = latest
+                self._names[latest.metric_type_id] = name
+            self.live = True
+
+    def update(self, rows: List[Dict[str, Any]]) -> None:
+        """Apply committed metric rows, keeping the newer reading"""
+        if not self.live:
+            return
+        with self._lock:
+            for (device_id, metric_type_id), row in \
+                    LatestMetric.newest(rows).items():
+                readings = self._values.setdefault(device_id, {})
+                current = readings.get(metric_type_id)
+                if current is None or row['timestamp'] > current.timestamp:
+                    readings[metric_type_id] = LatestMetric(
+                        device_id=device_id, metric_type_id=metric_type_id,
+                        timestamp=row['timestamp'], value=row['value'],
+                        quality=row.get('quality', 1.0))
+
+    def forget(self, device_id: int) -> None:
+        """Drop a deleted device"""
+        with self._lock:
+            self._values.pop(device_id, None)
+
+    def for_devices(self, device_ids: List[int]) -> List[Dict[str, Any]]:
+        """Latest readings of several devices"""
+        with self._lock:
+            readings = [(device_id, metric_type_id, latest)
+                        for device_id in sorted(set(device_ids))
+                        for metric_type_id, latest in sorted(
+                            self._values.get(device_id, {}).items())]
+            missing = {m for _, m, _ in readings} - self._names.keys()
+        if missing:
+            for metric_type in MetricType.query.filter(
+                    MetricType.id.in_(missing)):
+                self._names[metric_type.id] = metric_type.name
+        return [latest.to_dict(self._names.get(metric_type_id))
+                for _, metric_type_id, latest in readings]
+
+
+latest_values = LatestValues()
@@ -0,0 +1,196 @@
+"""
+    Module for the deduplicated metadata referenced by metric rows
+"""
+from __future__ import annotations
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from numbers import Real
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import mapped_column, Mapped
+from models import db
+from models.storage import JSONDocument
+
+
+def digest(document: Dict[str, Any]) -> str:
+    """Stable hash of a metadata document, independent of key order"""
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'),
+                           default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class MetadataDocument(db.Model):
+    """
+    A distinct metadata document.
+    -----------------------------
+    Firmware repeats the same metadata with every publish, so metrics
+    reference one stored copy by id instead of carrying a document per
+    reading.
+
+    Attributes:
+        id: Identifier referenced by metrics.metadata_id
+        digest: SHA-1 of the canonical JSON of the document
+        document: The metadata itself
+    """
+    __tablename__ = 'metadata_documents'
+
+    id: Mapped[int] = mapped_column(db.BigInteger().with_variant(
+        db.Integer, 'sqlite'), primary_key=True, init=False)
+    digest: Mapped[str] = mapped_column(db.String(40), unique=True,
+                                        nullable=False)
+    document: Mapped[Dict] = mapped_column(JSONDocument, nullable=False)
+
+    @classmethod
+    def ids_for(cls, documents: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Store documents that are not stored yet and return all their ids
+
+        Runs in its own short transaction: documents are immutable, so
+        committing them ahead of the metrics that reference them is safe
+        and ids handed out never disappear with a rolled back batch.
+
+        Args:
+            documents: Documents keyed by their digest
+
+        Returns:
+            Mapping of digest to id
+        """
+        if not documents:
+            return {}
+        with db.engine.begin() as connection:
+            dialect = postgresql if connection.dialect.name \
+                == 'postgresql' else sqlite
+            connection.execute(
+                dialect.insert(cls).values([
+                    {'digest': key, 'document': document}
+                    for key, document in documents.items()
+                ]).on_conflict_do_nothing(index_elements=[cls.digest]))
+            return dict(connection.execute(
+                select(cls.digest, cls.id)
+                .where(cls.digest.in_(list(documents)))).all())
+
+
+class MetadataDictionary:
+    """
+    Bounded digest -> id cache in front of metadata_documents.
+    ----------------------------------------------------------
+    Steady-state ingest sees a handful of distinct documents, so batches
+    are encoded without touching the table.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode_rows(self, rows: List[Dict[str, Any]]) \
+            -> List[Dict[str, Any]]:
+        """
+        Replace each row's metric_metadata by a metadata_id
+
+        Empty metadata becomes NULL. The input rows are not modified.
+        """
+        digests: List[Optional[str]] = []
+        known: Dict[str, int] = {}
+        missing: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for row in rows:
+                document = row.get('metric_metadata')
+                if not document:
+                    digests.append(None)
+                    continue
+                key = digest(document)
+                digests.append(key)
+                if key in known or key in missing:
+                    continue
+                if key in self._ids:
+                    self._ids.move_to_end(key)
+                    known[key] = self._ids[key]
+                    self.hits += 1
+                else:
+                    missing[key] = document
+                    self.misses += 1
+
+        ids = MetadataDocument.ids_for(missing)
+        known.update(ids)
+        with self._lock:
+            self._ids.update(ids)
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+        encoded = []
+        for row, key in zip(rows, digests):
+            row = {name: value for name, value in row.items()
+                   if name != 'metric_metadata'}
+            row['metadata_id'] = known[key] if key is not None else None
+            encoded.append(row)
+        return encoded
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters"""
+        with self._lock:
+            return {'size': len(self._ids), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+metadata_dictionary = MetadataDictionary()
+
+
+def promote_fields(rows: Iterable[Dict[str, Any]], fields: Iterable[str],
+                   metric_type_for: Callable[[str], Optional[int]]) \
+        -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Turn numeric metadata fields into readings of their own
+
+    A field is promoted when the metadata holds a number under that name
+    and a metric type of the same name exists. The promoted value becomes
+    a metric row (same device, timestamp and quality) and is removed from
+    the metadata, which also lets the remaining document deduplicate.
+
+    Args:
+        rows: Metric mappings with metric_metadata
+        fields: Names of promotable fields
+        metric_type_for: Returns the metric type id for a field name
+
+    Returns:
+        The rewritten rows followed by the promoted ones, and the number
+        of promoted readings
+    """
+    fields = tuple(fields)
+    result: List[Dict[str, Any]] = []
+    promoted: List[Dict[str, Any]] = []
+    # Batch payloads share one metadata document across their readings
+    seen = set()
+    for row in rows:
+        metadata = row.get('metric_metadata')
+        if not metadata or not any(f in metadata for f in fields):
+            result.append(row)
+            continue
+        remaining = dict(metadata)
+        for field in fields:
+            value = remaining.get(field)
+            if not isinstance(value, Real) or isinstance(value, bool):
+                continue
+            type_id = metric_type_for(field)
+            if type_id is None:
+                continue
+            del remaining[field]
+            key = (row['device_id'], type_id, row['timestamp'])
+            if key in seen:
+                continue
+            seen.add(key)
+            promoted.append({
+                'device_id': row['device_id'],
+                'metric_type_id': type_id,
+                'timestamp': row['timestamp'],
+                'value': float(value),
+                'quality': row.get('quality', 1.0),
+                'metric_metadata': {}
+            })
+        result.append({**row, 'metric_metadata': remaining})
+    return result + promoted, len(promoted)
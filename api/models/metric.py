@@ -2,20 +2,58 @@
     Python module for metric data hypertables
 """
 from __future__ import annotations
-from datetime import datetime, timedelta
-from typing import Dict, List, Union, Optional, Any, TypeVar, Generic
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from typing import (Dict, List, Union, Optional, Any, TypeVar, Generic,
+                    Callable, Tuple, Iterator)
 from dataclasses import dataclass
 from enum import Enum
-from sqlalchemy import text, func, Index
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship, validates, Mapped
+from sqlalchemy import (text, func, Index, tuple_, select, union_all,
+                        and_, or_, column, true, values, Integer)
+from sqlalchemy.sql import Select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import (relationship, validates, Mapped, aliased,
+                            selectinload)
 from sqlalchemy.orm.query import Query
 from sqlalchemy.ext.hybrid import hybrid_property
+import numpy as np
 from models import db
+from models.aggregates import (AggregateView, REFRESH_BUCKETS, STATS_VIEWS,
+                               aggregate_registry, align_down, align_up,
+                               parse_interval)
+from models.archive import (ARCHIVE_DAY, ArchiveSegment, BucketStats,
+                            bucket_stats)
+from models.downsampling import METHODS as DOWNSAMPLE_METHODS
+from models.metadata_document import MetadataDocument, metadata_dictionary
+from models.pg_copy import copy_new_rows, supports_copy
+from models.storage import JSONDocument, UTCDateTime, get_backend
+from models.validation import ValidationReport, compile_rules, validate_batch
 
 
 T = TypeVar('T')
 
+# A reading is identified by device, metric type and timestamp; brokers
+# and device firmware redeliver, so inserts skip keys that already exist
+NATURAL_KEY = ('device_id', 'metric_type_id', 'timestamp')
+INSERT_CHUNK_SIZE = 1000  # rows per multi-row INSERT statement
+
+
+def natural_key(device_id: int, metric_type_id: int,
+                timestamp: datetime) -> Tuple[int, int, datetime]:
+    """Comparable natural key of a reading, reading naive values as UTC"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (int(device_id), int(metric_type_id),
+            timestamp.astimezone(timezone.utc))
+
+
+def _epoch(moment: datetime) -> float:
+    """Epoch seconds of a timestamp, reading naive values as UTC"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
 
 class AggregationType(str, Enum):
     """Supported aggregation types for time-series data"""
@@ -47,7 +85,7 @@ class MetricType(db.Model):
     name: Mapped[str] = db.Column(db.String(50), unique=True, nullable=False)
     unit: Mapped[str] = db.Column(db.String(20))
     description: Mapped[str] = db.Column(db.Text)
-    validation_rules: Mapped[Dict] = db.Column(JSONB)
+    validation_rules: Mapped[Dict] = db.Column(JSONDocument)
 
     metrics = relationship("Metric", back_populates="metric_type")
 
@@ -61,11 +99,13 @@ class Metric(db.Model):
         device_id (str): Unique device  name.
         timestamp (datetime): timestamp of the metric.
         value (float): value of the metric.
+        metadata_id (int): shared metadata document, if any.
     """
     __tablename__ = 'metrics'
     __table_args__ = (
         Index('idx_metrics_device_timestamp', 'device_id', 'timestamp'),
         Index('idx_metrics_type_timestamp', 'metric_type_id', 'timestamp'),
+        Index('uq_metrics_natural_key', *NATURAL_KEY, unique=True),
         {
             'timescaledb_hypertable': {
                 'time_column': 'timestamp',
@@ -82,15 +122,24 @@ class Metric(db.Model):
     metric_type_id: Mapped[int] = db.Column(db.Integer,
                                             db.ForeignKey('metric_types.id'),
                                             nullable=False)
-    timestamp: Mapped[datetime] = db.Column(db.DateTime(timezone=True),
-                                            nullable=False)
+    timestamp: Mapped[datetime] = db.Column(UTCDateTime, nullable=False)
     value: Mapped[float] = db.Column(db.Float,
                                      nullable=False)
-    metric_metadata: Mapped[Dict] = db.Column(JSONB, default={})
+    # Deduplicated metadata, see models/metadata_document.py
+    metadata_id: Mapped[Optional[int]] = db.Column(
+        db.BigInteger, db.ForeignKey('metadata_documents.id'),
+        nullable=True)
     quality: Mapped[float] = db.Column(db.Float, default=1.0)
 
     device = relationship("Device", back_populates="metrics")
     metric_type = relationship("MetricType", back_populates="metrics")
+    metadata_document = relationship("MetadataDocument")
+
+    @property
+    def metric_metadata(self) -> Dict[str, Any]:
+        """Metadata sent with the reading"""
+        document = self.metadata_document
+        return document.document if document is not None else {}
 
     def save(self) -> None:
         """ Saves the metric to the database. """
@@ -101,13 +150,36 @@ class Metric(db.Model):
     def validate_value(self, value: float) -> float:
         """Validate metric value against metric type rules"""
         if self.metric_type and self.metric_type.validation_rules:
-            rules = self.metric_type.validation_rules
-            if 'min' in rules and value < rules['min']:
-                raise ValueError(f"Value {value} below minimum {rules['min']}")
-            if 'max' in rules and value > rules['max']:
-                raise ValueError(f"Value {value} above maximum {rules['max']}")
+            reason = compile_rules(
+                self.metric_type.validation_rules).check(value)
+            if reason:
+                raise ValueError(reason)
         return value
 
+    @classmethod
+    def validate_batch(cls, metrics: List[Dict[str, Any]],
+                       rules_for: Optional[Callable[[int],
+                                                    Optional[Dict]]] = None)\
+            -> Tuple[List[Dict[str, Any]], ValidationReport]:
+        """
+        Validate metric mappings for the bulk insert path
+
+        Args:
+            metrics: Metric mappings to validate
+            rules_for: Returns validation_rules for a metric type id;
+                defaults to loading the rules of all types in one query
+
+        Returns:
+            Accepted mappings and a report of rejected ones with reasons
+        """
+        if rules_for is None:
+            type_ids = {metric['metric_type_id'] for metric in metrics}
+            rules = dict(db.session.query(
+                MetricType.id, MetricType.validation_rules
+            ).filter(MetricType.id.in_(type_ids)).all()) if type_ids else {}
+            rules_for = rules.get
+        return validate_batch(metrics, rules_for)
+
     @classmethod
     def create_continuous_aggregate(cls, view_name: str,
                                     interval: str = '1 hour',
@@ -130,6 +202,152 @@ class Metric(db.Model):
         db.session.execute(sql)
         db.session.commit()
 
+    @classmethod
+    def create_stats_aggregate(cls, view: AggregateView) -> None:
+        """
+        Create a sum/min/max/count continuous aggregate and register it
+
+        The view is materialized-only; queries routed to it merge the
+        not yet materialized tail from raw rows themselves. The policy
+        only re-materializes the last REFRESH_BUCKETS buckets, so the
+        ingest writer refreshes older ranges itself when late or
+        replayed readings land there (StorageBackend.refresh_aggregates);
+        rows written any other way appear once that range is refreshed.
+        """
+        bucket_seconds = int(view.bucket.total_seconds())
+        refresh_seconds = REFRESH_BUCKETS * bucket_seconds
+        db.session.execute(text(f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {view.name}
+            WITH (timescaledb.continuous,
+                  timescaledb.materialized_only = true) AS
+            SELECT
+                time_bucket('{view.interval}', timestamp) AS bucket,
+                device_id,
+                metric_type_id,
+                sum(value) AS sum_value,
+                min(value) AS min_value,
+                max(value) AS max_value,
+                count(*) AS sample_count
+            FROM metrics
+            GROUP BY bucket, device_id, metric_type_id
+            WITH NO DATA;
+        """))
+        db.session.execute(text(f"""
+            SELECT add_continuous_aggregate_policy('{view.name}',
+                start_offset => INTERVAL '{refresh_seconds} seconds',
+                end_offset => INTERVAL '{bucket_seconds} seconds',
+                schedule_interval => INTERVAL '{bucket_seconds} seconds',
+                if_not_exists => true);
+        """))
+        db.session.commit()
+        aggregate_registry.register(view)
+
+    @classmethod
+    def create_stats_aggregates(cls) -> None:
+        """Create the 1 minute, 1 hour and 1 day stats aggregates"""
+        for view in STATS_VIEWS:
+            cls.create_stats_aggregate(view)
+
+    @classmethod
+    def stats_select(cls,
+                     device_ids: List[int],
+                     metric_type_ids: List[int],
+                     start_time: datetime,
+                     end_time: datetime,
+                     interval: str = '1 hour') -> Select:
+        """
+        Build a bucketed stats query, routed to the coarsest usable view
+
+        Whole view buckets inside the range are read from the aggregate;
+        the partial bucket at the start of the range and everything from
+        the newest materialized bucket onwards are read from raw rows.
+
+        Returns:
+            Select of device_id, metric_type_id, bucket, avg_value,
+            min_value, max_value and sample_count per bucket
+        """
+        raw_filter = [cls.device_id.in_(device_ids),
+                      cls.metric_type_id.in_(metric_type_ids)]
+        raw_bucket = get_backend().bucket(interval, cls.timestamp)
+
+        bucket = parse_interval(interval)
+        view = aggregate_registry.route(bucket) if bucket else None
+        if view is not None:
+            aggregate = view.table
+            view_start = align_up(start_time, view.bucket)
+            view_end = align_down(end_time, view.bucket)
+            # The newest materialized bucket may still be filling up
+            watermark = db.session.query(
+                func.max(aggregate.c.bucket)
+            ).filter(
+                aggregate.c.device_id.in_(device_ids),
+                aggregate.c.metric_type_id.in_(metric_type_ids),
+                aggregate.c.bucket >= view_start,
+                aggregate.c.bucket < view_end
+            ).scalar() if view_end > view_start else None
+            if watermark is None:
+                view = None
+            else:
+                if watermark.tzinfo is None:
+                    watermark = watermark.replace(tzinfo=timezone.utc)
+                view_end = min(view_end, watermark)
+                if view_end <= view_start:
+                    view = None
+
+        if view is None:
+            return select(
+                cls.device_id, cls.metric_type_id,
+                raw_bucket.label('bucket'),
+                func.avg(cls.value).label('avg_value'),
+                func.min(cls.value).label('min_value'),
+                func.max(cls.value).label('max_value'),
+                func.count(cls.value).label('sample_count')
+            ).where(
+                *raw_filter, cls.timestamp.between(start_time, end_time)
+            ).group_by(cls.device_id, cls.metric_type_id, raw_bucket)
+
+        raw_part = select(
+            cls.device_id, cls.metric_type_id,
+            raw_bucket.label('bucket'),
+            func.sum(cls.value).label('sum_value'),
+            func.min(cls.value).label('min_value'),
+            func.max(cls.value).label('max_value'),
+            func.count(cls.value).label('sample_count')
+        ).where(
+            *raw_filter,
+            or_(and_(cls.timestamp >= start_time,
+                     cls.timestamp < view_start),
+                and_(cls.timestamp >= view_end,
+                     cls.timestamp <= end_time))
+        ).group_by(cls.device_id, cls.metric_type_id, raw_bucket)
+
+        view_bucket = get_backend().bucket(interval, aggregate.c.bucket)
+        view_part = select(
+            aggregate.c.device_id, aggregate.c.metric_type_id,
+            view_bucket.label('bucket'),
+            func.sum(aggregate.c.sum_value).label('sum_value'),
+            func.min(aggregate.c.min_value).label('min_value'),
+            func.max(aggregate.c.max_value).label('max_value'),
+            func.sum(aggregate.c.sample_count).label('sample_count')
+        ).where(
+            aggregate.c.device_id.in_(device_ids),
+            aggregate.c.metric_type_id.in_(metric_type_ids),
+            aggregate.c.bucket >= view_start,
+            aggregate.c.bucket < view_end
+        ).group_by(aggregate.c.device_id, aggregate.c.metric_type_id,
+                   view_bucket)
+
+        parts = union_all(raw_part, view_part).subquery()
+        return select(
+            parts.c.device_id, parts.c.metric_type_id, parts.c.bucket,
+            (func.sum(parts.c.sum_value)
+             / func.sum(parts.c.sample_count)).label('avg_value'),
+            func.min(parts.c.min_value).label('min_value'),
+            func.max(parts.c.max_value).label('max_value'),
+            func.sum(parts.c.sample_count).label('sample_count')
+        ).group_by(parts.c.device_id, parts.c.metric_type_id,
+                   parts.c.bucket)
+
     @classmethod
     def get_timerange_stats(cls,
                             device_id: int,
@@ -138,49 +356,224 @@ class Metric(db.Model):
                             end_time: datetime,
                             interval: str = '1 hour')\
             -> List[TimeSeriesResult]:
-        """Get statistical aggregates for a time range"""
-        result = db.session.query(
-            func.time_bucket(interval, cls.timestamp).label('bucket'),
-            func.avg(cls.value).label('avg_value'),
-            func.min(cls.value).label('min_value'),
-            func.max(cls.value).label('max_value'),
-            func.count(cls.value).label('sample_count')
-        ).filter(
-            cls.device_id == device_id,
-            cls.metric_type_id == metric_type_id,
-            cls.timestamp.between(start_time, end_time)
-        ).group_by('bucket').order_by('bucket').all()
+        """
+        Get statistical aggregates for a time range
+
+        Buckets before the device's archive boundary are computed from
+        the archive files, the rest from the database; a bucket spanning
+        the boundary combines both.
+        """
+        bucket = parse_interval(interval)
+        boundary = ArchiveSegment.boundary(device_id) if bucket else None
+        stats: BucketStats = {}
+        if boundary is not None and start_time < boundary:
+            series = ArchiveSegment.read(
+                device_id, [metric_type_id], start_time,
+                min(end_time + timedelta(microseconds=1), boundary))
+            if metric_type_id in series:
+                times, values, _ = series[metric_type_id]
+                stats = bucket_stats(times, values, bucket)
+            start_time = max(start_time, boundary)
+
+        if start_time <= end_time:
+            query = cls.stats_select([device_id], [metric_type_id],
+                                     start_time, end_time, interval)
+            for r in db.session.execute(query):
+                moment = r.bucket if r.bucket.tzinfo else \
+                    r.bucket.replace(tzinfo=timezone.utc)
+                total = float(r.avg_value) * int(r.sample_count)
+                if moment in stats:
+                    s, lo, hi, n = stats[moment]
+                    stats[moment] = (s + total, min(lo, float(r.min_value)),
+                                     max(hi, float(r.max_value)),
+                                     n + int(r.sample_count))
+                else:
+                    stats[moment] = (total, float(r.min_value),
+                                     float(r.max_value),
+                                     int(r.sample_count))
 
         return [
             TimeSeriesResult(
-                timestamp=r.bucket,
+                timestamp=moment,
                 value={
-                    'avg': float(r.avg_value),
-                    'min': float(r.min_value),
-                    'max': float(r.max_value),
-                    'count': int(r.sample_count)
+                    'avg': total / count,
+                    'min': low,
+                    'max': high,
+                    'count': count
                 },
                 device_id=device_id
-            ) for r in result
+            ) for moment, (total, low, high, count) in sorted(stats.items())
         ]
 
     @classmethod
-    def downsample_metrics(cls,
-                           retention_policy: Dict[str,
-                                                  Union[str, int]]) -> None:
-        """Downsample old metrics based on retention policy"""
-        for interval, retention in retention_policy.items():
-            sql = text(f"""
-                SELECT timescaledb_toolkit.downsample(
-                    relation => 'metrics',
-                    time_column => 'timestamp',
-                    newer_than => NOW() - INTERVAL '{retention}',
-                    older_than => NOW() - INTERVAL '{retention}',
-                    interval => INTERVAL '{interval}'
-                );
-            """)
-            db.session.execute(sql)
-        db.session.commit()
+    def iter_multi_device_stats(cls,
+                                device_ids: List[int],
+                                metric_type_ids: List[int],
+                                start_time: datetime,
+                                end_time: datetime,
+                                interval: str = '1 hour',
+                                chunk_size: int = 1000)\
+            -> Iterator[Dict[str, Any]]:
+        """
+        Stream bucketed stats for many devices from one grouped query
+
+        Rows are yielded as they are fetched, ordered by device, metric
+        type and bucket.
+        """
+        if not device_ids or not metric_type_ids:
+            return
+        query = cls.stats_select(device_ids, metric_type_ids,
+                                 start_time, end_time, interval)
+        columns = query.selected_columns
+        result = db.session.execute(
+            query.order_by(columns.device_id, columns.metric_type_id,
+                           columns.bucket),
+            execution_options={'yield_per': chunk_size})
+
+        for r in result:
+            yield {
+                'device_id': r.device_id,
+                'metric_type_id': r.metric_type_id,
+                'bucket': r.bucket.isoformat(),
+                'avg': float(r.avg_value),
+                'min': float(r.min_value),
+                'max': float(r.max_value),
+                'count': int(r.sample_count)
+            }
+
+    @classmethod
+    def iter_value_chunks(cls,
+                          device_id: int,
+                          metric_type_id: int,
+                          start_time: datetime,
+                          end_time: datetime,
+                          chunk_size: int = 10000)\
+            -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Stream (epoch seconds, values) arrays for one series in time order
+
+        Args:
+            device_id: Device the series belongs to
+            metric_type_id: Metric type of the series
+            start_time: Inclusive start of the range
+            end_time: Exclusive end of the range
+            chunk_size: Rows fetched per round trip
+
+        Returns:
+            Iterator of NumPy array pairs of at most chunk_size rows
+        """
+        query = select(cls.timestamp, cls.value).where(
+            cls.device_id == device_id,
+            cls.metric_type_id == metric_type_id,
+            cls.timestamp >= start_time,
+            cls.timestamp < end_time
+        ).order_by(cls.timestamp)
+        result = db.session.execute(
+            query, execution_options={'yield_per': chunk_size})
+
+        for rows in result.partitions():
+            times = np.fromiter((_epoch(r.timestamp) for r in rows),
+                                dtype=np.float64, count=len(rows))
+            values = np.fromiter((r.value for r in rows),
+                                 dtype=np.float64, count=len(rows))
+            yield times, values
+
+    @classmethod
+    def iter_export_chunks(cls,
+                           device_id: int,
+                           metric_type_ids: Optional[List[int]],
+                           start_time: datetime,
+                           end_time: datetime,
+                           chunk_size: int = 5000)\
+            -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream a device's raw readings in time order for export
+
+        Args:
+            device_id: Device to export
+            metric_type_ids: Metric types to include, or None for all
+            start_time: Inclusive start of the range
+            end_time: Exclusive end of the range
+            chunk_size: Rows fetched per round trip
+
+        Returns:
+            Iterator of row dictionaries, at most chunk_size per list
+        """
+        query = select(cls.timestamp, cls.device_id,
+                       MetricType.name.label('metric_type'), cls.value,
+                       cls.quality,
+                       MetadataDocument.document.label('metric_metadata'))\
+            .join(MetricType, MetricType.id == cls.metric_type_id)\
+            .outerjoin(MetadataDocument,
+                       MetadataDocument.id == cls.metadata_id)\
+            .where(cls.device_id == device_id,
+                   cls.timestamp >= start_time,
+                   cls.timestamp < end_time)\
+            .order_by(cls.timestamp, cls.id)
+        if metric_type_ids is not None:
+            query = query.where(cls.metric_type_id.in_(metric_type_ids))
+        result = db.session.execute(
+            query, execution_options={'yield_per': chunk_size})
+
+        for rows in result.partitions():
+            yield [{
+                'timestamp': r.timestamp if r.timestamp.tzinfo
+                else r.timestamp.replace(tzinfo=timezone.utc),
+                'device_id': r.device_id,
+                'metric_type': r.metric_type,
+                'value': r.value,
+                'quality': r.quality,
+                'metadata': r.metric_metadata
+            } for r in rows]
+
+    @classmethod
+    def get_series(cls,
+                   device_id: int,
+                   metric_type_id: int,
+                   start_time: datetime,
+                   end_time: datetime,
+                   points: int,
+                   mode: str = 'lttb') -> List[Dict[str, Any]]:
+        """
+        Downsample a series to at most ``points`` chart points
+
+        Args:
+            device_id: Device the series belongs to
+            metric_type_id: Metric type of the series
+            start_time: Inclusive start of the range
+            end_time: Exclusive end of the range
+            points: Maximum number of points to return
+            mode: 'lttb' or 'minmax'
+
+        Returns:
+            List of {'timestamp', 'value'} dictionaries in time order
+        """
+        method = DOWNSAMPLE_METHODS[mode]
+        chunks = cls.iter_value_chunks(device_id, metric_type_id,
+                                       start_time, end_time)
+        selected = method(chunks, _epoch(start_time), _epoch(end_time),
+                          points)
+        return [{
+            'timestamp': datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            'value': value
+        } for ts, value in selected]
+
+    @classmethod
+    def downsample_metrics(cls, older_than: datetime) -> List[str]:
+        """
+        Materialize the stats aggregates for everything before older_than
+
+        Called before raw rows are removed so that every registered
+        aggregate already holds their roll-up. Refreshes are incremental,
+        so buckets that are already materialized cost nothing.
+
+        Args:
+            older_than: Raw rows before this time are about to be removed
+
+        Returns:
+            Names of the refreshed aggregates
+        """
+        return get_backend().refresh_aggregates(older_than)
 
     @hybrid_property
     def age(self) -> timedelta:
@@ -195,15 +588,116 @@ class Metric(db.Model):
             'metric_type_id': self.metric_type_id,
             'timestamp': self.timestamp.isoformat(),
             'value': float(self.value),
-            'metric_metadata': self.metadata,
+            'metric_metadata': self.metric_metadata,
             'quality': float(self.quality)
         }
 
     @classmethod
-    def batch_insert(cls, metrics: List[Dict[str, Any]]) -> None:
-        """Efficiently insert multiple metrics"""
-        db.session.bulk_insert_mappings(cls, metrics)
-        db.session.commit()
+    def recent_for_devices(cls, device_ids: List[int],
+                           limit: int = 10) -> List['Metric']:
+        """
+        Newest readings of several devices in one query
+
+        PostgreSQL reads each device's newest rows from the
+        (device_id, timestamp) index through a LATERAL join; other
+        databases rank the devices' rows with row_number().
+
+        Args:
+            device_ids: Devices to look up
+            limit: Readings returned per device
+
+        Returns:
+            Metrics ordered by device, newest first
+        """
+        if not device_ids:
+            return []
+        if db.session.get_bind().dialect.name == 'postgresql':
+            fleet = values(column('device_id', Integer), name='fleet')\
+                .data([(device_id,) for device_id in device_ids])
+            recent = select(cls).where(cls.device_id == fleet.c.device_id)\
+                .order_by(cls.timestamp.desc()).limit(limit).lateral()
+            metric = aliased(cls, recent)
+            query = select(metric).select_from(fleet).join(recent, true())
+        else:
+            ranked = select(cls, func.row_number().over(
+                partition_by=cls.device_id,
+                order_by=cls.timestamp.desc()).label('rank')
+            ).where(cls.device_id.in_(device_ids)).subquery()
+            metric = aliased(cls, ranked)
+            query = select(metric).where(ranked.c.rank <= limit)
+        return db.session.scalars(
+            query.order_by(metric.device_id, metric.timestamp.desc())
+            .options(selectinload(metric.metadata_document))).all()
+
+    @classmethod
+    def batch_insert(cls, metrics: List[Dict[str, Any]],
+                     method: str = 'auto',
+                     copy_format: str = 'text',
+                     commit: bool = True) -> List[Dict[str, Any]]:
+        """
+        Efficiently insert multiple metrics, skipping duplicate readings
+
+        metric_metadata documents are stored once in metadata_documents
+        and the rows reference them by metadata_id. Rows whose
+        (device_id, metric_type_id, timestamp) already exists, in the
+        table or earlier in the batch, are not inserted.
+
+        Args:
+            metrics: Metric mappings to insert
+            method: 'copy', 'insert' or 'auto' (COPY when the database
+                supports it, parameterised INSERTs otherwise)
+            copy_format: COPY format, 'text' or 'binary'
+            commit: Commit the session, False to leave the transaction
+                open for the caller
+
+        Returns:
+            The mappings that were inserted
+        """
+        if not metrics:
+            return []
+
+        encoded = metadata_dictionary.encode_rows(metrics)
+        connection = db.session.connection()
+        if method != 'insert' and supports_copy(connection):
+            keys = copy_new_rows(connection, cls.__tablename__, encoded,
+                                 NATURAL_KEY, copy_format)
+        else:
+            keys = cls._insert_new_rows(encoded)
+        if commit:
+            db.session.commit()
+
+        inserted = {natural_key(*key) for key in keys}
+        if len(inserted) == len(metrics):
+            return metrics
+        rows = []
+        for row in metrics:
+            key = natural_key(row['device_id'], row['metric_type_id'],
+                              row['timestamp'])
+            if key in inserted:
+                inserted.discard(key)  # later copies in the batch lost
+                rows.append(row)
+        return rows
+
+    @classmethod
+    def _insert_new_rows(cls, rows: List[Dict[str, Any]]) -> List[Tuple]:
+        """INSERT ... ON CONFLICT DO NOTHING, returning inserted keys"""
+        dialect = postgresql if db.session.get_bind().dialect.name \
+            == 'postgresql' else sqlite
+        key_columns = [cls.__table__.c[name] for name in NATURAL_KEY]
+        keys: List[Tuple] = []
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            statement = dialect.insert(cls).values([{
+                'device_id': row['device_id'],
+                'metric_type_id': row['metric_type_id'],
+                'timestamp': row['timestamp'],
+                'value': row['value'],
+                'quality': row.get('quality', 1.0),
+                'metadata_id': row.get('metadata_id')
+            } for row in rows[i:i + INSERT_CHUNK_SIZE]])
+            keys.extend(db.session.execute(
+                statement.on_conflict_do_nothing(index_elements=key_columns)
+                .returning(*key_columns)).all())
+        return keys
 
     @classmethod
     def get_paginated_results(cls,
@@ -224,10 +718,127 @@ class Metric(db.Model):
             'metrics': [metric.to_dict() for metric in pagination.items]
         }
 
+    @staticmethod
+    def encode_cursor(timestamp: datetime, metric_id: int) -> str:
+        """Encode a (timestamp, id) position as an opaque cursor"""
+        raw = json.dumps([timestamp.isoformat(), metric_id])
+        return base64.urlsafe_b64encode(raw.encode()).rstrip(b'=').decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        """Decode a cursor from encode_cursor, raising ValueError if bad"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, metric_id = json.loads(
+                base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(timestamp), int(metric_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor: {str(e)}")
+
     @classmethod
-    def cleanup_old_data(cls, older_than: datetime) -> int:
-        """Remove old data while maintaining continuous aggregates"""
-        result = db.session.query(cls).filter(cls.timestamp
-                                              < older_than).delete()
-        db.session.commit()
-        return result
+    def get_keyset_page(cls,
+                        query: Query,
+                        limit: int,
+                        cursor: Optional[str] = None,
+                        include_total: bool = False) -> Dict[
+                            str, Union[int, str, None,
+                                       List[Dict[str, Any]]]]:
+        """
+        Get one page of a metric query, newest first, by keyset
+
+        Pages are keyed on (timestamp, id) rather than an offset, so every
+        page is an index range scan of the same cost.
+
+        Args:
+            query: Filtered metric query (no ordering needed)
+            limit: Page size, at least 1
+            cursor: next_cursor from the previous page
+            include_total: Also count all matching rows (a full scan)
+
+        Returns:
+            Page of metrics with the cursor of the next page, if any
+        """
+        limit = max(1, limit)
+        total = query.order_by(None).count() if include_total else None
+
+        if cursor:
+            timestamp, metric_id = cls.decode_cursor(cursor)
+            query = query.filter(tuple_(cls.timestamp, cls.id)
+                                 < tuple_(timestamp, metric_id))
+
+        rows = query.order_by(cls.timestamp.desc(), cls.id.desc())\
+            .limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        page = {
+            'per_page': limit,
+            'next_cursor': cls.encode_cursor(rows[-1].timestamp, rows[-1].id)
+            if has_more else None,
+            'metrics': [metric.to_dict() for metric in rows]
+        }
+        if include_total:
+            page['total_items'] = total
+        return page
+
+    @classmethod
+    def archive_closed_days(cls, before: datetime) -> int:
+        """
+        Copy every device-day before ``before`` to the archive
+
+        Days that already have an archive file are skipped, so a day is
+        archived once even if removing its raw rows took several runs.
+
+        Args:
+            before: Start of a UTC day; earlier days are archived
+
+        Returns:
+            Number of readings archived
+        """
+        day = get_backend().bucket('1 day', cls.timestamp)
+        days = db.session.execute(
+            select(cls.device_id, day.label('day'))
+            .where(cls.timestamp < before)
+            .group_by(cls.device_id, day)).all()
+        archived = ArchiveSegment.archived_days({d.device_id for d in days})
+
+        total = 0
+        for device_id, day_start in sorted(days):
+            if day_start.tzinfo is None:
+                day_start = day_start.replace(tzinfo=timezone.utc)
+            if (device_id, day_start.date()) in archived:
+                continue
+            rows = db.session.execute(
+                select(cls.metric_type_id, cls.timestamp, cls.value,
+                       cls.quality)
+                .where(cls.device_id == device_id,
+                       cls.timestamp >= day_start,
+                       cls.timestamp < day_start + ARCHIVE_DAY)
+                .order_by(cls.metric_type_id, cls.timestamp)).all()
+            total += ArchiveSegment.write_day(device_id, day_start.date(),
+                                              rows)
+        return total
+
+    @classmethod
+    def cleanup_old_data(cls, older_than: datetime,
+                         batch_size: int = 10000,
+                         deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Remove rows older than older_than without long-running deletes
+
+        On TimescaleDB whole chunks are dropped, on a partitioned
+        PostgreSQL table whole weekly partitions. Remaining rows are
+        deleted in batches of batch_size, committing after each, until
+        none are left or the time.monotonic() deadline passes.
+
+        Args:
+            older_than: Remove rows with an earlier timestamp
+            batch_size: Rows per DELETE statement
+            deadline: Stop starting new batches after this time
+
+        Returns:
+            Dictionary with method, chunks_dropped or rows_deleted and
+            whether every old row was removed ('complete')
+        """
+        return get_backend().drop_older_than(
+            cls.__table__, older_than, batch_size, deadline)
@@ -0,0 +1,154 @@
+"""
+    PostgreSQL COPY support for bulk metric inserts
+"""
+from __future__ import annotations
+import io
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+from sqlalchemy.engine import Connection
+
+
+# Columns written by COPY, ``id`` is left to its sequence default
+COPY_COLUMNS = ('device_id', 'metric_type_id', 'timestamp', 'value',
+                'quality', 'metadata_id')
+
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+NULL_FIELD = struct.pack('!i', -1)
+
+
+def supports_copy(connection: Connection) -> bool:
+    """Check whether the connection can stream COPY FROM STDIN"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    cursor = connection.connection.cursor()
+    try:
+        return hasattr(cursor, 'copy_expert')
+    finally:
+        cursor.close()
+
+
+def copy_rows(connection: Connection, table: str,
+              rows: List[Dict[str, Any]], copy_format: str = 'text') -> None:
+    """
+    Stream rows into ``table`` with COPY inside the current transaction
+
+    Args:
+        connection: SQLAlchemy connection bound to the session
+        table: Target table name
+        rows: Metric mappings as accepted by bulk_insert_mappings
+        copy_format: 'text' or 'binary'
+    """
+    if copy_format == 'binary':
+        buffer = encode_binary(rows)
+        options = 'FORMAT binary'
+    else:
+        buffer = encode_text(rows)
+        options = 'FORMAT text'
+
+    sql = (f"COPY {table} ({', '.join(COPY_COLUMNS)}) "
+           f"FROM STDIN WITH ({options})")
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+def copy_new_rows(connection: Connection, table: str,
+                  rows: List[Dict[str, Any]], key_columns: Sequence[str],
+                  copy_format: str = 'text') -> List[Tuple]:
+    """
+    COPY rows into ``table``, skipping those whose key already exists
+
+    COPY cannot skip conflicting rows, so the rows are streamed into a
+    per-connection temporary staging table and moved with INSERT ...
+    ON CONFLICT DO NOTHING.
+
+    Args:
+        connection: SQLAlchemy connection bound to the session
+        table: Target table name
+        rows: Metric mappings as accepted by bulk_insert_mappings
+        key_columns: Columns of the unique index rows conflict on
+        copy_format: 'text' or 'binary'
+
+    Returns:
+        Key tuples of the rows that were inserted
+    """
+    staging = f"{table}_staging"
+    columns = ', '.join(COPY_COLUMNS)
+    keys = ', '.join(key_columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                       f"ON COMMIT DELETE ROWS AS "
+                       f"SELECT {columns} FROM {table} WITH NO DATA")
+        copy_rows(connection, staging, rows, copy_format)
+        cursor.execute(f"INSERT INTO {table} ({columns}) "
+                       f"SELECT {columns} FROM {staging} "
+                       f"ON CONFLICT ({keys}) DO NOTHING "
+                       f"RETURNING {keys}")
+        inserted = cursor.fetchall()
+        # Callers may insert several batches in one transaction
+        cursor.execute(f"TRUNCATE {staging}")
+        return inserted
+    finally:
+        cursor.close()
+
+
+def _row_values(row: Dict[str, Any]) -> Sequence[Any]:
+    """Order a metric mapping as COPY_COLUMNS, filling defaults"""
+    timestamp = row['timestamp']
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (int(row['device_id']), int(row['metric_type_id']), timestamp,
+            float(row['value']), float(row.get('quality', 1.0)),
+            row.get('metadata_id'))
+
+
+def encode_text(rows: List[Dict[str, Any]]) -> io.StringIO:
+    """Encode rows in COPY text format"""
+    buffer = io.StringIO()
+    for row in rows:
+        device_id, type_id, timestamp, value, quality, metadata_id = \
+            _row_values(row)
+        metadata = '\\N' if metadata_id is None else metadata_id
+        buffer.write(f"{device_id}\t{type_id}\t{timestamp.isoformat()}\t"
+                     f"{value!r}\t{quality!r}\t{metadata}\n")
+    buffer.seek(0)
+    return buffer
+
+
+def encode_binary(rows: List[Dict[str, Any]]) -> io.BytesIO:
+    """Encode rows in COPY binary format"""
+    tuple_header = struct.Struct('!h')
+    int_field = struct.Struct('!ii')
+    bigint_field = struct.Struct('!iq')
+    double_field = struct.Struct('!id')
+    field_count = tuple_header.pack(len(COPY_COLUMNS))
+
+    buffer = io.BytesIO()
+    buffer.write(BINARY_HEADER)
+    for row in rows:
+        device_id, type_id, timestamp, value, quality, metadata_id = \
+            _row_values(row)
+        # timestamptz is sent as microseconds since 2000-01-01 UTC
+        delta = timestamp - PG_EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1000000 \
+            + delta.microseconds
+
+        buffer.write(field_count)
+        buffer.write(int_field.pack(4, device_id))
+        buffer.write(int_field.pack(4, type_id))
+        buffer.write(bigint_field.pack(8, micros))
+        buffer.write(double_field.pack(8, value))
+        buffer.write(double_field.pack(8, quality))
+        if metadata_id is None:
+            buffer.write(NULL_FIELD)
+        else:
+            buffer.write(bigint_field.pack(8, metadata_id))
+    buffer.write(BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,165 @@
+"""
+    Declarative retention tiers for raw metrics and stats aggregates
+"""
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import mapped_column, Mapped
+from models import db
+from models.aggregates import (STATS_VIEWS, aggregate_registry, align_down,
+                               drop_chunks, parse_interval)
+from models.archive import ARCHIVE_DAY
+from models.metric import Metric
+
+
+RAW_TIER = 'raw'
+FOREVER = 'forever'
+
+
+@dataclass(frozen=True)
+class RetentionTier:
+    """
+    How long one resolution of data is kept
+
+    Attributes:
+        resolution: 'raw' for the metrics table, otherwise the interval of
+            a stats aggregate such as '1 hour'
+        keep: Age after which data is removed, None to keep it forever
+    """
+    resolution: str
+    keep: Optional[timedelta]
+
+    @property
+    def relation(self) -> str:
+        """Table or continuous aggregate holding this resolution"""
+        if self.resolution == RAW_TIER:
+            return Metric.__tablename__
+        bucket = parse_interval(self.resolution)
+        for view in STATS_VIEWS:
+            if view.bucket == bucket:
+                return view.name
+        raise ValueError(f"No stats aggregate for '{self.resolution}'")
+
+
+def parse_tiers(spec: str) -> List[RetentionTier]:
+    """
+    Parse a tier list such as 'raw:30 days,1 hour:365 days,1 day:forever'
+
+    Raises:
+        ValueError: For unknown resolutions or malformed durations
+    """
+    tiers = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        resolution, _, keep = (s.strip() for s in item.partition(':'))
+        if keep.lower() == FOREVER:
+            duration = None
+        else:
+            duration = parse_interval(keep)
+            if duration is None:
+                raise ValueError(f"Invalid retention '{keep}'")
+        tier = RetentionTier(resolution.lower(), duration)
+        tier.relation  # validates the resolution
+        tiers.append(tier)
+    return tiers
+
+
+class RetentionRun(db.Model):
+    """
+    Outcome of applying one retention tier.
+    ---------------------------------------
+    Attributes:
+        id: Unique identifier
+        relation: Table or aggregate the tier applies to
+        method: 'drop_chunks', 'drop_partitions' or 'batched_delete'
+        cutoff: Data older than this was removed
+        started_at: Start of the run
+        duration_ms: Wall time of the run
+        chunks_dropped: Chunks or partitions dropped whole
+        rows_deleted: Rows removed by batched deletes
+        complete: False when the run stopped at its time budget
+        error: Error message of a failed run
+    """
+    __tablename__ = 'retention_runs'
+
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    relation: Mapped[str] = mapped_column(db.String(128), nullable=False)
+    method: Mapped[str] = mapped_column(db.String(20), nullable=False)
+    cutoff: Mapped[datetime] = mapped_column(db.DateTime(timezone=True),
+                                             nullable=False)
+    started_at: Mapped[datetime] = mapped_column(
+        db.DateTime(timezone=True), nullable=False, index=True)
+    duration_ms: Mapped[int] = mapped_column(db.Integer, default=0)
+    chunks_dropped: Mapped[int] = mapped_column(db.Integer, default=0)
+    rows_deleted: Mapped[int] = mapped_column(db.BigInteger, default=0)
+    complete: Mapped[bool] = mapped_column(db.Boolean, default=True)
+    error: Mapped[Optional[str]] = mapped_column(db.Text, default=None)
+
+    @classmethod
+    def apply(cls, tier: RetentionTier, batch_size: int = 10000,
+              max_seconds: float = 60.0) -> Optional['RetentionRun']:
+        """
+        Apply a tier and record the run
+
+        Args:
+            tier: Tier to apply; tiers kept forever are skipped
+            batch_size: Rows per DELETE when chunks cannot be dropped
+            max_seconds: Time budget of batched deletes
+
+        Returns:
+            The committed run, or None when there was nothing to do
+        """
+        if tier.keep is None:
+            return None
+        relation = tier.relation
+        if relation != Metric.__tablename__ and relation not in {
+                view.name for view in aggregate_registry.views()}:
+            return None  # aggregate does not exist in this database
+
+        started = datetime.now(timezone.utc)
+        began = time.monotonic()
+        run = cls(relation=relation, method='', cutoff=started - tier.keep,
+                  started_at=started)
+        try:
+            if relation == Metric.__tablename__:
+                # Roll raw rows up before they disappear
+                Metric.downsample_metrics(run.cutoff)
+                if current_app.config.get('ARCHIVE_ENABLED'):
+                    # Whole days only, so no row is deleted unarchived
+                    run.cutoff = align_down(run.cutoff, ARCHIVE_DAY)
+                    Metric.archive_closed_days(run.cutoff)
+                result = Metric.cleanup_old_data(
+                    run.cutoff, batch_size=batch_size,
+                    deadline=began + max_seconds)
+            else:
+                result = drop_chunks(relation, run.cutoff)
+            run.method = result['method']
+            run.chunks_dropped = result.get('chunks_dropped', 0)
+            run.rows_deleted = result.get('rows_deleted', 0)
+            run.complete = result.get('complete', True)
+        except (SQLAlchemyError, OSError) as e:
+            db.session.rollback()
+            run.method = run.method or 'failed'
+            run.error = str(e)
+        run.duration_ms = int((time.monotonic() - began) * 1000)
+        db.session.add(run)
+        db.session.commit()
+        return run
+
+    def to_dict(self) -> Dict:
+        """Convert run to dictionary"""
+        return {
+            'relation': self.relation,
+            'method': self.method,
+            'cutoff': self.cutoff.isoformat(),
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': self.duration_ms,
+            'chunks_dropped': self.chunks_dropped,
+            'rows_deleted': self.rows_deleted,
+            'complete': self.complete,
+            'error': self.error
+        }
+
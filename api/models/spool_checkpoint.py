@@ -0,0 +1,31 @@
+"""
+    Module for spool replay checkpoints
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from sqlalchemy.orm import mapped_column, Mapped
+from models import db
+
+
+class SpoolCheckpoint(db.Model):
+    """
+    Replay position of an ingest spool.
+    -----------------------------------
+    Updated in the same transaction as the rows it covers, so a crash
+    during replay can never insert a spooled reading twice.
+
+    Attributes:
+        name: Spool name (one per ingest process)
+        segment: Segment sequence number being replayed
+        position: Rows of that segment already written, in replay order
+        updated_at: Time of the last replayed batch
+    """
+    __tablename__ = 'spool_checkpoints'
+
+    name: Mapped[str] = mapped_column(db.String(128), primary_key=True)
+    segment: Mapped[int] = mapped_column(db.BigInteger, default=0)
+    position: Mapped[int] = mapped_column(db.Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(
+        db.DateTime(timezone=True),
+        default_factory=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc))
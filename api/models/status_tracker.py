@@ -0,0 +1,130 @@
+"""
+    Rolling-window state used to derive device status
+"""
+from __future__ import annotations
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+
+def _as_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Treat naive timestamps (as SQLite returns them) as UTC"""
+    if timestamp is not None and timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+class StatusTracker:
+    """
+    In-memory window of recent readings per (device, metric type).
+    ---------------------------------------------------------------
+    Each reading is appended once and evicted once, so keeping the
+    window up to date is amortised O(1) per reading instead of a query
+    over the whole window. The tracker also remembers the status and
+    last_seen last written for every device so callers only write rows
+    that actually change.
+    """
+
+    def __init__(self, window: timedelta):
+        self.window = window
+        self._readings: Dict[Tuple[int, int],
+                             Deque[Tuple[datetime, float]]] = {}
+        self._persisted: Dict[int, Tuple[Optional[str],
+                                         Optional[datetime]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, device_id: int, metric_type_id: int,
+                timestamp: datetime, value: float) -> Optional[float]:
+        """
+        Add a reading and return the relative change across the window
+
+        Returns:
+            abs((oldest - newest) / newest), or None when the window holds
+            fewer than two readings or the newest value is zero
+        """
+        timestamp = _as_utc(timestamp)
+
+        with self._lock:
+            readings = self._readings.setdefault((device_id, metric_type_id),
+                                                 deque())
+            if readings and timestamp < readings[-1][0]:
+                # Late reading: insert in order, scanning from the newest
+                # end where redelivered readings usually land
+                position = len(readings) - 1
+                while position > 0 and readings[position - 1][0] > timestamp:
+                    position -= 1
+                readings.insert(position, (timestamp, value))
+            else:
+                readings.append((timestamp, value))
+
+            cutoff = readings[-1][0] - self.window
+            while readings and readings[0][0] < cutoff:
+                readings.popleft()
+
+            if len(readings) < 2:
+                return None
+            newest = readings[-1][1]
+            oldest = readings[0][1]
+
+        if newest == 0:
+            return None
+        return abs((oldest - newest) / newest)
+
+    def needs_write(self, device_id: int, status: Optional[str],
+                    last_seen: datetime, resolution: timedelta) -> bool:
+        """
+        Check whether a device row differs from what was last written
+
+        last_seen only counts as changed once it has moved by at least
+        ``resolution``, so a steady stream of readings does not rewrite
+        the device row on every batch.
+        """
+        last_seen = _as_utc(last_seen)
+        with self._lock:
+            persisted_status, persisted_seen = \
+                self._persisted.get(device_id, (None, None))
+        if status is not None and status != persisted_status:
+            return True
+        return persisted_seen is None or \
+            last_seen - persisted_seen >= resolution
+
+    def mark_written(self, device_id: int, status: Optional[str],
+                     last_seen: datetime) -> None:
+        """Remember the values last written for a device"""
+        last_seen = _as_utc(last_seen)
+        with self._lock:
+            persisted_status, persisted_seen = \
+                self._persisted.get(device_id, (None, None))
+            if status is None:
+                status = persisted_status
+            if persisted_seen is not None and persisted_seen > last_seen:
+                last_seen = persisted_seen
+            self._persisted[device_id] = (status, last_seen)
+
+    def forget(self, device_id: int) -> None:
+        """Drop all state for a device"""
+        with self._lock:
+            self._persisted.pop(device_id, None)
+            for key in [key for key in self._readings
+                        if key[0] == device_id]:
+                del self._readings[key]
+
+    def rebuild(self,
+                readings: Iterable[Tuple[int, int, datetime, float]],
+                devices: Iterable[Tuple[int, str, datetime]]) -> None:
+        """
+        Reset the tracker from stored data
+
+        Args:
+            readings: (device_id, metric_type_id, timestamp, value) rows in
+                ascending timestamp order, covering at least the window
+            devices: (device_id, status, last_seen) rows
+        """
+        with self._lock:
+            self._readings.clear()
+            self._persisted = {
+                device_id: (status, _as_utc(last_seen))
+                for device_id, status, last_seen in devices
+            }
+        for device_id, metric_type_id, timestamp, value in readings:
+            self.observe(device_id, metric_type_id, timestamp, value)
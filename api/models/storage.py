@@ -0,0 +1,268 @@
+"""
+    Storage backends for the metrics table
+
+TimescaleBackend uses time_bucket, hypertable chunks and continuous
+aggregates. PortableBackend runs on plain PostgreSQL and SQLite: buckets
+are computed with epoch arithmetic aligned like time_bucket, and on
+PostgreSQL a metrics table partitioned by week (see
+migrations/002_partition_metrics.sql) gets its partitions created ahead
+of time and dropped whole by retention. Everything else falls back to
+bounded, batched deletes.
+"""
+from __future__ import annotations
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from flask import current_app
+from sqlalchemy import (JSON, DateTime, Integer, Table, TypeDecorator,
+                        cast, delete, func, select, text, type_coerce)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import ColumnElement
+from models import db
+from models.aggregates import (BUCKET_ORIGIN, REFRESH_BUCKETS,
+                               aggregate_registry,
+                               align_down, align_up, drop_chunks,
+                               is_hypertable, parse_interval)
+
+
+logger = logging.getLogger(__name__)
+
+# JSONB on PostgreSQL, JSON text elsewhere
+JSONDocument = JSON().with_variant(JSONB(), 'postgresql')
+
+
+class UTCDateTime(TypeDecorator):
+    """
+    timestamptz that binds and returns aware UTC datetimes
+
+    SQLite stores datetimes as text and drops the offset, so a value is
+    converted to UTC before it is bound (in inserts and comparisons
+    alike) and naive results are read back as UTC.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[datetime],
+                           dialect) -> Optional[datetime]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+    def process_result_value(self, value: Optional[datetime],
+                             dialect) -> Optional[datetime]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+PARTITION_WIDTH = timedelta(weeks=1)
+PARTITION_AHEAD = 2  # weeks of partitions created in advance
+
+
+class StorageBackend:
+    """Database specific parts of storing and aggregating metrics"""
+    name = 'base'
+
+    def bucket(self, interval: str, column: ColumnElement) -> ColumnElement:
+        """Start of the ``interval`` bucket containing ``column``"""
+        raise NotImplementedError
+
+    def maintain(self, table: Table) -> None:
+        """Prepare storage for upcoming data (e.g. create partitions)"""
+
+    def refresh_aggregates(self, older_than: datetime,
+                           newer_than: Optional[datetime] = None) -> List[str]:
+        """
+        Materialize aggregates over rows older than ``older_than``
+
+        Used before data is removed, and with ``newer_than`` for late
+        rows written behind the aggregates' refresh window.
+
+        Returns:
+            Names of the refreshed aggregates
+        """
+        return []
+
+    def drop_older_than(self, table: Table, older_than: datetime,
+                        batch_size: int = 10000,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Remove rows older than ``older_than``"""
+        return self._batched_delete(table, older_than, batch_size, deadline)
+
+    @staticmethod
+    def _batched_delete(table: Table, older_than: datetime, batch_size: int,
+                        deadline: Optional[float]) -> Dict[str, Any]:
+        """Delete in batches, committing after each, until the deadline"""
+        deleted = 0
+        while True:
+            oldest = select(table.c.id)\
+                .where(table.c.timestamp < older_than).limit(batch_size)
+            count = db.session.execute(
+                delete(table).where(table.c.id.in_(oldest)),
+                execution_options={'synchronize_session': False}).rowcount
+            db.session.commit()
+            deleted += count
+            if count < batch_size:
+                complete = True
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                complete = False
+                break
+        return {'method': 'batched_delete', 'rows_deleted': deleted,
+                'complete': complete}
+
+
+class TimescaleBackend(StorageBackend):
+    """Hypertable with chunks and continuous aggregates"""
+    name = 'timescale'
+
+    def bucket(self, interval: str, column: ColumnElement) -> ColumnElement:
+        return func.time_bucket(interval, column)
+
+    def refresh_aggregates(self, older_than: datetime,
+                           newer_than: Optional[datetime] = None) -> List[str]:
+        views = aggregate_registry.views()
+        if newer_than is not None:
+            # The policy still covers its last REFRESH_BUCKETS buckets
+            now = datetime.now(timezone.utc)
+            views = [view for view in views if newer_than <
+                     align_down(now, view.bucket)
+                     - REFRESH_BUCKETS * view.bucket]
+        if not views:
+            return []
+        # refresh_continuous_aggregate cannot run inside a transaction
+        with db.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as connection:
+            for view in views:
+                connection.execute(
+                    text("CALL refresh_continuous_aggregate("
+                         "CAST(:view AS regclass), :window_start, "
+                         ":window_end)"),
+                    {'view': view.name,
+                     'window_start': align_down(newer_than, view.bucket)
+                     if newer_than is not None else None,
+                     'window_end': align_up(older_than, view.bucket)})
+        return [view.name for view in views]
+
+    def drop_older_than(self, table: Table, older_than: datetime,
+                        batch_size: int = 10000,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        return drop_chunks(table.name, older_than)
+
+
+class PortableBackend(StorageBackend):
+    """Plain PostgreSQL (optionally partitioned by week) or SQLite"""
+    name = 'portable'
+
+    def bucket(self, interval: str, column: ColumnElement) -> ColumnElement:
+        width = parse_interval(interval)
+        if width is None:
+            raise ValueError(f"Interval '{interval}' has no fixed length")
+        seconds = int(width.total_seconds())
+        origin = int(BUCKET_ORIGIN.timestamp())
+        if db.session.get_bind().dialect.name == 'postgresql':
+            epoch = func.extract('epoch', column)
+            return func.to_timestamp(
+                func.floor((epoch - origin) / seconds) * seconds + origin)
+        # SQLite: integer division of non-negative offsets is floor
+        epoch = cast(func.strftime('%s', column), Integer)
+        return type_coerce(
+            func.datetime((epoch - origin) // seconds * seconds + origin,
+                          'unixepoch'),
+            DateTime(timezone=True))
+
+    def maintain(self, table: Table) -> None:
+        if not self._is_partitioned(table):
+            return
+        start = align_down(datetime.now(timezone.utc) - PARTITION_WIDTH,
+                           PARTITION_WIDTH)
+        for week in range(PARTITION_AHEAD + 2):
+            lower = start + week * PARTITION_WIDTH
+            name = self._partition_name(table, lower)
+            try:
+                # Partition bounds cannot be bind parameters
+                db.session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF "
+                    f"{table.name} FOR VALUES FROM ('{lower.isoformat()}') "
+                    f"TO ('{(lower + PARTITION_WIDTH).isoformat()}')"))
+                db.session.commit()
+            except SQLAlchemyError as e:
+                # e.g. rows for this week already sit in the default
+                db.session.rollback()
+                logger.error(f"Failed to create partition {name}: {str(e)}")
+
+    def drop_older_than(self, table: Table, older_than: datetime,
+                        batch_size: int = 10000,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        dropped = 0
+        if self._is_partitioned(table):
+            for name, lower in self._partitions(table):
+                if lower + PARTITION_WIDTH <= older_than:
+                    db.session.execute(text(f"DROP TABLE {name}"))
+                    db.session.commit()
+                    dropped += 1
+        # Rows of the partially expired week (or of an unpartitioned table)
+        result = self._batched_delete(table, older_than, batch_size,
+                                      deadline)
+        if dropped:
+            result.update(method='drop_partitions', chunks_dropped=dropped)
+        return result
+
+    @staticmethod
+    def _partition_name(table: Table, lower: datetime) -> str:
+        return f"{table.name}_p{lower:%Y%m%d}"
+
+    @staticmethod
+    def _is_partitioned(table: Table) -> bool:
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return False
+        return db.session.execute(text(
+            "SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = CAST(:name AS regclass)"
+        ), {'name': table.name}).first() is not None
+
+    def _partitions(self, table: Table) -> List[tuple]:
+        """Weekly partitions as (name, lower bound), by naming convention"""
+        rows = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:name AS regclass)"
+        ), {'name': table.name})
+        partitions = []
+        prefix = f"{table.name}_p"
+        for (name,) in rows:
+            try:
+                lower = datetime.strptime(name[len(prefix):], '%Y%m%d')
+            except ValueError:
+                continue  # default or foreign partitions
+            partitions.append((name, lower.replace(tzinfo=timezone.utc)))
+        return sorted(partitions, key=lambda p: p[1])
+
+
+BACKENDS = {'timescale': TimescaleBackend, 'portable': PortableBackend}
+_backends: Dict[int, StorageBackend] = {}
+
+
+def get_backend() -> StorageBackend:
+    """
+    Backend for the current database
+
+    METRIC_STORAGE_BACKEND selects one explicitly; 'auto' uses Timescale
+    when the metrics table is a hypertable and the portable backend
+    otherwise. The choice is made once per engine.
+    """
+    engine = db.engine
+    backend = _backends.get(id(engine))
+    if backend is None:
+        choice = current_app.config.get('METRIC_STORAGE_BACKEND', 'auto')
+        if choice == 'auto':
+            choice = 'timescale' if is_hypertable('metrics') else 'portable'
+        backend = BACKENDS[choice]()
+        _backends[id(engine)] = backend
+        logger.info(f"Using {backend.name} metric storage")
+    return backend
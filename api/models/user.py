@@ -8,9 +8,9 @@ from datetime import datetime, timedelta, timezone
 from flask_bcrypt import Bcrypt
 from sqlalchemy import event, Index, text
 from sqlalchemy.orm import mapped_column, relationship, validates, Mapped
-from sqlalchemy.dialects.postgresql import JSONB
 import jwt
 from models import db
+from models.storage import JSONDocument
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -56,7 +56,7 @@ class User(db.Model):
         nullable=False
     )
     user_metadata: Mapped[Dict] = mapped_column(
-    JSONB,
+    JSONDocument,
     default=dict,
     nullable=False
     )
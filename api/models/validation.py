@@ -0,0 +1,114 @@
+"""
+    Batch validation of metric rows against MetricType.validation_rules
+"""
+from __future__ import annotations
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """Validation rules of one metric type, parsed once"""
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    allow_non_finite: bool = False
+
+    def check(self, value: float) -> Optional[str]:
+        """Return the rejection reason for a single value, if any"""
+        if not self.allow_non_finite and not np.isfinite(value):
+            return f"Value {value} is not finite"
+        if self.minimum is not None and value < self.minimum:
+            return f"Value {value} below minimum {self.minimum}"
+        if self.maximum is not None and value > self.maximum:
+            return f"Value {value} above maximum {self.maximum}"
+        return None
+
+    def reject_masks(self, values: np.ndarray) -> List[Tuple[str,
+                                                             np.ndarray]]:
+        """Return (reason, mask) pairs for a column of values"""
+        masks = []
+        if not self.allow_non_finite:
+            masks.append(('not_finite', ~np.isfinite(values)))
+        # NaN compares False, so it never also counts as out of range
+        if self.minimum is not None:
+            masks.append(('below_minimum', values < self.minimum))
+        if self.maximum is not None:
+            masks.append(('above_maximum', values > self.maximum))
+        return masks
+
+
+@lru_cache(maxsize=1024)
+def _compile(rules_json: str) -> CompiledRules:
+    rules = json.loads(rules_json)
+    return CompiledRules(
+        minimum=float(rules['min']) if 'min' in rules else None,
+        maximum=float(rules['max']) if 'max' in rules else None,
+        allow_non_finite=bool(rules.get('allow_non_finite', False))
+    )
+
+
+def compile_rules(rules: Optional[Dict[str, Any]]) -> CompiledRules:
+    """Compile a validation_rules document, memoised by content"""
+    return _compile(json.dumps(rules or {}, sort_keys=True))
+
+
+@dataclass
+class Rejection:
+    """A row that failed validation"""
+    row: Dict[str, Any]
+    reason: str
+
+
+@dataclass
+class ValidationReport:
+    """Outcome of validating a batch"""
+    accepted: int = 0
+    rejected: List[Rejection] = field(default_factory=list)
+
+    def reasons(self) -> Dict[str, int]:
+        """Count rejections per reason"""
+        return dict(Counter(rejection.reason for rejection in self.rejected))
+
+
+def validate_batch(rows: List[Dict[str, Any]],
+                   rules_for: Callable[[int], Optional[Dict[str, Any]]])\
+        -> Tuple[List[Dict[str, Any]], ValidationReport]:
+    """
+    Validate metric rows column-wise, one metric type at a time
+
+    Args:
+        rows: Metric mappings with 'metric_type_id' and 'value'
+        rules_for: Returns the validation_rules of a metric type id
+
+    Returns:
+        Accepted rows in their original order and a rejection report
+    """
+    report = ValidationReport()
+    if not rows:
+        return rows, report
+
+    type_ids = np.fromiter((row['metric_type_id'] for row in rows),
+                           dtype=np.int64, count=len(rows))
+    values = np.fromiter((row['value'] for row in rows),
+                         dtype=np.float64, count=len(rows))
+    reasons = np.full(len(rows), None, dtype=object)
+
+    for type_id in np.unique(type_ids):
+        positions = np.flatnonzero(type_ids == type_id)
+        rules = compile_rules(rules_for(int(type_id)))
+        # Apply in reverse so the first failing rule is the one reported
+        for reason, mask in reversed(rules.reject_masks(values[positions])):
+            reasons[positions[mask]] = reason
+
+    accepted = []
+    for row, reason in zip(rows, reasons):
+        if reason is None:
+            accepted.append(row)
+        else:
+            report.rejected.append(Rejection(row=row, reason=reason))
+    report.accepted = len(accepted)
+    return accepted, report
@@ -1,18 +1,57 @@
 """
 Data manipulation routes
 """
-from flask import Blueprint, request, jsonify
+import json
+from datetime import datetime, timedelta, timezone
+from flask import (Blueprint, Response, request, jsonify,
+                   stream_with_context)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.device import Device
-from models.metric import Metric
-from typing import Dict, Union, Tuple
+from models.metric import Metric, MetricType
+from models.aggregates import parse_interval
+from models.downsampling import METHODS as DOWNSAMPLE_METHODS
+from services.conditional import make_etag, not_modified, with_validators
+from services.response_cache import response_cache
+from services.export import (ENCODERS, EXPORT_FORMATS, available_formats,
+                             gzip_stream)
+from typing import Dict, List, Optional, Union, Tuple
 
 
 data = Blueprint('data', __name__)
 
+MAX_PER_PAGE = 1000
+MAX_STATS_BUCKETS = 100000
+MAX_SERIES_POINTS = 10000
+
+
+def _parse_time(value: Optional[str], default: datetime) -> datetime:
+    """Parse an ISO-8601 query argument, treating naive times as UTC"""
+    if not value:
+        return default
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def _page_size() -> int:
+    """per_page query argument, clamped to 1..MAX_PER_PAGE"""
+    per_page = request.args.get('per_page', 10, type=int)
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def _device_tags(user_id, view_args, body) -> List[str]:
+    return [f"device:{int(view_args['device_id'])}"]
+
+
+def _parse_list(value: Optional[str]) -> List[str]:
+    """Split a comma separated query argument"""
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
 
 @data.route('/data/<device_id>', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=_device_tags)
 def get_device_data(device_id: int) -> Union[Dict[str,
                                              Union[int, str, float]],
                                              Tuple[Dict[str, str], int]]:
@@ -29,10 +68,197 @@ def get_device_data(device_id: int) -> Union[Dict[str,
     if not device or device.user_id != user_id:
         return jsonify({'message': 'Device not found'}), 404
 
+    # Unchanged since the client's copy: answer before querying metrics
+    etag = make_etag('data', device.id, device.data_version)
+    unchanged = not_modified(etag, device.data_updated_at)
+    if unchanged is not None:
+        return unchanged
+
     # Retrieve metrics for the device.
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    query = Metric.query.filter_by(device_id=device_id).order_by(
-        Metric.timestamp.desc())
-    data = Metric.to_dict(query, page, per_page)
-    return jsonify(data), 200
+    per_page = _page_size()
+    query = Metric.query.filter_by(device_id=device_id)
+
+    # Offset paging is kept for clients that still send page numbers
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        data = Metric.get_paginated_results(
+            query.order_by(Metric.timestamp.desc()), page, per_page)
+        return with_validators(jsonify(data), etag,
+                               device.data_updated_at), 200
+
+    include_total = request.args.get('include_total', 'false').lower() \
+        in ('1', 'true', 'yes')
+    try:
+        data = Metric.get_keyset_page(query, per_page,
+                                      cursor=request.args.get('cursor'),
+                                      include_total=include_total)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return with_validators(jsonify(data), etag, device.data_updated_at), 200
+
+
+@data.route('/data/stats', methods=['GET'])
+@jwt_required()
+def get_multi_device_stats() -> Union[Response, Tuple[Dict[str, str], int]]:
+    """
+    Get bucketed statistics for several devices at once.
+    ----------------------------------------------------
+    :param device_ids: Comma separated device ids (default all devices).
+    :param metric_types: Comma separated metric type names (default all).
+    :param start: ISO-8601 start of the range (default 24 hours ago).
+    :param end: ISO-8601 end of the range (default now).
+    :param interval: Bucket width such as '15 minutes' (default '1 hour').
+    :return: An NDJSON stream with one line per device, metric and bucket.
+    """
+    user_id: str = get_jwt_identity()
+    try:
+        requested = [int(i) for i in
+                     _parse_list(request.args.get('device_ids'))]
+        end = _parse_time(request.args.get('end'),
+                          datetime.now(timezone.utc))
+        start = _parse_time(request.args.get('start'),
+                            end - timedelta(days=1))
+    except ValueError:
+        return jsonify({'message': 'Invalid device id or time'}), 400
+
+    interval = request.args.get('interval', '1 hour')
+    bucket = parse_interval(interval)
+    if bucket is None or start >= end:
+        return jsonify({'message': 'Invalid interval or time range'}), 400
+
+    devices = Device.query.with_entities(Device.id)\
+        .filter(Device.user_id == user_id)
+    if requested:
+        devices = devices.filter(Device.id.in_(requested))
+    device_ids = [d.id for d in devices]
+    if requested and len(device_ids) != len(set(requested)):
+        return jsonify({'message': 'Device not found'}), 404
+
+    types = MetricType.query.with_entities(MetricType.id)
+    names = _parse_list(request.args.get('metric_types'))
+    if names:
+        types = types.filter(MetricType.name.in_(names))
+    metric_type_ids = [t.id for t in types]
+    if names and len(metric_type_ids) != len(set(names)):
+        return jsonify({'message': 'Unknown metric type'}), 400
+
+    buckets = (end - start) / bucket
+    if buckets * len(device_ids) * len(metric_type_ids) > MAX_STATS_BUCKETS:
+        return jsonify({'message': 'Too many buckets requested'}), 400
+
+    def generate():
+        for row in Metric.iter_multi_device_stats(
+                device_ids, metric_type_ids, start, end, interval):
+            yield json.dumps(row) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@data.route('/data/<device_id>/series', methods=['GET'])
+@jwt_required()
+def get_device_series(device_id: int) -> Union[Dict[str, object],
+                                               Tuple[Dict[str, str], int]]:
+    """
+    Get a chart-sized, downsampled series for a device.
+    ---------------------------------------------------
+    :param device_id: The ID of the device to retrieve the series for.
+    :param metric_type: Name of the metric type to plot (required).
+    :param points: Maximum number of points to return (default 1000).
+    :param mode: 'lttb' (default) or 'minmax'.
+    :return: A JSON response with at most ``points`` points in time order.
+    """
+    user_id: str = get_jwt_identity()
+    device: Device = Device.query.get(device_id)
+
+    # Check if device exists and belongs to the user.
+    if not device or device.user_id != user_id:
+        return jsonify({'message': 'Device not found'}), 404
+
+    metric_type = MetricType.query.filter_by(
+        name=request.args.get('metric_type')).first()
+    if not metric_type:
+        return jsonify({'message': 'Unknown metric type'}), 400
+
+    mode = request.args.get('mode', 'lttb')
+    points = min(request.args.get('points', 1000, type=int),
+                 MAX_SERIES_POINTS)
+    if mode not in DOWNSAMPLE_METHODS or points < 3:
+        return jsonify({'message': 'Invalid mode or points'}), 400
+    try:
+        end = _parse_time(request.args.get('end'),
+                          datetime.now(timezone.utc))
+        start = _parse_time(request.args.get('start'),
+                            end - timedelta(days=1))
+    except ValueError:
+        return jsonify({'message': 'Invalid time'}), 400
+    if start >= end:
+        return jsonify({'message': 'Invalid time range'}), 400
+
+    series = Metric.get_series(device.id, metric_type.id, start, end,
+                               points, mode)
+    return jsonify({
+        'device_id': device.id,
+        'metric_type': metric_type.name,
+        'mode': mode,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'points': series
+    }), 200
+
+
+@data.route('/data/<device_id>/export', methods=['GET'])
+@jwt_required()
+def export_device_data(device_id: int) -> Union[Response,
+                                                Tuple[Dict[str, str], int]]:
+    """
+    Export raw readings of a device as a stream.
+    --------------------------------------------
+    :param device_id: The ID of the device to export.
+    :param format: 'ndjson' (default), 'csv' or 'arrow'.
+    :param metric_types: Comma separated metric type names (default all).
+    :param start: ISO-8601 start of the range (default 24 hours ago).
+    :param end: ISO-8601 end of the range (default now).
+    :param gzip: Compress the stream with gzip (default false).
+    :return: A streamed file in the requested format.
+    """
+    user_id: str = get_jwt_identity()
+    device: Device = Device.query.get(device_id)
+
+    # Check if device exists and belongs to the user.
+    if not device or device.user_id != user_id:
+        return jsonify({'message': 'Device not found'}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in available_formats():
+        return jsonify({'message': 'Unsupported format'}), 400
+    try:
+        end = _parse_time(request.args.get('end'),
+                          datetime.now(timezone.utc))
+        start = _parse_time(request.args.get('start'),
+                            end - timedelta(days=1))
+    except ValueError:
+        return jsonify({'message': 'Invalid time'}), 400
+    if start >= end:
+        return jsonify({'message': 'Invalid time range'}), 400
+
+    metric_type_ids = None
+    names = _parse_list(request.args.get('metric_types'))
+    if names:
+        metric_type_ids = [t.id for t in MetricType.query.with_entities(
+            MetricType.id).filter(MetricType.name.in_(names))]
+        if len(metric_type_ids) != len(set(names)):
+            return jsonify({'message': 'Unknown metric type'}), 400
+
+    chunks = Metric.iter_export_chunks(device.id, metric_type_ids,
+                                       start, end)
+    body = ENCODERS[export_format](chunks)
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    headers = {'Content-Disposition':
+               f'attachment; filename=device-{device.id}.{extension}'}
+    if request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes'):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers=headers)
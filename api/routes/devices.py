@@ -1,12 +1,31 @@
 from flask import Blueprint, request, jsonify
 from models.user import User
 from models.device import Device
+from models.latest_metric import LatestMetric
+from models.metric import Metric
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.conditional import make_etag, not_modified, with_validators
+from services.response_cache import response_cache
 from typing import Dict, Union, List, Tuple
 
 devices = Blueprint('devices', __name__)
 
 
+def _device_list_tags(user_id, view_args, body) -> List[str]:
+    """A listing changes with any of its devices or the set of devices"""
+    return [f"user:{user_id}"] + [f"device:{d['id']}" for d in body]
+
+
+def _device_tags(user_id, view_args, body) -> List[str]:
+    return [f"device:{int(view_args['device_id'])}"]
+
+
+def _fleet_etag(kind: str, devices: List[Device]) -> str:
+    """Changes with any device row, data watermark or activity state"""
+    return make_etag(kind, request.args.to_dict(),
+                     [(d.to_dict(), d.data_version) for d in devices])
+
+
 @devices.route('/devices', methods=['POST'])
 @jwt_required()
 def add_device() -> Union[Dict[str, Union[str, int]],
@@ -37,6 +56,7 @@ def add_device() -> Union[Dict[str, Union[str, int]],
 
 @devices.route('/devices', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=_device_list_tags)
 def get_devices() -> Union[List[Dict[str, Union[int, str]]],
                            Tuple[Dict[str, str], int]]:
     """
@@ -50,13 +70,43 @@ def get_devices() -> Union[List[Dict[str, Union[int, str]]],
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    devices: List[Dict[str, Union[int, str]]] = [device.to_dict()
-                                                 for device in user.devices]
-    return jsonify(devices), 200
+    include_metrics = request.args.get('include_metrics', 'false').lower() \
+        in ('1', 'true', 'yes')
+    # user.devices is a dynamic query, so load it exactly once
+    user_devices: List[Device] = user.devices.all()
+    etag = _fleet_etag('devices', user_devices)
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    device_ids = [device.id for device in user_devices]
+    latest = LatestMetric.for_devices(device_ids) \
+        if include_metrics else None
+    recent = Metric.recent_for_devices(device_ids) \
+        if include_metrics else None
+    devices: List[Dict[str, Union[int, str]]] = [
+        device.to_dict(include_metrics, latest, recent)
+        for device in user_devices]
+    return with_validators(jsonify(devices), etag), 200
+
+
+@devices.route('/devices/summary', methods=['GET'])
+@jwt_required()
+@response_cache.cached(tags=_device_list_tags)
+def get_fleet_summary() -> Union[List[Dict[str, object]],
+                                 Tuple[Dict[str, str], int]]:
+    """
+    Get status, latest readings and 24 h min/max of every device.
+    -------------------------------------------------------------
+    :return: A JSON response containing one summary per device.
+    """
+    user_id: int = get_jwt_identity()
+    return jsonify(Device.fleet_summary(user_id)), 200
 
 
 @devices.route('/<int:device_id>', methods=['GET'])
 @jwt_required()
+@response_cache.cached(tags=_device_tags)
 def get_device(device_id) -> Union[Dict[str, Union[int, str]],
                                    Tuple[Dict[str, str], int]]:
     """
@@ -80,7 +130,7 @@ def get_device(device_id) -> Union[Dict[str, Union[int, str]],
 
 
 @devices.route('/<int:device_id>', methods=['DELETE'])
-@jwt_required
+@jwt_required()
 def remove_device(device_id) -> Union[Dict[str, str],
                                       Tuple[Dict[str, str], int]]:
     """
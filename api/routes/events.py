@@ -0,0 +1,71 @@
+"""
+Real-time event stream routes
+"""
+import json
+import time
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from models.device import Device
+from services.event_hub import event_hub
+from typing import Dict, List, Tuple, Union
+
+events = Blueprint('events', __name__)
+
+
+@events.route('/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_events() -> Union[Response, Tuple[Dict[str, str], int]]:
+    """
+    Stream new readings and status changes as server-sent events.
+    -------------------------------------------------------------
+    :param device_ids: Comma separated device ids (default all devices).
+    :param token: Access token, for clients that cannot set headers.
+    :return: A text/event-stream of 'reading' and 'status' events,
+        ended by an 'expired' event once the access token expires.
+    """
+    user_id: str = get_jwt_identity()
+    try:
+        requested = {int(i) for i in
+                     request.args.get('device_ids', '').split(',')
+                     if i.strip()}
+    except ValueError:
+        return jsonify({'message': 'Invalid device id'}), 400
+
+    devices = Device.query.with_entities(Device.id)\
+        .filter(Device.user_id == user_id)
+    if requested:
+        devices = devices.filter(Device.id.in_(requested))
+    device_ids: List[int] = [d.id for d in devices]
+    if requested and len(device_ids) != len(requested):
+        return jsonify({'message': 'Device not found'}), 404
+
+    keepalive = current_app.config['EVENT_KEEPALIVE']
+    expires = get_jwt().get('exp')
+    subscription = event_hub.subscribe(user_id, device_ids)
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while not subscription.closed:
+                # The token is only checked on connect, so end the stream
+                # ourselves when it expires; the client has to reconnect
+                timeout = keepalive
+                if expires is not None:
+                    remaining = expires - time.time()
+                    if remaining <= 0:
+                        yield 'event: expired\ndata: {}\n\n'
+                        break
+                    timeout = min(keepalive, remaining)
+                batch = subscription.get(timeout=timeout)
+                if not batch:
+                    yield ': keepalive\n\n'
+                for event in batch:
+                    yield (f"event: {event['event']}\n"
+                           f"data: {json.dumps(event)}\n\n")
+        finally:
+            # Runs when the client disconnects and the generator is closed
+            event_hub.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
@@ -0,0 +1,34 @@
+"""
+Operational statistics routes
+"""
+from flask import Blueprint, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from services.event_hub import event_hub
+from services.lookup_cache import lookup_cache
+from services.response_cache import response_cache
+from typing import Dict, Any, Tuple
+
+system = Blueprint('system', __name__)
+
+
+@system.route('/system/stats', methods=['GET'])
+@jwt_required()
+def get_system_stats() -> Tuple[Dict[str, Any], int]:
+    """
+    Get ingest and cache counters for this process.
+    -----------------------------------------------
+    :return: A JSON response containing the counters.
+    """
+    stats: Dict[str, Any] = {'lookup_cache': lookup_cache.stats(),
+                             'response_cache': response_cache.stats(),
+                             'events': event_hub.stats()}
+
+    handler = getattr(current_app, 'mqtt_handler', None)
+    if handler is not None:
+        stats['writer'] = handler.writer.stats()
+
+    scheduler = getattr(current_app, 'retention_scheduler', None)
+    if scheduler is not None:
+        stats['retention'] = scheduler.stats()
+
+    return jsonify(stats), 200
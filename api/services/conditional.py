@@ -0,0 +1,45 @@
+"""Conditional GET helpers built on per-device data watermarks
+
+Routes derive a weak ETag from the ``data_version`` of the devices they
+read (bumped by the ingest writer with every committed batch) and check
+it against ``If-None-Match`` before touching the metrics table.
+"""
+from __future__ import annotations
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Optional
+from flask import Response, request
+
+
+def make_etag(*parts: Any) -> str:
+    """Stable ETag value for the given watermark parts"""
+    digest = hashlib.sha1(json.dumps(parts, default=str,
+                                     sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def not_modified(etag: str,
+                 last_modified: Optional[datetime] = None
+                 ) -> Optional[Response]:
+    """Return a 304 response when the client already has this version"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since:
+        fresh = last_modified.replace(microsecond=0) \
+            <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response: Response, etag: str,
+                    last_modified: Optional[datetime] = None) -> Response:
+    """Attach ETag/Last-Modified and ask clients to revalidate"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,161 @@
+"""In-process fan-out of committed readings and device status changes
+
+The metric writer publishes every committed batch once; each subscriber
+(one per open event stream) gets its own bounded buffer. Events are
+coalesced by key, so a slow consumer receives only the newest reading per
+(device, metric type) and the newest status per device instead of
+stalling the writer or growing without bound. Only readings ingested by
+this process are published, i.e. when MQTT runs in the API process.
+"""
+from __future__ import annotations
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set
+
+
+_subscription_ids = itertools.count(1)
+
+
+def _isoformat(moment: datetime) -> str:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.isoformat()
+
+
+class Subscription:
+    """Bounded, coalescing event buffer of one client"""
+
+    def __init__(self, user_id: Any, device_ids: Set[int],
+                 maxsize: int = 1000):
+        self.id = next(_subscription_ids)
+        self.user_id = user_id
+        self.device_ids = device_ids
+        self.maxsize = maxsize
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._events: OrderedDict = OrderedDict()
+        self._ready = threading.Condition()
+        self.closed = False
+
+    def push(self, key: Hashable, event: Dict[str, Any]) -> None:
+        """Buffer an event, replacing a pending one with the same key"""
+        with self._ready:
+            if key in self._events:
+                self.coalesced += 1
+                del self._events[key]
+            elif len(self._events) >= self.maxsize:
+                self._events.popitem(last=False)
+                self.dropped += 1
+            self._events[key] = event
+            self._ready.notify()
+
+    def get(self, timeout: float) -> List[Dict[str, Any]]:
+        """Wait up to ``timeout`` seconds and drain the buffer"""
+        with self._ready:
+            if not self._events and not self.closed:
+                self._ready.wait(timeout)
+            events = list(self._events.values())
+            self._events.clear()
+            self.delivered += len(events)
+            return events
+
+    def close(self) -> None:
+        """Wake a waiting reader so its stream can end"""
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+
+
+class EventHub:
+    """Routes published events to the subscriptions of each device"""
+
+    def __init__(self, buffer_size: int = 1000):
+        self.buffer_size = buffer_size
+        self.published = 0
+        self._by_device: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, buffer_size: int) -> None:
+        """Apply the per-subscriber buffer size from the app config"""
+        self.buffer_size = buffer_size
+
+    def subscribe(self, user_id: Any,
+                  device_ids: Iterable[int]) -> Subscription:
+        """Register a client for already authorized devices"""
+        subscription = Subscription(user_id, set(device_ids),
+                                    self.buffer_size)
+        with self._lock:
+            for device_id in subscription.device_ids:
+                self._by_device.setdefault(device_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a client and wake its reader"""
+        with self._lock:
+            for device_id in subscription.device_ids:
+                subscribers = self._by_device.get(device_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_device[device_id]
+        subscription.close()
+
+    def publish_readings(self, rows: List[Dict[str, Any]]) -> None:
+        """Publish committed metric rows to subscribers of their devices"""
+        if not self._by_device:
+            return
+        for row in rows:
+            subscribers = self._subscribers(row['device_id'])
+            if not subscribers:
+                continue
+            event = {
+                'event': 'reading',
+                'device_id': row['device_id'],
+                'metric_type_id': row['metric_type_id'],
+                'timestamp': _isoformat(row['timestamp']),
+                'value': row['value'],
+                'quality': row.get('quality', 1.0)
+            }
+            key = ('reading', row['device_id'], row['metric_type_id'])
+            for subscription in subscribers:
+                subscription.push(key, event)
+            self.published += 1
+
+    def publish_status(self, device_id: int, status: Optional[str],
+                       last_seen: datetime) -> None:
+        """Publish a device status or activity change"""
+        subscribers = self._subscribers(device_id)
+        if not subscribers:
+            return
+        event = {
+            'event': 'status',
+            'device_id': device_id,
+            'status': status,
+            'last_seen': _isoformat(last_seen)
+        }
+        for subscription in subscribers:
+            subscription.push(('status', device_id), event)
+        self.published += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return subscriber and delivery counters"""
+        with self._lock:
+            subscriptions = set().union(*self._by_device.values()) \
+                if self._by_device else set()
+        return {
+            'subscribers': len(subscriptions),
+            'devices': len(self._by_device),
+            'published': self.published,
+            'coalesced': sum(s.coalesced for s in subscriptions),
+            'dropped': sum(s.dropped for s in subscriptions)
+        }
+
+    def _subscribers(self, device_id: int) -> List[Subscription]:
+        with self._lock:
+            return list(self._by_device.get(device_id, ()))
+
+
+event_hub = EventHub()
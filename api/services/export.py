@@ -0,0 +1,111 @@
+"""Streaming encoders for bulk metric exports
+
+Rows arrive in chunks from a server-side cursor and are encoded chunk by
+chunk, so memory use depends on the chunk size and not on the range being
+exported. Rows are dictionaries keyed by ``EXPORT_COLUMNS`` with an aware
+``timestamp``; every encoder yields ``bytes``.
+"""
+from __future__ import annotations
+import csv
+import io
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+
+EXPORT_COLUMNS = ('timestamp', 'device_id', 'metric_type', 'value',
+                  'quality', 'metadata')
+
+ARROW_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('device_id', pa.int64()),
+    ('metric_type', pa.string()),
+    ('value', pa.float64()),
+    ('quality', pa.float64()),
+    ('metadata', pa.string()),
+]) if pa else None
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def available_formats() -> List[str]:
+    """Formats that can be produced with the installed packages"""
+    return [name for name in EXPORT_FORMATS if name != 'arrow' or pa]
+
+
+def encode_ndjson(chunks: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """One JSON document per row"""
+    for rows in chunks:
+        yield ''.join(
+            json.dumps(dict(row, timestamp=row['timestamp'].isoformat()))
+            + '\n' for row in rows).encode()
+
+
+def encode_csv(chunks: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """CSV with a header row; metadata is written as a JSON string"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([
+                row['timestamp'].isoformat(), row['device_id'],
+                row['metric_type'],
+                row['value'], row['quality'],
+                json.dumps(row['metadata']) if row['metadata'] else ''
+            ])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_arrow(chunks: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """Arrow IPC stream with one record batch per chunk"""
+    if pa is None:
+        raise ValueError("Arrow export requires the pyarrow package")
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, ARROW_SCHEMA)
+    for rows in chunks:
+        writer.write_batch(pa.record_batch([
+            [row['timestamp'] for row in rows],
+            [row['device_id'] for row in rows],
+            [row['metric_type'] for row in rows],
+            [row['value'] for row in rows],
+            [row['quality'] for row in rows],
+            [json.dumps(row['metadata']) if row['metadata'] else None
+             for row in rows],
+        ], schema=ARROW_SCHEMA))
+        yield _take(sink)
+    writer.close()
+    yield _take(sink)
+
+
+def _take(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+ENCODERS = {'ndjson': encode_ndjson, 'csv': encode_csv, 'arrow': encode_arrow}
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream into a single gzip member as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
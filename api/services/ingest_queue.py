@@ -0,0 +1,228 @@
+"""Bounded ingest queue with overload policies
+
+Sits between the MQTT callbacks and the metric writer. When the writer
+falls behind (for example because the database stalls) the queue applies
+a configurable overflow policy and, past a high watermark, pauses reading
+from the broker until it drains below a low watermark.
+"""
+from __future__ import annotations
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, deque
+from enum import Enum
+from typing import Any, Deque, Dict, List, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    """What to do with a reading when the queue is under pressure"""
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_LOWEST_QUALITY = 'drop_lowest_quality'
+    SAMPLE = 'sample'
+
+
+class IngestQueue:
+    """
+    Thread-safe bounded queue of metric rows.
+    -----------------------------------------
+    Policies:
+        block: wait up to ``block_timeout`` for space, then drop the reading
+        drop_oldest: evict the oldest queued reading
+        drop_lowest_quality: evict the queued reading with the lowest
+            quality (oldest first among equals), or the incoming one if
+            it is the worst; a (quality, sequence) heap finds it in
+            O(log n) and evicted rows are compacted away in bulk
+        sample: above the high watermark keep one reading in
+            ``sample_every`` per device; drop readings once full
+    """
+
+    def __init__(self, maxsize: int = 10000,
+                 policy: OverflowPolicy = OverflowPolicy.BLOCK,
+                 high_watermark: float = 0.8,
+                 low_watermark: float = 0.5,
+                 sample_every: int = 4,
+                 block_timeout: float = 5.0):
+        self.maxsize = maxsize
+        self.policy = OverflowPolicy(policy)
+        self.high_watermark = max(1, int(maxsize * high_watermark))
+        self.low_watermark = min(self.high_watermark - 1,
+                                 int(maxsize * low_watermark))
+        self.sample_every = max(1, sample_every)
+        self.block_timeout = block_timeout
+        self.accepted = 0
+        self.delayed = 0
+        self.dropped: Counter = Counter()
+        # Rows tagged with an increasing sequence number, oldest first
+        self._items: Deque[Tuple[int, Dict[str, Any]]] = deque()
+        self._size = 0
+        self._seq = 0
+        # drop_lowest_quality only: (quality, seq) of queued rows, plus
+        # entries of rows already dequeued, discarded when reached
+        self._quality_heap: List[Tuple[float, int]] = []
+        self._evicted: Set[int] = set()
+        self._paused = False
+        self._sample_counts: Counter = Counter()
+        self._cond = threading.Condition()
+
+    @property
+    def paused(self) -> bool:
+        """Whether reading from the broker should be paused"""
+        return self._paused
+
+    def qsize(self) -> int:
+        """Number of queued rows"""
+        return self._size
+
+    def put(self, row: Dict[str, Any]) -> bool:
+        """
+        Queue a row according to the overflow policy
+
+        Returns:
+            True if the row was queued, False if it was dropped
+        """
+        with self._cond:
+            if self.policy == OverflowPolicy.SAMPLE and \
+               self._size >= self.high_watermark:
+                device_id = row.get('device_id')
+                self._sample_counts[device_id] += 1
+                if self._sample_counts[device_id] % self.sample_every:
+                    self.dropped['sampled'] += 1
+                    return False
+
+            if self._size >= self.maxsize and \
+               not self._make_room(row):
+                return False
+
+            self._seq += 1
+            self._items.append((self._seq, row))
+            self._size += 1
+            if self.policy == OverflowPolicy.DROP_LOWEST_QUALITY:
+                heapq.heappush(self._quality_heap,
+                               (row.get('quality', 1.0), self._seq))
+                # Evicted rows stay in _items until compacted, so a
+                # stalled writer cannot grow the queue past the cap
+                if len(self._items) > 2 * self.maxsize:
+                    self._compact()
+            self.accepted += 1
+            if not self._paused and self._size >= self.high_watermark:
+                self._paused = True
+                logger.warning(f"Ingest queue above high watermark "
+                               f"({self._size}/{self.maxsize}), "
+                               f"pausing broker reads")
+            self._cond.notify_all()
+            return True
+
+    def put_many(self, rows: List[Dict[str, Any]]) -> int:
+        """Queue several rows, returning how many were accepted"""
+        return sum(self.put(row) for row in rows)
+
+    def get_batch(self, max_items: int, timeout: float) -> List[Dict[str,
+                                                                 Any]]:
+        """Wait up to ``timeout`` for rows and return at most ``max_items``"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+            batch = [self._popleft()
+                     for _ in range(min(max_items, self._size))]
+            if len(self._quality_heap) > 2 * self.maxsize:
+                self._compact()
+            if self._paused and self._size <= self.low_watermark:
+                self._paused = False
+                self._sample_counts.clear()
+                logger.info(f"Ingest queue below low watermark "
+                            f"({self._size}/{self.maxsize}), "
+                            f"resuming broker reads")
+            self._cond.notify_all()
+            return batch
+
+    def wait_until_resumed(self, timeout: float) -> bool:
+        """
+        Block the calling broker thread while the queue is paused
+
+        The wait is bounded so that MQTT keepalives still go out.
+
+        Returns:
+            True if reading may continue, False if the wait timed out
+        """
+        with self._cond:
+            if not self._paused:
+                return True
+            self.delayed += 1
+            return self._cond.wait_for(lambda: not self._paused, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and accepted/dropped/delayed counters"""
+        return {
+            'policy': self.policy.value,
+            'size': self._size,
+            'maxsize': self.maxsize,
+            'paused': self._paused,
+            'accepted': self.accepted,
+            'delayed': self.delayed,
+            'dropped': dict(self.dropped)
+        }
+
+    def _make_room(self, row: Dict[str, Any]) -> bool:
+        """Apply the policy to a full queue; caller holds the lock"""
+        if self.policy == OverflowPolicy.BLOCK:
+            self.delayed += 1
+            if self._cond.wait_for(lambda: self._size < self.maxsize,
+                                   self.block_timeout):
+                return True
+            self.dropped['timeout'] += 1
+            return False
+
+        if self.policy == OverflowPolicy.DROP_OLDEST:
+            self._popleft()
+            self.dropped['oldest'] += 1
+            return True
+
+        if self.policy == OverflowPolicy.DROP_LOWEST_QUALITY:
+            # Entries older than the head of the queue were dequeued
+            oldest = self._items[0][0]
+            while self._quality_heap[0][1] < oldest:
+                heapq.heappop(self._quality_heap)
+            self.dropped['lowest_quality'] += 1
+            if self._quality_heap[0][0] >= row.get('quality', 1.0):
+                return False
+            _, seq = heapq.heappop(self._quality_heap)
+            self._evicted.add(seq)
+            self._size -= 1
+            return True
+
+        self.dropped['full'] += 1
+        return False
+
+    def _popleft(self) -> Dict[str, Any]:
+        """Dequeue the oldest row that was not evicted; caller holds lock"""
+        seq, row = self._items.popleft()
+        while seq in self._evicted:
+            self._evicted.discard(seq)
+            seq, row = self._items.popleft()
+        self._size -= 1
+        return row
+
+    def _compact(self) -> None:
+        """
+        Drop evicted rows and stale heap entries; caller holds the lock
+
+        Runs once the queue or the heap has reached twice maxsize, so
+        its O(maxsize) cost is amortised O(1) per put.
+        """
+        if self._evicted:
+            self._items = deque(item for item in self._items
+                                if item[0] not in self._evicted)
+            self._evicted.clear()
+        self._quality_heap = [(row.get('quality', 1.0), seq)
+                              for seq, row in self._items]
+        heapq.heapify(self._quality_heap)
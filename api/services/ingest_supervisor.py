@@ -0,0 +1,231 @@
+"""Supervisor for sharded multi-process MQTT ingest
+
+Runs N worker processes, each with its own Flask app, database
+connections, MQTT subscribers and batch writer. Every worker subscribes
+to the same wildcard topics and keeps only the devices whose id hashes to
+its shard, so decoding, validation and ORM work spread across cores. The
+supervisor restarts workers that exit and logs per-worker throughput.
+
+Each worker therefore receives the whole message stream. MQTT topic
+filters cannot express a hash partition of device ids, and subscribing
+every worker to its devices' own topics would mean resubscribing on each
+registration. Foreign messages are dropped after splitting the topic and
+hashing the id, before the payload is decoded, so the extra cost is
+broker fan-out and network bandwidth (N copies of the stream), not CPU.
+Split devices across brokers or topic prefixes if that becomes the limit.
+
+Usage (from the api directory):
+    python -m services.ingest_supervisor --workers 4
+
+Set MQTT_INGEST_WORKERS for the API processes as well so they stop
+ingesting themselves.
+"""
+from __future__ import annotations
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(device_id: int, shard_count: int) -> int:
+    """Return the worker shard that owns a device id"""
+    return zlib.crc32(str(device_id).encode('ascii')) % shard_count
+
+
+def run_worker(index: int, count: int, stats_queue: multiprocessing.Queue,
+               report_interval: float) -> None:
+    """Entry point of an ingest worker process"""
+    # The API app reads its config on import: it must not start embedded
+    # ingest, and retention runs in the API processes, not once per shard
+    os.environ['MQTT_INGEST_WORKERS'] = str(count)
+    os.environ['RETENTION_ENABLED'] = 'false'
+    # Imported here so the supervisor itself never touches the database
+    from app import app
+    from services.mqtt_handler import init_mqtt_handler
+
+    # Per-shard broker group and spool so workers never share either
+    group = app.config.get('MQTT_SHARED_GROUP', 'autoswitch-ingest')
+    app.config['MQTT_SHARED_GROUP'] = f"{group}-shard{index}"
+    if app.config.get('MQTT_SPOOL_DIR'):
+        app.config['MQTT_SPOOL_DIR'] = os.path.join(
+            app.config['MQTT_SPOOL_DIR'], f"shard-{index}")
+    app.config['MQTT_SPOOL_NAME'] = \
+        f"{app.config.get('MQTT_SPOOL_NAME', 'default')}-shard{index}"
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    with app.app_context():
+        handler = init_mqtt_handler(app, shard=(index, count))
+
+    while not stop.wait(report_interval):
+        stats = handler.writer.stats()
+        stats_queue.put({
+            'index': index,
+            'pid': os.getpid(),
+            'time': time.time(),
+            'rows_written': stats['rows_written'],
+            'rows_spooled': stats['rows_spooled'],
+            'rows_rejected': stats['rows_rejected'],
+            'queue_size': stats['queue']['size'],
+            'dropped': sum(stats['queue']['dropped'].values())
+        })
+
+    handler.cleanup()
+
+
+@dataclass
+class WorkerState:
+    """Supervisor bookkeeping for one shard"""
+    index: int
+    process: Optional[multiprocessing.Process] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    restart_at: float = 0.0
+    rows_per_second: float = 0.0
+    last_report: Optional[Dict[str, Any]] = None
+
+
+class IngestSupervisor:
+    """Start, watch and restart sharded ingest workers"""
+
+    def __init__(self, worker_count: int, report_interval: float = 10.0,
+                 max_backoff: float = 60.0):
+        self.worker_count = worker_count
+        self.report_interval = report_interval
+        self.max_backoff = max_backoff
+        self.workers = [WorkerState(index=i) for i in range(worker_count)]
+        self._stats_queue: multiprocessing.Queue = multiprocessing.Queue()
+        self._stop = threading.Event()
+
+    def run(self) -> None:
+        """Run until SIGTERM/SIGINT, then stop the workers"""
+        signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self._stop.set())
+
+        for worker in self.workers:
+            self._start_worker(worker)
+
+        next_report = time.monotonic() + self.report_interval
+        while not self._stop.wait(1.0):
+            self._check_workers()
+            self._drain_stats()
+            if time.monotonic() >= next_report:
+                self._log_throughput()
+                next_report = time.monotonic() + self.report_interval
+
+        self.stop()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Ask every worker to flush and exit, killing stragglers"""
+        self._stop.set()
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    logger.error(f"Worker {worker.index} did not exit, "
+                                 f"killing it")
+                    worker.process.kill()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return per-worker state and throughput"""
+        return [{
+            'index': worker.index,
+            'pid': worker.process.pid if worker.process else None,
+            'alive': bool(worker.process and worker.process.is_alive()),
+            'restarts': worker.restarts,
+            'rows_per_second': worker.rows_per_second,
+            'last_report': worker.last_report
+        } for worker in self.workers]
+
+    def _start_worker(self, worker: WorkerState) -> None:
+        worker.process = multiprocessing.Process(
+            target=run_worker,
+            args=(worker.index, self.worker_count, self._stats_queue,
+                  self.report_interval),
+            name=f"ingest-worker-{worker.index}",
+            daemon=False)
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = 0.0
+        worker.last_report = None
+        logger.info(f"Started ingest worker {worker.index} "
+                    f"(pid {worker.process.pid})")
+
+    def _check_workers(self) -> None:
+        """Schedule restarts with exponential backoff for dead workers"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is None or worker.process.is_alive():
+                continue
+
+            if not worker.restart_at:
+                if now - worker.started_at > self.max_backoff:
+                    worker.restarts = 0  # it ran fine for a while
+                delay = min(self.max_backoff, 2 ** worker.restarts)
+                worker.restart_at = now + delay
+                worker.rows_per_second = 0.0
+                logger.error(f"Ingest worker {worker.index} exited with "
+                             f"code {worker.process.exitcode}, "
+                             f"restarting in {delay}s")
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                self._start_worker(worker)
+
+    def _drain_stats(self) -> None:
+        """Fold worker reports into per-worker throughput"""
+        while True:
+            try:
+                report = self._stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            worker = self.workers[report['index']]
+            previous = worker.last_report
+            if previous and previous['pid'] == report['pid'] and \
+               report['time'] > previous['time']:
+                worker.rows_per_second = \
+                    (report['rows_written'] - previous['rows_written']) \
+                    / (report['time'] - previous['time'])
+            worker.last_report = report
+
+    def _log_throughput(self) -> None:
+        total = sum(worker.rows_per_second for worker in self.workers)
+        per_worker = ', '.join(f"{worker.index}: "
+                               f"{worker.rows_per_second:.0f}"
+                               for worker in self.workers)
+        logger.info(f"Ingest throughput {total:.0f} rows/s ({per_worker})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run sharded MQTT ingest workers')
+    parser.add_argument(
+        '--workers', type=int,
+        default=int(os.getenv('MQTT_INGEST_WORKERS', 0)) or os.cpu_count(),
+        help='number of worker processes (default: MQTT_INGEST_WORKERS '
+             'or the CPU count)')
+    parser.add_argument(
+        '--report-interval', type=float,
+        default=float(os.getenv('MQTT_WORKER_REPORT_INTERVAL', 10.0)),
+        help='seconds between throughput reports')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    IngestSupervisor(args.workers, args.report_interval).run()
@@ -0,0 +1,252 @@
+"""In-process lookup cache for the ingest path
+
+Keeps small snapshots of devices and metric types so that steady-state
+ingest resolves them without a database round trip. Entries expire after
+a TTL, the least recently used ones are evicted when the cache is full,
+and device entries are invalidated whenever a device row is inserted,
+updated or deleted (User.register_device, Device.update, Device.delete),
+including devices removed along with their user. Metric type entries,
+misses included, are invalidated when a metric type is written. Writes
+are only invalidated once their session commits, so a concurrent lookup
+cannot cache the old row again in between.
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from models.device import Device
+from models.metric import MetricType
+from models.user import User
+
+
+_MISSING = object()
+
+# Session.info key of the invalidations waiting for the commit
+PENDING_INVALIDATIONS = 'lookup_cache_invalidations'
+
+
+@dataclass(frozen=True)
+class DeviceSnapshot:
+    """Ownership and status of a device as seen by ingest"""
+    id: int
+    user_id: int
+    status: str
+
+
+@dataclass(frozen=True)
+class MetricTypeSnapshot:
+    """Metric type id and its validation rules"""
+    id: int
+    name: str
+    validation_rules: Optional[Dict[str, Any]] = None
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or ``_MISSING``"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return _MISSING
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entries"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable,
+                    loader: Callable[[], Any]) -> Any:
+        """Return the cached value, loading and storing it on a miss"""
+        value = self.get(key)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a single entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class LookupCache:
+    """Device and metric type snapshots used by the ingest path"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.devices = TTLCache(maxsize, ttl)
+        self.metric_types = TTLCache(maxsize, ttl)
+
+    def configure(self, maxsize: int, ttl: float) -> None:
+        """Apply size and TTL settings from the app config"""
+        for cache in (self.devices, self.metric_types):
+            cache.maxsize = maxsize
+            cache.ttl = ttl
+
+    def get_device(self, device_id: int) -> Optional[DeviceSnapshot]:
+        """Return a device snapshot, or None for unknown devices"""
+        return self.devices.get_or_load(
+            device_id, lambda: self._load_device(device_id))
+
+    def get_metric_type(self, name: str) -> Optional[MetricTypeSnapshot]:
+        """Return a metric type snapshot, or None for unknown types"""
+        return self.metric_types.get_or_load(
+            ('name', name), lambda: self._load_metric_type(name))
+
+    def get_metric_type_rules(self,
+                              metric_type_id: int) -> Optional[Dict[str, Any]]:
+        """Return the validation rules of a metric type id"""
+        snapshot = self.metric_types.get_or_load(
+            ('id', metric_type_id),
+            lambda: self._load_metric_type_by_id(metric_type_id))
+        return snapshot.validation_rules if snapshot else None
+
+    def invalidate_device(self, device_id: int) -> None:
+        """Forget a device so the next lookup reloads it"""
+        self.devices.invalidate(device_id)
+
+    def invalidate_metric_type(self, metric_type_id: int, name: str) -> None:
+        """Forget a metric type, cached by name and by id"""
+        self.metric_types.invalidate(('name', name))
+        self.metric_types.invalidate(('id', metric_type_id))
+
+    def clear(self) -> None:
+        """Forget everything"""
+        self.devices.clear()
+        self.metric_types.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return hit/miss counters for both caches"""
+        return {
+            'devices': self.devices.stats(),
+            'metric_types': self.metric_types.stats()
+        }
+
+    @staticmethod
+    def _load_device(device_id: int) -> Optional[DeviceSnapshot]:
+        device = Device.query.get(device_id)
+        if not device:
+            return None
+        return DeviceSnapshot(id=device.id, user_id=device.user_id,
+                              status=device.status)
+
+    @staticmethod
+    def _load_metric_type(name: str) -> Optional[MetricTypeSnapshot]:
+        return LookupCache._snapshot_metric_type(
+            MetricType.query.filter_by(name=name).first())
+
+    @staticmethod
+    def _load_metric_type_by_id(
+            metric_type_id: int) -> Optional[MetricTypeSnapshot]:
+        return LookupCache._snapshot_metric_type(
+            MetricType.query.get(metric_type_id))
+
+    @staticmethod
+    def _snapshot_metric_type(
+            metric_type: Optional[MetricType]) -> Optional[MetricTypeSnapshot]:
+        if not metric_type:
+            return None
+        return MetricTypeSnapshot(
+            id=metric_type.id, name=metric_type.name,
+            validation_rules=metric_type.validation_rules)
+
+
+lookup_cache = LookupCache()
+
+
+def invalidate_on_commit(target: Any, invalidate: Callable[[], None]) -> None:
+    """Run ``invalidate`` once the session writing ``target`` commits"""
+    session = object_session(target)
+    if session is None:
+        invalidate()
+        return
+    session.info.setdefault(PENDING_INVALIDATIONS, []).append(invalidate)
+
+
+# Event listeners
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_update')
+@event.listens_for(Device, 'after_delete')
+def invalidate_device_snapshot(mapper, connection, target):
+    """Drop cached snapshots of devices that were written"""
+    device_id = target.id
+    invalidate_on_commit(
+        target, lambda: lookup_cache.invalidate_device(device_id))
+
+
+@event.listens_for(User, 'before_delete', insert=True)
+def invalidate_user_device_snapshots(mapper, connection, target):
+    """Drop cached snapshots of the devices of a user being deleted"""
+    # Runs ahead of cleanup_user_data, whose raw DELETE bypasses the
+    # Device listeners above
+    device_ids = connection.execute(
+        select(Device.id).where(Device.user_id == target.id)).scalars().all()
+    invalidate_on_commit(target, lambda: [
+        lookup_cache.invalidate_device(device_id) for device_id in device_ids])
+
+
+@event.listens_for(MetricType, 'after_insert')
+@event.listens_for(MetricType, 'after_update')
+@event.listens_for(MetricType, 'after_delete')
+def invalidate_metric_type_snapshot(mapper, connection, target):
+    """Drop cached snapshots of metric types that were written"""
+    # A new type replaces a cached miss for its name
+    metric_type_id, name = target.id, target.name
+    invalidate_on_commit(
+        target,
+        lambda: lookup_cache.invalidate_metric_type(metric_type_id, name))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_pending_invalidations(session):
+    """Invalidate the snapshots of rows written in the committed session"""
+    for invalidate in session.info.pop(PENDING_INVALIDATIONS, []):
+        invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending_invalidations(session):
+    """Rolled back writes leave the cached snapshots valid"""
+    session.info.pop(PENDING_INVALIDATIONS, None)
@@ -0,0 +1,374 @@
+"""Background writer for metric rows
+
+Readings arriving from MQTT are queued here and drained by a dedicated
+thread that writes them with one bulk insert per batch. Redelivered
+readings are dropped by a recent-key filter and, past it, by the unique
+natural key of the metrics table. Batches that
+cannot be written because the database is unavailable are appended to an
+on-disk spool and replayed once it is reachable again. Batches the
+database rejects outright (constraint or data errors) would fail on every
+replay, so they go to a quarantine spool that is kept but never replayed.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
+from flask import Flask
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
+from models import db
+from models.device import Device
+from models.latest_metric import LatestMetric, latest_values
+from models.metadata_document import metadata_dictionary, promote_fields
+from models.metric import Metric
+from models.spool_checkpoint import SpoolCheckpoint
+from models.storage import get_backend
+from services.event_hub import event_hub
+from services.ingest_queue import IngestQueue
+from services.recent_keys import RecentKeyFilter
+from services.lookup_cache import lookup_cache
+from services.response_cache import response_cache
+from services.spool import Spool
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient(error: SQLAlchemyError) -> bool:
+    """Whether a failed write may succeed later without changing the rows"""
+    return isinstance(error, OperationalError) or (
+        isinstance(error, DBAPIError) and error.connection_invalidated)
+
+
+class MetricWriter:
+    """Batch metric rows and flush them on size or elapsed time"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.batch_size: int = app.config.get('MQTT_BATCH_SIZE', 100)
+        # MQTT_FLUSH_INTERVAL is configured in milliseconds
+        self.flush_interval: float = \
+            app.config.get('MQTT_FLUSH_INTERVAL', 1000) / 1000.0
+        self.insert_method: str = app.config.get('METRIC_INSERT_METHOD',
+                                                 'auto')
+        self.copy_format: str = app.config.get('METRIC_COPY_FORMAT', 'text')
+        self.promoted_fields: List[str] = app.config.get(
+            'METADATA_PROMOTED_FIELDS', [])
+        self.queue = IngestQueue(
+            maxsize=app.config.get('MQTT_QUEUE_SIZE', 10000),
+            policy=app.config.get('MQTT_OVERFLOW_POLICY', 'block'),
+            high_watermark=app.config.get('MQTT_HIGH_WATERMARK', 0.8),
+            low_watermark=app.config.get('MQTT_LOW_WATERMARK', 0.5),
+            sample_every=app.config.get('MQTT_SAMPLE_EVERY', 4),
+            block_timeout=app.config.get('MQTT_BLOCK_TIMEOUT', 5.0))
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+        self.rows_rejected = 0
+        self.rows_promoted = 0
+        self.rows_duplicate = 0
+        self.errors = 0
+        self.recent_keys: Optional[RecentKeyFilter] = None
+        if app.config.get('MQTT_DEDUP_WINDOW', 512) > 0:
+            self.recent_keys = RecentKeyFilter(
+                window=app.config.get('MQTT_DEDUP_WINDOW', 512),
+                max_devices=app.config.get('MQTT_DEDUP_DEVICES', 10000))
+        self.rows_spooled = 0
+        self.rows_replayed = 0
+        self.rows_quarantined = 0
+        self.spool: Optional[Spool] = None
+        self.quarantine: Optional[Spool] = None
+        if app.config.get('MQTT_SPOOL_DIR'):
+            segment_bytes = app.config.get('MQTT_SPOOL_SEGMENT_BYTES',
+                                           64 * 1024 * 1024)
+            self.spool = Spool(app.config['MQTT_SPOOL_DIR'],
+                               segment_bytes=segment_bytes)
+            self.quarantine = Spool(
+                os.path.join(app.config['MQTT_SPOOL_DIR'], 'quarantine'),
+                segment_bytes=segment_bytes)
+        self.spool_name: str = app.config.get('MQTT_SPOOL_NAME', 'default')
+        self.replay_batch_size: int = \
+            app.config.get('MQTT_SPOOL_REPLAY_BATCH', 5000)
+        self.replay_interval: float = \
+            app.config.get('MQTT_SPOOL_REPLAY_INTERVAL', 5.0)
+        self._next_replay = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the writer thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='metric-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row: Dict[str, Any]) -> bool:
+        """Queue a metric row subject to the overflow policy"""
+        return self.queue.put(row)
+
+    def submit_many(self, rows: List[Dict[str, Any]]) -> int:
+        """Queue several metric rows, e.g. from one batch payload"""
+        return self.queue.put_many(rows)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the writer thread and flush whatever is still queued"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.spool:
+            self.spool.close()
+            self.quarantine.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return writer and queue counters"""
+        return {
+            'alive': self._thread is not None and self._thread.is_alive(),
+            'errors': self.errors,
+            'queue': self.queue.stats(),
+            'rows_written': self.rows_written,
+            'batches_written': self.batches_written,
+            'rows_failed': self.rows_failed,
+            'rows_rejected': self.rows_rejected,
+            'rows_promoted': self.rows_promoted,
+            'rows_duplicate': self.rows_duplicate,
+            'recent_keys': self.recent_keys.stats()
+            if self.recent_keys else None,
+            'metadata': metadata_dictionary.stats(),
+            'rows_spooled': self.rows_spooled,
+            'rows_replayed': self.rows_replayed,
+            'rows_quarantined': self.rows_quarantined,
+            'spool': self.spool.stats() if self.spool else None,
+            'quarantine': self.quarantine.stats() if self.quarantine else None
+        }
+
+    def _run(self) -> None:
+        """Drain the queue until stopped, then flush the tail"""
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while not self._stop.is_set():
+            batch.extend(self.queue.get_batch(
+                self.batch_size - len(batch),
+                max(0.0, deadline - time.monotonic())))
+
+            if len(batch) >= self.batch_size or \
+               time.monotonic() >= deadline:
+                if batch:
+                    self._flush_safely(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+            if self.spool and time.monotonic() >= self._next_replay and \
+               self.spool.pending():
+                try:
+                    self._replay_spool()
+                except Exception:
+                    self.errors += 1
+                    self._next_replay = \
+                        time.monotonic() + self.replay_interval
+                    logger.exception("Spool replay failed unexpectedly")
+
+        # Shutdown: write everything that made it into the queue
+        while True:
+            batch.extend(self.queue.get_batch(self.batch_size - len(batch),
+                                              0))
+            if not batch:
+                break
+            self._flush_safely(batch)
+            batch = []
+
+    def _flush_safely(self, rows: List[Dict[str, Any]]) -> None:
+        """Flush a batch; an unexpected error must not end the thread"""
+        try:
+            self._flush(rows)
+        except Exception:
+            self.errors += 1
+            logger.exception(f"Unexpected error flushing {len(rows)} "
+                             f"metrics")
+
+    def _flush(self, rows: List[Dict[str, Any]]) -> None:
+        """Validate and write one batch with a single commit"""
+        if self.recent_keys:
+            rows, duplicates = self.recent_keys.split(rows)
+            self.rows_duplicate += duplicates
+            if not rows:
+                return
+        with self.app.app_context():
+            if self.spool and self.spool.pending():
+                # Queue behind spooled rows until replay has caught up
+                self._spool(rows)
+                return
+
+            try:
+                written = self._write(rows)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                logger.error(f"Failed to write batch of {len(rows)} "
+                             f"metrics: {str(e)}")
+                if self.spool and _is_transient(e):
+                    self._spool(rows)
+                else:
+                    self._quarantine(rows)
+                return
+
+            self._after_write(written)
+
+    def _write(self, rows: List[Dict[str, Any]],
+               commit: bool = True) -> List[Dict[str, Any]]:
+        """Validate rows and insert the accepted, not yet stored ones"""
+        if self.promoted_fields:
+            rows, promoted = promote_fields(rows, self.promoted_fields,
+                                            self._metric_type_id)
+            self.rows_promoted += promoted
+        rows, report = Metric.validate_batch(
+            rows, lookup_cache.get_metric_type_rules)
+        if report.rejected:
+            self.rows_rejected += len(report.rejected)
+            logger.warning(f"Rejected {len(report.rejected)} metrics: "
+                           f"{report.reasons()}")
+        if rows:
+            inserted = Metric.batch_insert(rows, method=self.insert_method,
+                                           copy_format=self.copy_format,
+                                           commit=False)
+            self.rows_duplicate += len(rows) - len(inserted)
+            rows = inserted
+            if rows:
+                LatestMetric.upsert(rows, commit=False)
+                Device.bump_data_versions(row['device_id'] for row in rows)
+            if commit:
+                db.session.commit()
+        return rows
+
+    @staticmethod
+    def _metric_type_id(name: str) -> Optional[int]:
+        metric_type = lookup_cache.get_metric_type(name)
+        return metric_type.id if metric_type else None
+
+    def _after_write(self, rows: List[Dict[str, Any]]) -> None:
+        """Update counters and device state for committed rows"""
+        if not rows:
+            return
+        self.rows_written += len(rows)
+        self.batches_written += 1
+        if self.recent_keys:
+            self.recent_keys.remember(rows)
+        try:
+            latest_values.update(rows)
+            response_cache.invalidate_devices(
+                {row['device_id'] for row in rows})
+            event_hub.publish_readings(rows)
+            for update in Device.record_readings(rows):
+                lookup_cache.invalidate_device(update['id'])
+                event_hub.publish_status(update['id'], update.get('status'),
+                                         update['last_seen'])
+        except Exception:
+            # The rows are committed; only derived state is stale
+            db.session.rollback()
+            self.errors += 1
+            logger.exception("Failed to update state after writing metrics")
+        self._refresh_aggregates(rows)
+
+    def _refresh_aggregates(self, rows: List[Dict[str, Any]]) -> None:
+        """Materialize aggregates over rows too late for their policy"""
+        timestamps = [row['timestamp'] for row in rows]
+        try:
+            refreshed = get_backend().refresh_aggregates(
+                max(timestamps) + timedelta(microseconds=1),
+                newer_than=min(timestamps))
+        except SQLAlchemyError as e:
+            self.errors += 1
+            logger.error(f"Failed to refresh aggregates over "
+                         f"{len(rows)} late metrics: {str(e)}")
+            return
+        if refreshed:
+            logger.info(f"Refreshed {', '.join(refreshed)} over "
+                        f"{len(rows)} late metrics")
+
+    def _spool(self, rows: List[Dict[str, Any]]) -> None:
+        """Append rows to the spool for later replay"""
+        try:
+            self.spool.append(rows)
+            self.rows_spooled += len(rows)
+        except OSError as e:
+            self.rows_failed += len(rows)
+            logger.error(f"Failed to spool {len(rows)} metrics: {str(e)}")
+
+    def _quarantine(self, rows: List[Dict[str, Any]]) -> None:
+        """Set aside rows the database rejected, or count them as failed"""
+        if not self.quarantine:
+            self.rows_failed += len(rows)
+            return
+        try:
+            self.quarantine.append(rows)
+            self.rows_quarantined += len(rows)
+        except OSError as e:
+            self.rows_failed += len(rows)
+            logger.error(f"Failed to quarantine {len(rows)} metrics: "
+                         f"{str(e)}")
+
+    def _checkpoint(self) -> SpoolCheckpoint:
+        """Replay checkpoint of this writer's spool, created on first use"""
+        checkpoint = db.session.get(SpoolCheckpoint, self.spool_name)
+        if checkpoint is None:
+            checkpoint = SpoolCheckpoint(name=self.spool_name)
+            db.session.add(checkpoint)
+        return checkpoint
+
+    def _replay_spool(self) -> None:
+        """
+        Replay closed spool segments oldest first
+
+        Each segment is sorted by timestamp and written in large batches.
+        The checkpoint row is committed in the same transaction as each
+        batch, so a crash mid-replay resumes without duplicates. A batch
+        the database rejects for its content is quarantined and skipped;
+        only transient errors stop the replay until the next attempt.
+        """
+        self.spool.rotate()
+        with self.app.app_context():
+            try:
+                for seq, path in self.spool.closed_segments():
+                    checkpoint = self._checkpoint()
+                    if checkpoint.segment > seq:
+                        self.spool.remove_segment(seq)
+                        continue
+
+                    start = checkpoint.position \
+                        if checkpoint.segment == seq else 0
+                    rows = Spool.read_segment(path)
+                    rows.sort(key=lambda row: row['timestamp'])
+                    for i in range(start, len(rows), self.replay_batch_size):
+                        chunk = rows[i:i + self.replay_batch_size]
+                        try:
+                            written = self._write(chunk, commit=False)
+                        except SQLAlchemyError as e:
+                            if _is_transient(e):
+                                raise
+                            db.session.rollback()
+                            logger.error(f"Quarantining {len(chunk)} spooled "
+                                         f"metrics: {str(e)}")
+                            self._quarantine(chunk)
+                            written = []
+                            checkpoint = self._checkpoint()
+                        checkpoint.segment = seq
+                        checkpoint.position = i + len(chunk)
+                        db.session.commit()
+                        self.rows_replayed += len(written)
+                        self._after_write(written)
+
+                    checkpoint.segment = seq + 1
+                    checkpoint.position = 0
+                    db.session.commit()
+                    self.spool.remove_segment(seq)
+                    logger.info(f"Replayed spool segment {seq} "
+                                f"({len(rows)} rows)")
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self._next_replay = time.monotonic() + self.replay_interval
+                logger.error(f"Spool replay failed, retrying in "
+                             f"{self.replay_interval}s: {str(e)}")
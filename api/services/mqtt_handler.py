@@ -4,26 +4,45 @@ This module manages MQTT connections and message handling for IoT devices,
 including metric validation, storage, and error handling.
 """
 from __future__ import annotations
+import atexit
 import json
+import os
 import logging
-from datetime import datetime
-from typing import Dict, Any, List
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
 import paho.mqtt.client as mqtt
-from flask import Flask, current_app
+from flask import Flask
 from sqlalchemy.exc import SQLAlchemyError
+from models import db
 from models.device import Device
-from models.metric import Metric, MetricType
+from models.latest_metric import latest_values
+from services.event_hub import event_hub
+from services.ingest_supervisor import shard_for
+from services.lookup_cache import lookup_cache
+from services.metric_writer import MetricWriter
+from services.payloads import BatchPayload, decode_batch
 
 
 logger = logging.getLogger(__name__)
 
 
+# Topics every ingest subscriber listens on, device id is topic level 1
+INGEST_TOPICS = ('devices/+/metrics/#', 'devices/+/status',
+                 'devices/+/batch/#')
+
+
 class MQTTHandler:
     """Handler for MQTT client connections and message processing"""
 
-    def __init__(self, app: Flask):
+    def __init__(self, app: Flask,
+                 shard: Optional[Tuple[int, int]] = None):
         self.app = app
+        # (index, count) when running as one of several ingest workers
+        self.shard = shard
         self.clients: List[mqtt.Client] = []
+        self.writer = MetricWriter(app)
+        lookup_cache.configure(app.config.get('LOOKUP_CACHE_SIZE', 10000),
+                               app.config.get('LOOKUP_CACHE_TTL', 300))
         self._setup_logging()
 
     def _setup_logging(self) -> None:
@@ -38,27 +57,85 @@ class MQTTHandler:
     def on_connect(self, client: mqtt.Client, userdata: Any,
                    flags: Dict, rc: int) -> None:
         """Handle client connection events"""
+        if 'subscriber' in userdata:
+            self._on_subscriber_connect(client, userdata, rc)
+            return
+
         device_id = userdata.get('device_id')
         if rc == 0:
             logger.info(f"Device {device_id} connected successfully")
             # Subscribe to device-specific topics
             client.subscribe(f"devices/{device_id}/metrics/#")
             client.subscribe(f"devices/{device_id}/status")
+            client.subscribe(f"devices/{device_id}/batch/#")
         else:
             logger.error(f"Device {device_id}\
                          connection failed with code {rc}")
 
+    def _on_subscriber_connect(self, client: mqtt.Client, userdata: Any,
+                               rc: int) -> None:
+        """Subscribe a shared ingest connection to the wildcard topics"""
+        index = userdata['subscriber']
+        if rc != 0:
+            logger.error(f"Subscriber {index} connection failed with code {rc}")
+            return
+
+        logger.info(f"Subscriber {index} connected successfully")
+        for topic in INGEST_TOPICS:
+            client.subscribe(self._subscription_topic(topic))
+
+    def _subscription_topic(self, topic: str) -> str:
+        """Wrap a topic in a shared subscription when pooling connections"""
+        if self.app.config.get('MQTT_SUBSCRIBER_POOL_SIZE', 1) > 1:
+            # Let the broker balance messages across the pool instead of
+            # delivering every message to every connection
+            group = self.app.config.get('MQTT_SHARED_GROUP',
+                                        'autoswitch-ingest')
+            return f"$share/{group}/{topic}"
+        return topic
+
     def on_message(self, client: mqtt.Client, userdata: Any,
                    msg: mqtt.MQTTMessage) -> None:
         """Process incoming MQTT messages"""
+        # Above the queue's high watermark, stop reading from the broker
+        # by holding this network thread (bounded, to keep keepalives)
+        self.writer.queue.wait_until_resumed(
+            self.app.config.get('MQTT_BLOCK_TIMEOUT', 5.0))
+
         try:
             # Parse topic to get device_id and metric_type
             topics = msg.topic.split('/')
-            if len(topics) < 4:
+            if len(topics) < 3:
                 logger.error(f"Invalid topic format: {msg.topic}")
                 return
 
             device_id = int(topics[1])
+            if self.shard and \
+               shard_for(device_id, self.shard[1]) != self.shard[0]:
+                return  # owned by another ingest worker
+
+            if len(topics) == 3 and topics[2] == 'status':
+                with self.app.app_context():
+                    self._process_status(device_id)
+                return
+
+            if topics[2] == 'batch':
+                # devices/<id>/batch[/<encoding>]
+                encoding = topics[3] if len(topics) > 3 else 'json'
+                try:
+                    batch = decode_batch(msg.payload, encoding)
+                except ValueError as e:
+                    logger.error(f"Invalid batch from device "
+                                 f"{device_id}: {str(e)}")
+                    return
+                with self.app.app_context():
+                    self._process_batch(device_id, batch)
+                return
+
+            if len(topics) < 4:
+                logger.error(f"Invalid topic format: {msg.topic}")
+                return
+
             metric_type_name = topics[3]
 
             # Parse message payload
@@ -78,10 +155,9 @@ class MQTTHandler:
                         payload: Dict[str, Any]) -> None:
         """Process and store metric data"""
         try:
-            # Validate device and metric type
-            device = Device.query.get(device_id)
-            metric_type = MetricType.query.filter_by(
-                name=metric_type_name).first()
+            # Validate device and metric type from cached snapshots
+            device = lookup_cache.get_device(device_id)
+            metric_type = lookup_cache.get_metric_type(metric_type_name)
 
             if not device or not metric_type:
                 logger.error(f"Invalid device {device_id}\
@@ -89,65 +165,104 @@ class MQTTHandler:
                 return
 
             # Extract and validate metric data
-            timestamp = datetime.fromisoformat(payload.get('timestamp',
-                                               datetime.now().isoformat()))
+            timestamp = datetime.fromisoformat(payload.get(
+                'timestamp', datetime.now(timezone.utc).isoformat()))
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            else:
+                timestamp = timestamp.astimezone(timezone.utc)
             value = float(payload.get('value'))
             quality = float(payload.get('quality', 1.0))
             metadata = payload.get('metadata', {})
 
-            # Create and validate metric
-            metric = Metric(
-                device_id=device_id,
-                metric_type_id=metric_type.id,
-                timestamp=timestamp,
-                value=value,
-                quality=quality,
-                metadata=metadata
-            )
-
-            # Batch insert if multiple metrics are queued
-            if hasattr(current_app, 'metric_queue'):
-                current_app.metric_queue.append(metric.to_dict())
-                if len(current_app.metric_queue) >= \
-                   current_app.config.get('MQTT_BATCH_SIZE', 100):
-                    Metric.batch_insert(current_app.metric_queue)
-                    current_app.metric_queue.clear()
-            else:
-                metric.save()
+            # Hand the row to the writer thread, which batches inserts
+            self.writer.submit({
+                'device_id': device_id,
+                'metric_type_id': metric_type.id,
+                'timestamp': timestamp,
+                'value': value,
+                'quality': quality,
+                'metric_metadata': metadata
+            })
 
         except ValueError as e:
             logger.error(f"Validation error for device {device_id}: {str(e)}")
         except SQLAlchemyError as e:
             logger.error(f"Database error for device {device_id}: {str(e)}")
 
+    def _process_batch(self, device_id: int, batch: BatchPayload) -> None:
+        """Turn a decoded batch into rows for the writer"""
+        device = lookup_cache.get_device(device_id)
+        if not device:
+            logger.error(f"Invalid device {device_id}")
+            return
+
+        rows = []
+        for reading in batch.readings:
+            metric_type = lookup_cache.get_metric_type(reading.metric_type)
+            if not metric_type:
+                logger.error(f"Invalid metric type {reading.metric_type} "
+                             f"from device {device_id}")
+                continue
+            rows.append({
+                'device_id': device_id,
+                'metric_type_id': metric_type.id,
+                'timestamp': reading.timestamp,
+                'value': reading.value,
+                'quality': reading.quality,
+                'metric_metadata': batch.metadata
+            })
+
+        self.writer.submit_many(rows)
+
+    def _process_status(self, device_id: int) -> None:
+        """Record a status heartbeat as device activity"""
+        try:
+            last_seen = datetime.now(timezone.utc)
+            Device.query.filter_by(id=device_id).update(
+                {'last_seen': last_seen})
+            db.session.commit()
+            event_hub.publish_status(device_id, None, last_seen)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Database error for device {device_id}: {str(e)}")
+
+    def _create_client(self, userdata: Dict[str, Any],
+                       username: Optional[str], password: Optional[str],
+                       client_id: str = '') -> mqtt.Client:
+        """Build, connect and start a client with the app configuration"""
+        client = mqtt.Client(client_id=client_id, userdata=userdata)
+        if username:
+            client.username_pw_set(username, password)
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+
+        # Configure TLS if enabled
+        if self.app.config.get('MQTT_USE_TLS', False):
+            client.tls_set(
+                ca_certs=self.app.config.get('MQTT_CA_CERTS'),
+                certfile=self.app.config.get('MQTT_CERTFILE'),
+                keyfile=self.app.config.get('MQTT_KEYFILE')
+            )
+
+        # Configure connection parameters
+        client.connect(
+            host=self.app.config['MQTT_BROKER'],
+            port=self.app.config['MQTT_PORT'],
+            keepalive=self.app.config.get('MQTT_KEEPALIVE', 60)
+        )
+
+        client.loop_start()
+        return client
+
     def init_clients(self) -> List[mqtt.Client]:
-        """Initialize MQTT clients for all devices"""
+        """Initialize MQTT clients for the configured ingest mode"""
         try:
-            devices = Device.query.all()
-            for device in devices:
-                client = mqtt.Client(userdata={'device_id': device.id})
-                client.username_pw_set(device.device_key,
-                                       device.user.password_hash)
-                client.on_connect = self.on_connect
-                client.on_message = self.on_message
-
-                # Configure TLS if enabled
-                if self.app.config.get('MQTT_USE_TLS', False):
-                    client.tls_set(
-                        ca_certs=self.app.config.get('MQTT_CA_CERTS'),
-                        certfile=self.app.config.get('MQTT_CERTFILE'),
-                        keyfile=self.app.config.get('MQTT_KEYFILE')
-                    )
-
-                # Configure connection parameters
-                client.connect(
-                    host=self.app.config['MQTT_BROKER'],
-                    port=self.app.config['MQTT_PORT'],
-                    keepalive=self.app.config.get('MQTT_KEEPALIVE', 60)
-                )
-
-                client.loop_start()
-                self.clients.append(client)
+            if self.app.config.get('MQTT_INGEST_MODE',
+                                   'shared') == 'per_device':
+                self._init_device_clients()
+            else:
+                self._init_shared_clients()
 
             logger.info(f"Initialized {len(self.clients)} MQTT clients")
             self.app.mqtt_handler = self
@@ -157,8 +272,33 @@ class MQTTHandler:
             logger.error(f"Error initializing MQTT clients: {str(e)}")
             return []
 
+    def _init_shared_clients(self) -> None:
+        """Open a fixed pool of wildcard subscribers for the whole fleet"""
+        pool_size = max(1, self.app.config.get('MQTT_SUBSCRIBER_POOL_SIZE',
+                                               1))
+        group = self.app.config.get('MQTT_SHARED_GROUP', 'autoswitch-ingest')
+        for index in range(pool_size):
+            client = self._create_client(
+                userdata={'subscriber': index},
+                username=self.app.config.get('MQTT_USERNAME'),
+                password=self.app.config.get('MQTT_PASSWORD'),
+                client_id=f"{group}-{os.getpid()}-{index}"
+            )
+            self.clients.append(client)
+
+    def _init_device_clients(self) -> None:
+        """Open one client per device (legacy mode)"""
+        devices = Device.query.all()
+        for device in devices:
+            client = self._create_client(
+                userdata={'device_id': device.id},
+                username=device.device_key,
+                password=device.user.password_hash
+            )
+            self.clients.append(client)
+
     def cleanup(self) -> None:
-        """Clean up MQTT clients and connections"""
+        """Clean up MQTT clients and connections, then flush pending rows"""
         for client in self.clients:
             try:
                 client.loop_stop()
@@ -166,10 +306,20 @@ class MQTTHandler:
             except Exception as e:
                 logger.error(f"Error disconnecting client: {str(e)}")
         self.clients.clear()
+        self.writer.stop()
 
 
-def init_mqtt_handler(app: Flask) -> MQTTHandler:
+def init_mqtt_handler(app: Flask,
+                      shard: Optional[Tuple[int, int]] = None) -> MQTTHandler:
     """Initialize the MQTT handler with the Flask app"""
-    handler = MQTTHandler(app)
+    handler = MQTTHandler(app, shard)
+    try:
+        Device.rebuild_status_tracker()
+        latest_values.load()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error rebuilding device state: {str(e)}")
+    handler.writer.start()
     handler.init_clients()
+    atexit.register(handler.cleanup)
     return handler
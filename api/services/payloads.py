@@ -0,0 +1,131 @@
+"""Decoding of batched multi-reading MQTT payloads
+
+Devices publish several readings at once on ``devices/<id>/batch`` (JSON)
+or ``devices/<id>/batch/msgpack`` (MessagePack). Both encodings carry the
+same versioned document:
+
+    {"v": 1,
+     "metadata": {...},                       # shared by every record
+     "records": [{"type": "temperature", "ts": 1718000000,
+                  "value": 21.4, "quality": 1.0}, ...]}
+
+Records may also be compact arrays ``[type, ts, value, quality]``. ``ts``
+is epoch seconds or an ISO 8601 string and defaults to the receive time.
+"""
+from __future__ import annotations
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+BATCH_VERSION = 1
+BATCH_ENCODINGS = ('json', 'msgpack')
+
+
+@dataclass
+class Reading:
+    """A single reading from a batch"""
+    metric_type: str
+    timestamp: datetime
+    value: float
+    quality: float = 1.0
+
+
+@dataclass
+class BatchPayload:
+    """A decoded batch with its shared metadata"""
+    version: int
+    readings: List[Reading]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def decode_batch(payload: bytes, encoding: str = 'json') -> BatchPayload:
+    """
+    Decode a batch payload in one pass
+
+    Args:
+        payload: Raw MQTT payload
+        encoding: 'json' or 'msgpack'
+
+    Returns:
+        Decoded batch
+
+    Raises:
+        ValueError: If the payload is malformed or the version unsupported
+    """
+    if encoding == 'json':
+        try:
+            document = json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid JSON batch: {str(e)}")
+    elif encoding == 'msgpack':
+        if msgpack is None:
+            raise ValueError("MessagePack batches require the msgpack package")
+        try:
+            document = msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack batch: {str(e)}")
+    else:
+        raise ValueError(f"Unsupported batch encoding {encoding}")
+
+    if not isinstance(document, dict):
+        raise ValueError("Batch payload must be an object")
+
+    version = document.get('v', BATCH_VERSION)
+    if version != BATCH_VERSION:
+        raise ValueError(f"Unsupported batch version {version}")
+
+    records = document.get('records')
+    if not isinstance(records, list):
+        raise ValueError("Batch payload has no records")
+
+    received_at = datetime.now(timezone.utc)
+    return BatchPayload(
+        version=version,
+        readings=[_decode_record(record, received_at) for record in records],
+        metadata=document.get('metadata') or {}
+    )
+
+
+def _decode_record(record: Any, received_at: datetime) -> Reading:
+    """Decode one object or array record"""
+    if isinstance(record, dict):
+        metric_type = record.get('type')
+        ts = record.get('ts')
+        value = record.get('value')
+        quality = record.get('quality', 1.0)
+    elif isinstance(record, (list, tuple)) and len(record) >= 3:
+        metric_type, ts, value = record[:3]
+        quality = record[3] if len(record) > 3 else 1.0
+    else:
+        raise ValueError(f"Invalid batch record {record!r}")
+
+    if not metric_type or value is None:
+        raise ValueError("Batch record is missing type or value")
+
+    try:
+        return Reading(metric_type=str(metric_type),
+                       timestamp=_decode_timestamp(ts, received_at),
+                       value=float(value),
+                       quality=float(quality))
+    except (TypeError, OverflowError, OSError) as e:
+        # e.g. an object as value or an epoch far outside datetime's range
+        raise ValueError(f"Invalid batch record {record!r}: {str(e)}")
+
+
+def _decode_timestamp(ts: Optional[Any], received_at: datetime) -> datetime:
+    """Accept epoch seconds, ISO 8601 strings or nothing"""
+    if ts is None:
+        return received_at
+    if isinstance(ts, (int, float)):
+        return datetime.fromtimestamp(ts, tz=timezone.utc)
+    timestamp = datetime.fromisoformat(str(ts))
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
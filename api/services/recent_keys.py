@@ -0,0 +1,89 @@
+"""In-memory filter of recently written readings
+
+Brokers redeliver QoS 1 messages after reconnects and device firmware
+resends unacknowledged readings, so the same (metric type, timestamp)
+arrives again from a device shortly after it was written. The writer
+keeps the keys of its latest committed rows in a bounded ring per device
+and drops matching rows before they reach the database. Anything the
+ring has forgotten is still caught by the unique natural key index.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Set, Tuple
+from models.metric import natural_key
+
+
+class _Ring:
+    """The last ``size`` keys of one device, with O(1) membership"""
+    __slots__ = ('keys', 'members')
+
+    def __init__(self, size: int):
+        self.keys: Deque[Tuple] = deque(maxlen=size)
+        self.members: Set[Tuple] = set()
+
+    def add(self, key: Tuple) -> None:
+        if key in self.members:
+            return
+        if len(self.keys) == self.keys.maxlen:
+            self.members.discard(self.keys[0])
+        self.keys.append(key)
+        self.members.add(key)
+
+
+class RecentKeyFilter:
+    """Per-device rings of committed natural keys, least recent evicted"""
+
+    def __init__(self, window: int = 512, max_devices: int = 10000):
+        self.window = window
+        self.max_devices = max_devices
+        self.checked = 0
+        self.dropped = 0
+        self._rings: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def split(self, rows: List[Dict[str, Any]]) \
+            -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Remove rows already written or repeated within ``rows``
+
+        Returns:
+            The remaining rows and the number of rows removed
+        """
+        fresh = []
+        batch: Set[Tuple] = set()
+        with self._lock:
+            for row in rows:
+                key = natural_key(row['device_id'], row['metric_type_id'],
+                                  row['timestamp'])
+                ring = self._rings.get(key[0])
+                if key in batch or (ring is not None and
+                                    key[1:] in ring.members):
+                    continue
+                batch.add(key)
+                fresh.append(row)
+            self.checked += len(rows)
+            self.dropped += len(rows) - len(fresh)
+        return fresh, len(rows) - len(fresh)
+
+    def remember(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Record the keys of committed rows"""
+        with self._lock:
+            for row in rows:
+                device_id, type_id, timestamp = natural_key(
+                    row['device_id'], row['metric_type_id'],
+                    row['timestamp'])
+                ring = self._rings.get(device_id)
+                if ring is None:
+                    ring = self._rings[device_id] = _Ring(self.window)
+                    if len(self._rings) > self.max_devices:
+                        self._rings.popitem(last=False)
+                else:
+                    self._rings.move_to_end(device_id)
+                ring.add((type_id, timestamp))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return filter counters"""
+        with self._lock:
+            return {'devices': len(self._rings), 'checked': self.checked,
+                    'dropped': self.dropped}
@@ -0,0 +1,198 @@
+"""Per-user cache of JSON responses for the polled API endpoints
+
+Entries are keyed by user, path and query string and tagged with the
+devices they were built from (``device:<id>``) and, for listings, their
+owner (``user:<id>``). The ingest writer invalidates device tags after
+every committed batch and device events invalidate both tags, so a repeat
+poll between readings is answered without touching the database. A short
+TTL bounds time-dependent fields such as ``is_active`` and writes made by
+other processes (e.g. dedicated ingest workers).
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import wraps
+from typing import (Any, Callable, Dict, FrozenSet, Iterable, Optional,
+                    Set, Tuple)
+from flask import Response, current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from models.device import Device
+
+
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+TagFunction = Callable[[Any, Dict[str, Any], Any], Iterable[str]]
+
+
+@dataclass
+class CachedResponse:
+    """Body of a successful response and the tags it depends on"""
+    body: bytes
+    mimetype: str
+    headers: Dict[str, str]
+    tags: FrozenSet[str]
+    expires_at: float
+
+
+class ResponseCache:
+    """Thread-safe LRU response cache bounded by total body size"""
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 30.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._bytes = 0
+        self._data: OrderedDict = OrderedDict()
+        self._keys_by_tag: Dict[str, Set[Tuple]] = {}
+        self._tag_versions: Dict[str, int] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def configure(self, max_bytes: int, ttl: float) -> None:
+        """Apply size and TTL settings from the app config"""
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def get(self, key: Tuple) -> Optional[CachedResponse]:
+        """Return a live entry, or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry.expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def version(self) -> int:
+        """Invalidation counter, taken before building a response"""
+        return self._version
+
+    def set(self, key: Tuple, body: bytes, mimetype: str,
+            headers: Dict[str, str], tags: Iterable[str],
+            since: int) -> bool:
+        """
+        Store a response unless one of its tags was invalidated after
+        ``since``, which would mean the body may already be stale
+        """
+        tags = frozenset(tags)
+        if len(body) > self.max_bytes:
+            return False
+        with self._lock:
+            if any(self._tag_versions.get(tag, 0) > since for tag in tags):
+                return False
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = CachedResponse(
+                body, mimetype, headers, tags, time.monotonic() + self.ttl)
+            self._bytes += len(body)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+            return True
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        """Drop every entry carrying any of the tags"""
+        with self._lock:
+            self._version += 1
+            for tag in tags:
+                self._tag_versions[tag] = self._version
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_devices(self, device_ids: Iterable[int]) -> None:
+        """Drop entries built from any of the devices"""
+        self.invalidate_tags(f"device:{device_id}"
+                             for device_id in device_ids)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+            self._keys_by_tag.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def cached(self, tags: TagFunction) -> Callable:
+        """
+        Cache successful JSON responses of a route per user
+
+        ``tags`` receives the user id, the view arguments and the decoded
+        response body, and returns the tags of the entry. Must be applied
+        below ``jwt_required`` so the identity is available.
+        """
+        def decorator(view: Callable) -> Callable:
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                user_id = get_jwt_identity()
+                key = (user_id, request.path,
+                       tuple(sorted(request.args.items(multi=True))))
+                entry = self.get(key)
+                if entry is not None:
+                    response = Response(entry.body, mimetype=entry.mimetype,
+                                        headers=entry.headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    # Answers If-None-Match from the stored ETag
+                    return response.make_conditional(request)
+
+                since = self.version()
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and response.is_json \
+                        and not response.is_streamed:
+                    self.set(key, response.get_data(), response.mimetype,
+                             {name: response.headers[name]
+                              for name in VALIDATOR_HEADERS
+                              if name in response.headers},
+                             tags(user_id, kwargs, response.get_json()),
+                             since)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= len(entry.body)
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+response_cache = ResponseCache()
+
+
+# Event listeners
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_update')
+@event.listens_for(Device, 'after_delete')
+def invalidate_device_responses(mapper, connection, target):
+    """Drop cached responses built from devices that were written"""
+    response_cache.invalidate_tags((f"device:{target.id}",
+                                    f"user:{target.user_id}"))
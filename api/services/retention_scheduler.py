@@ -0,0 +1,142 @@
+"""Background application of the retention tiers
+
+Every RETENTION_INTERVAL seconds the scheduler applies each tier in
+RETENTION_TIERS: raw chunks are dropped after the stats aggregates are
+refreshed over them, and aggregate chunks are dropped per tier. Without
+TimescaleDB, weekly partitions are created ahead and dropped whole when
+metrics is partitioned; otherwise bounded, batched deletes are used.
+Each tier's run is recorded in retention_runs. Only API processes run
+the scheduler (ingest workers disable it); on PostgreSQL an advisory
+lock keeps several of them from running retention concurrently.
+"""
+from __future__ import annotations
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db
+from models.metric import Metric
+from models.retention import RetentionRun, RetentionTier, parse_tiers
+from models.storage import get_backend
+
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key shared by every process of this deployment
+RETENTION_LOCK_KEY = 0x72657465
+
+
+class RetentionScheduler:
+    """Apply the retention tiers on a fixed interval"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.tiers: List[RetentionTier] = parse_tiers(
+            app.config.get('RETENTION_TIERS', ''))
+        self.interval: float = app.config.get('RETENTION_INTERVAL', 3600.0)
+        self.batch_size: int = app.config.get('RETENTION_BATCH_SIZE', 10000)
+        self.max_seconds: float = app.config.get('RETENTION_MAX_SECONDS',
+                                                 60.0)
+        self.runs = 0
+        self.last_runs: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the scheduler thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='retention', daemon=True)
+        self._thread.start()
+        logger.info(f"Retention scheduler started for "
+                    f"{len(self.tiers)} tiers")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the scheduler after the current run"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> List[RetentionRun]:
+        """Apply every tier now, unless another process is already"""
+        with self.app.app_context():
+            connection = db.engine.connect()
+            acquired = False
+            try:
+                acquired = self._acquire(connection)
+                if not acquired:
+                    logger.info("Retention already running elsewhere")
+                    return []
+                # Create upcoming partitions before rows need them
+                get_backend().maintain(Metric.__table__)
+                runs = []
+                for tier in self.tiers:
+                    run = RetentionRun.apply(tier, self.batch_size,
+                                             self.max_seconds)
+                    if run is None:
+                        continue
+                    runs.append(run)
+                    if run.error:
+                        logger.error(f"Retention of {run.relation} failed: "
+                                     f"{run.error}")
+                    else:
+                        logger.info(f"Retention of {run.relation}: "
+                                    f"{run.method} dropped "
+                                    f"{run.chunks_dropped} chunks, deleted "
+                                    f"{run.rows_deleted} rows in "
+                                    f"{run.duration_ms} ms")
+                self.runs += 1
+                self.last_runs = [run.to_dict() for run in runs]
+                return runs
+            finally:
+                if acquired:
+                    self._release(connection)
+                connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the tiers and the outcome of the latest run"""
+        return {
+            'tiers': [{'resolution': tier.resolution,
+                       'keep_seconds': tier.keep.total_seconds()
+                       if tier.keep else None} for tier in self.tiers],
+            'runs': self.runs,
+            'last_runs': self.last_runs
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            # Any failure only costs this run; the next interval retries
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention run failed")
+
+    @staticmethod
+    def _acquire(connection) -> bool:
+        if connection.dialect.name != 'postgresql':
+            return True
+        return bool(connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"),
+            {'key': RETENTION_LOCK_KEY}).scalar())
+
+    @staticmethod
+    def _release(connection) -> None:
+        if connection.dialect.name != 'postgresql':
+            return
+        try:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"),
+                               {'key': RETENTION_LOCK_KEY})
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to release retention lock: {str(e)}")
+
+
+def init_retention_scheduler(app: Flask) -> RetentionScheduler:
+    """Create and start the retention scheduler for the app"""
+    scheduler = RetentionScheduler(app)
+    app.retention_scheduler = scheduler
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,176 @@
+"""Append-only on-disk spool for metric rows
+
+When the database is unavailable the writer appends validated rows here
+instead of dropping them. The spool is a directory of numbered segment
+files; each record is a 4-byte length, a 4-byte CRC32 and a JSON row.
+Segments are rotated by size and replayed (memory-mapped) oldest first.
+A torn record at the end of a segment, left by a crash mid-append, is
+detected by its length or checksum and ignored.
+
+Replay checkpoints name segments by sequence number, so numbers must
+never repeat, even after every segment was replayed and removed. The
+last number handed out is kept in a sequence file next to the segments,
+and new numbers are at least the current time in microseconds in case
+the directory itself was wiped.
+"""
+from __future__ import annotations
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+
+RECORD_HEADER = struct.Struct('!II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.spool'
+SEQUENCE_FILE = 'sequence'
+
+
+class Spool:
+    """Segment-rotated append-only spool of metric rows"""
+
+    def __init__(self, directory: str,
+                 segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.rows_appended = 0
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = None
+        self._active: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._next_seq = max(segments[-1][0] if segments else 0,
+                             self._read_sequence()) + 1
+
+    def append(self, rows: List[Dict[str, Any]]) -> None:
+        """Append rows and fsync them before returning"""
+        if not rows:
+            return
+        buffer = bytearray()
+        for row in rows:
+            payload = json.dumps(_encode_row(row)).encode('utf-8')
+            buffer += RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            buffer += payload
+
+        with self._lock:
+            if self._file is None or \
+               self._file.tell() >= self.segment_bytes:
+                self._open_segment()
+            self._file.write(buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.rows_appended += len(rows)
+
+    def rotate(self) -> None:
+        """Close the active segment so it can be replayed"""
+        with self._lock:
+            self._close_segment()
+
+    def pending(self) -> bool:
+        """Whether any rows are waiting in the spool"""
+        return bool(self.segments())
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """List (sequence, path) of segments, oldest first"""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and \
+               name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                segments.append((seq, os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def closed_segments(self) -> List[Tuple[int, str]]:
+        """Segments that are no longer being appended to"""
+        with self._lock:
+            active = self._active
+        return [segment for segment in self.segments()
+                if segment[0] != active]
+
+    @staticmethod
+    def read_segment(path: str) -> List[Dict[str, Any]]:
+        """Read every intact record of a segment in append order"""
+        rows: List[Dict[str, Any]] = []
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return rows
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + RECORD_HEADER.size <= len(data):
+                    length, checksum = RECORD_HEADER.unpack_from(data, offset)
+                    start = offset + RECORD_HEADER.size
+                    payload = data[start:start + length]
+                    if len(payload) < length or \
+                       zlib.crc32(payload) != checksum:
+                        break  # torn tail record
+                    rows.append(_decode_row(json.loads(payload)))
+                    offset = start + length
+        return rows
+
+    def remove_segment(self, seq: int) -> None:
+        """Delete a fully replayed segment"""
+        path = os.path.join(self.directory,
+                            f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return segment count, size on disk and rows appended"""
+        segments = self.segments()
+        return {
+            'segments': len(segments),
+            'bytes': sum(os.path.getsize(path) for _, path in segments),
+            'rows_appended': self.rows_appended
+        }
+
+    def close(self) -> None:
+        """Close the active segment"""
+        self.rotate()
+
+    def _open_segment(self) -> None:
+        self._close_segment()
+        self._active = max(self._next_seq, time.time_ns() // 1000)
+        self._next_seq = self._active + 1
+        self._write_sequence(self._active)
+        path = os.path.join(
+            self.directory,
+            f"{SEGMENT_PREFIX}{self._active:012d}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab')
+
+    def _read_sequence(self) -> int:
+        try:
+            with open(os.path.join(self.directory, SEQUENCE_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_sequence(self, seq: int) -> None:
+        """Persist the last sequence number handed out"""
+        path = os.path.join(self.directory, SEQUENCE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _close_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._active = None
+
+
+def _encode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = dict(row)
+    encoded['timestamp'] = row['timestamp'].isoformat()
+    return encoded
+
+
+def _decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return row
@@ -0,0 +1,89 @@
+"""
+Fixtures for tests run against an in-memory SQLite database
+
+Tests parametrized over storage backends (indirect ``app`` parameter)
+also run on TimescaleDB when TIMESCALE_TEST_DATABASE_URI points at a
+scratch database (timescaledb:// dialect, so metrics is a hypertable);
+its tables are dropped afterwards.
+"""
+import os
+import sys
+import pytest
+from flask import Flask
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from models import db  # noqa: E402
+from models.user import User  # noqa: E402
+from models.device import Device, status_tracker  # noqa: E402
+from models.latest_metric import latest_values  # noqa: E402
+from models import storage  # noqa: E402
+from models.metric import MetricType  # noqa: E402
+from services.lookup_cache import lookup_cache  # noqa: E402
+
+
+@pytest.fixture
+def app(request):
+    """Database-only app (no MQTT, no scheduler) on a fresh database"""
+    backend = getattr(request, 'param', 'portable')
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(TESTING=True, METRIC_STORAGE_BACKEND=backend)
+    if backend == 'timescale':
+        uri = os.getenv('TIMESCALE_TEST_DATABASE_URI')
+        if not uri:
+            pytest.skip('TIMESCALE_TEST_DATABASE_URI is not set')
+        app.config.update(SQLALCHEMY_DATABASE_URI=uri)
+    else:
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite://',
+            SQLALCHEMY_ENGINE_OPTIONS={'poolclass': StaticPool,
+                                       'connect_args': {
+                                           'check_same_thread': False}},
+        )
+    db.init_app(app)
+    # Process-wide state must not leak between databases
+    status_tracker.rebuild([], [])
+    latest_values.live = False
+    latest_values._values.clear()
+    lookup_cache.clear()
+    storage._backends.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    """A user owning no devices yet"""
+    user = User(username='tester', email='tester@example.com',
+                password='secret-password')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def metric_type(app):
+    """A metric type readings can be written against"""
+    # MetricType maps plain Columns, so insert through the table
+    result = db.session.execute(
+        MetricType.__table__.insert().values(name='voltage', unit='V'))
+    db.session.commit()
+    return db.session.get(MetricType, result.inserted_primary_key[0])
+
+
+@pytest.fixture
+def make_devices(user):
+    """Factory adding ``count`` devices to the test user"""
+    def make(count, prefix='device'):
+        devices = [Device(device_key=f"{prefix}-{i}", user=user)
+                   for i in range(count)]
+        db.session.add_all(devices)
+        db.session.commit()
+        return devices
+    return make
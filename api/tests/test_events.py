@@ -0,0 +1,29 @@
+"""
+Tests for the server-sent event stream
+"""
+import time
+from datetime import timedelta
+from flask_jwt_extended import JWTManager, create_access_token
+from routes.events import events
+from services.event_hub import event_hub
+
+
+def test_stream_ends_when_token_expires(app, make_devices):
+    device = make_devices(1)[0]
+    app.config.update(JWT_SECRET_KEY='test-secret', EVENT_KEEPALIVE=0.05)
+    JWTManager(app)
+    app.register_blueprint(events, url_prefix='/api')
+    token = create_access_token(identity=str(device.user_id),
+                                expires_delta=timedelta(seconds=2))
+
+    started = time.monotonic()
+    response = app.test_client().get(
+        '/api/events', headers={'Authorization': f"Bearer {token}"})
+    body = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert body.startswith('retry: 5000')
+    assert ': keepalive' in body
+    assert body.endswith('event: expired\ndata: {}\n\n')
+    assert time.monotonic() - started < 5
+    assert not event_hub._by_device.get(device.id)
@@ -0,0 +1,66 @@
+"""
+Tests that the fleet summary issues a fixed number of queries
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from models import db
+from models.device import Device
+from models.latest_metric import LatestMetric
+from models.metric import Metric
+from models.user import User
+from benchmarks.batch_insert import make_rows
+from benchmarks.fleet_queries import count_queries
+
+
+def make_fleet(name, size, metric_type, readings=10):
+    """A user owning ``size`` devices with recent readings"""
+    user = User(username=name, email=f"{name}@example.com",
+                password='secret-password')
+    db.session.add(user)
+    db.session.flush()
+    devices = [Device(device_key=f"{name}-{i}", user=user)
+               for i in range(size)]
+    db.session.add_all(devices)
+    db.session.flush()
+    start = datetime.now(timezone.utc) - timedelta(hours=2)
+    for device in devices:
+        rows = make_rows(device.id, metric_type.id, readings, start)
+        Metric.batch_insert(rows, commit=False)
+        LatestMetric.upsert(rows, commit=False)
+    db.session.commit()
+    return user
+
+
+@pytest.mark.parametrize('size', [5, 25])
+def test_fleet_summary_query_count_is_fixed(app, metric_type, size):
+    single = make_fleet('single', 1, metric_type)
+    fleet = make_fleet('fleet', size, metric_type)
+
+    queries = count_queries(single.id)
+    assert queries > 0
+    assert count_queries(fleet.id) == queries
+
+    summary = Device.fleet_summary(fleet.id)
+    assert len(summary) == size
+    assert all(device['latest_metrics'] for device in summary)
+    assert all(reading['window']['count'] == 10
+               for device in summary
+               for reading in device['latest_metrics'])
+
+
+def test_device_dict_keeps_recent_metrics(app, metric_type):
+    user = make_fleet('legacy', 3, metric_type, readings=15)
+    devices = Device.query.filter_by(user_id=user.id).all()
+    device_ids = [device.id for device in devices]
+    recent = Metric.recent_for_devices(device_ids)
+    latest = LatestMetric.for_devices(device_ids)
+
+    for device in devices:
+        device_dict = device.to_dict(True, latest, recent)
+        assert device_dict == device.to_dict(True)
+        assert len(device_dict['latest_metrics']) == 1
+        readings = device_dict['recent_metrics']
+        assert len(readings) == 10
+        assert {r['device_id'] for r in readings} == {device.id}
+        timestamps = [r['timestamp'] for r in readings]
+        assert timestamps == sorted(timestamps, reverse=True)
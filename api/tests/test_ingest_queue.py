@@ -0,0 +1,61 @@
+"""
+Tests for the ingest queue overflow policies
+"""
+import random
+from services.ingest_queue import IngestQueue, OverflowPolicy
+
+
+def reference_put(items, row, maxsize):
+    """The linear scan drop_lowest_quality replaced"""
+    if len(items) >= maxsize:
+        worst = min(range(len(items)), key=lambda i: items[i]['quality'])
+        if items[worst]['quality'] >= row['quality']:
+            return False
+        del items[worst]
+    items.append(row)
+    return True
+
+
+def test_drop_lowest_quality_evicts_worst_oldest_first():
+    queue = IngestQueue(maxsize=3,
+                        policy=OverflowPolicy.DROP_LOWEST_QUALITY)
+    for n, quality in enumerate([0.5, 0.2, 0.2]):
+        assert queue.put({'n': n, 'quality': quality})
+
+    assert not queue.put({'n': 3, 'quality': 0.1})
+    assert queue.put({'n': 4, 'quality': 0.9})
+
+    assert [row['n'] for row in queue.get_batch(10, 0)] == [0, 2, 4]
+    assert queue.stats()['dropped'] == {'lowest_quality': 2}
+
+
+def test_drop_lowest_quality_matches_linear_scan():
+    rng = random.Random(7)
+    queue = IngestQueue(maxsize=20, high_watermark=1.0, low_watermark=0.5,
+                        policy=OverflowPolicy.DROP_LOWEST_QUALITY)
+    expected = []
+    for n in range(5000):
+        if rng.random() < 0.1:
+            count = rng.randint(1, 15)
+            assert queue.get_batch(count, 0) == expected[:count]
+            del expected[:count]
+            continue
+        row = {'n': n, 'quality': rng.choice([0.1, 0.3, 0.5, 0.9, 1.0])}
+        assert queue.put(row) == reference_put(expected, row, 20)
+        assert queue.qsize() == len(expected)
+    assert queue.get_batch(100, 0) == expected
+    assert len(queue._quality_heap) <= 2 * queue.maxsize + 20
+
+
+def test_stalled_queue_memory_stays_bounded():
+    queue = IngestQueue(maxsize=50,
+                        policy=OverflowPolicy.DROP_LOWEST_QUALITY)
+    for n in range(10000):
+        queue.put({'n': n, 'quality': (n % 7) / 7})
+        assert len(queue._items) <= 2 * queue.maxsize
+        assert len(queue._evicted) <= queue.maxsize + 1
+        assert len(queue._quality_heap) <= 2 * queue.maxsize
+    assert queue.qsize() == queue.maxsize
+    rows = queue.get_batch(100, 0)
+    assert len(rows) == queue.maxsize
+    assert all(row['quality'] == 6 / 7 for row in rows)
@@ -0,0 +1,66 @@
+"""
+Tests for the ingest lookup cache invalidation
+"""
+from sqlalchemy import inspect
+from models import db
+from models.device import DeviceStatus
+from models.metric import MetricType
+from models.user import User
+from services.lookup_cache import _MISSING, lookup_cache
+
+
+def test_new_metric_type_replaces_cached_miss(app):
+    lookup_cache.clear()
+    assert lookup_cache.get_metric_type('frequency') is None
+
+    db.session.add(MetricType(id=None, name='frequency', unit='Hz',
+                              description=None, validation_rules=None))
+    db.session.commit()
+
+    snapshot = lookup_cache.get_metric_type('frequency')
+    assert snapshot is not None and snapshot.name == 'frequency'
+
+
+def test_user_cleanup_forgets_device_snapshots(app, user, make_devices):
+    lookup_cache.clear()
+    device_ids = [device.id for device in make_devices(2)]
+    for device_id in device_ids:
+        assert lookup_cache.get_device(device_id) is not None
+
+    # Run the User before_delete listeners alone: cleanup_user_data
+    # deletes the devices with raw SQL, without any Device listener
+    mapper = inspect(User)
+    mapper.dispatch.before_delete(mapper, db.session.connection(),
+                                  inspect(user))
+    db.session.commit()
+
+    for device_id in device_ids:
+        assert lookup_cache.get_device(device_id) is None
+
+
+def test_device_write_is_invalidated_on_commit(app, make_devices):
+    lookup_cache.clear()
+    device = make_devices(1)[0]
+    assert lookup_cache.get_device(device.id).status == device.status
+
+    device.status = DeviceStatus.MAINTENANCE
+    db.session.flush()
+    # Not committed yet: other sessions still read the old row
+    assert lookup_cache.devices.get(device.id) is not _MISSING
+    db.session.commit()
+
+    assert lookup_cache.devices.get(device.id) is _MISSING
+    snapshot = lookup_cache.get_device(device.id)
+    assert snapshot.status == DeviceStatus.MAINTENANCE
+
+
+def test_rolled_back_write_keeps_snapshot(app, make_devices):
+    lookup_cache.clear()
+    device = make_devices(1)[0]
+    lookup_cache.get_device(device.id)
+
+    device.status = DeviceStatus.MAINTENANCE
+    db.session.flush()
+    db.session.rollback()
+
+    assert lookup_cache.devices.get(device.id) is not _MISSING
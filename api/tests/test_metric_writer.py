@@ -0,0 +1,140 @@
+"""
+Tests for the background metric writer
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+from models import db
+from models.metric import Metric
+from models.spool_checkpoint import SpoolCheckpoint
+from models.storage import get_backend
+from services.metric_writer import MetricWriter
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_unexpected_error_does_not_stop_writer(app, monkeypatch):
+    app.config.update(MQTT_SPOOL_DIR=None, MQTT_FLUSH_INTERVAL=10)
+    writer = MetricWriter(app)
+
+    def explode(rows, commit=True):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(writer, '_write', explode)
+
+    writer.start()
+    try:
+        writer.submit({'device_id': 1, 'metric_type_id': 1,
+                       'timestamp': datetime.now(timezone.utc),
+                       'value': 1.0, 'quality': 1.0,
+                       'metric_metadata': {}})
+        assert wait_for(lambda: writer.errors == 1)
+        assert writer.stats()['alive']
+    finally:
+        writer.stop(timeout=5)
+    assert not writer.stats()['alive']
+
+
+def make_writer(app, tmp_path, error):
+    """Writer spooling under tmp_path whose inserts raise ``error``"""
+    app.config.update(MQTT_SPOOL_DIR=str(tmp_path / 'spool'),
+                      MQTT_SPOOL_REPLAY_INTERVAL=0)
+    writer = MetricWriter(app)
+
+    def fail(rows, commit=True):
+        raise error
+    writer._write = fail
+    return writer
+
+
+def reading(value=1.0):
+    return {'device_id': 1, 'metric_type_id': 1,
+            'timestamp': datetime.now(timezone.utc), 'value': value,
+            'quality': 1.0, 'metric_metadata': {}}
+
+
+def test_transient_error_is_spooled(app, tmp_path):
+    error = OperationalError('INSERT', {}, Exception('server closed'))
+    writer = make_writer(app, tmp_path, error)
+    writer._flush([reading()])
+
+    assert writer.rows_spooled == 1
+    assert writer.rows_quarantined == 0
+    assert writer.spool.pending()
+
+
+def test_permanent_error_is_quarantined(app, tmp_path):
+    error = IntegrityError('INSERT', {}, Exception('foreign key'))
+    writer = make_writer(app, tmp_path, error)
+    writer._flush([reading()])
+
+    assert writer.rows_spooled == 0
+    assert writer.rows_quarantined == 1
+    assert not writer.spool.pending()
+    assert writer.quarantine.stats()['rows_appended'] == 1
+
+
+def test_replay_skips_rejected_rows(app, tmp_path):
+    error = DataError('INSERT', {}, Exception('value out of range'))
+    writer = make_writer(app, tmp_path, error)
+    writer.spool.append([reading(1.0), reading(2.0)])
+    writer.spool.rotate()
+    [(seq, _)] = writer.spool.segments()
+
+    writer._replay_spool()
+
+    assert not writer.spool.pending()
+    assert writer.rows_replayed == 0
+    assert writer.rows_quarantined == 2
+    checkpoint = db.session.get(SpoolCheckpoint, writer.spool_name)
+    assert checkpoint.segment == seq + 1 and checkpoint.position == 0
+
+
+def test_replay_after_restart_with_empty_spool(app, tmp_path, make_devices,
+                                              metric_type):
+    device = make_devices(1)[0]
+    app.config.update(MQTT_SPOOL_DIR=str(tmp_path / 'spool'),
+                      MQTT_DEDUP_WINDOW=0)
+
+    def spool_and_replay(values):
+        writer = MetricWriter(app)
+        writer._spool([dict(reading(value), device_id=device.id,
+                            metric_type_id=metric_type.id)
+                       for value in values])
+        writer._replay_spool()
+        writer.stop()
+        assert not writer.spool.pending()
+        return writer
+
+    assert spool_and_replay([1.0, 2.0]).rows_replayed == 2
+    # Restart: the spool directory is empty, the checkpoint is not
+    assert spool_and_replay([3.0]).rows_replayed == 1
+    assert sorted(m.value for m in Metric.query.all()) == [1.0, 2.0, 3.0]
+
+
+def test_replayed_rows_refresh_their_aggregate_range(app, tmp_path,
+                                                     make_devices,
+                                                     metric_type,
+                                                     monkeypatch):
+    device = make_devices(1)[0]
+    app.config.update(MQTT_SPOOL_DIR=str(tmp_path / 'spool'),
+                      MQTT_DEDUP_WINDOW=0)
+    refreshes = []
+    monkeypatch.setattr(get_backend(), 'refresh_aggregates',
+                        lambda older_than, newer_than=None:
+                        refreshes.append((newer_than, older_than)) or [])
+
+    writer = MetricWriter(app)
+    late = datetime.now(timezone.utc) - timedelta(days=2)
+    writer._spool([dict(reading(), device_id=device.id,
+                        metric_type_id=metric_type.id,
+                        timestamp=late + timedelta(minutes=i))
+                   for i in range(3)])
+    writer._replay_spool()
+    writer.stop()
+
+    assert refreshes == [(late, late + timedelta(minutes=2, microseconds=1))]
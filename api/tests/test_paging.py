@@ -0,0 +1,36 @@
+"""
+Tests for metric paging bounds
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from models.metric import Metric
+from routes.data import MAX_PER_PAGE, _page_size
+from benchmarks.batch_insert import make_rows
+
+
+@pytest.mark.parametrize('argument, expected', [
+    ('', 10), ('per_page=0', 1), ('per_page=-5', 1), ('per_page=1', 1),
+    (f'per_page={MAX_PER_PAGE}', MAX_PER_PAGE),
+    (f'per_page={MAX_PER_PAGE + 1}', MAX_PER_PAGE),
+    ('per_page=abc', 10),
+])
+def test_page_size_is_clamped(app, argument, expected):
+    with app.test_request_context(f'/?{argument}'):
+        assert _page_size() == expected
+
+
+@pytest.mark.parametrize('limit', [0, -3])
+def test_keyset_page_returns_at_least_one_row(app, make_devices,
+                                              metric_type, limit):
+    device = make_devices(1)[0]
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    Metric.batch_insert(make_rows(device.id, metric_type.id, 3, start))
+    query = Metric.query.filter_by(device_id=device.id)
+
+    page = Metric.get_keyset_page(query, limit)
+    assert page['per_page'] == 1
+    assert len(page['metrics']) == 1
+
+    following = Metric.get_keyset_page(query, limit, page['next_cursor'])
+    assert following['metrics'][0]['timestamp'] < \
+        page['metrics'][0]['timestamp']
@@ -0,0 +1,36 @@
+"""
+Tests for batch payload decoding
+"""
+import json
+from datetime import datetime, timezone
+import pytest
+from services.payloads import decode_batch
+
+
+def batch(*records):
+    return json.dumps({'v': 1, 'records': list(records)}).encode()
+
+
+def test_decodes_object_and_array_records():
+    decoded = decode_batch(batch(
+        {'type': 'voltage', 'ts': 1718000000, 'value': 230},
+        ['current', '2024-06-10T08:13:20+02:00', '1.5', 0.5]))
+
+    assert [(r.metric_type, r.value, r.quality) for r in decoded.readings] \
+        == [('voltage', 230.0, 1.0), ('current', 1.5, 0.5)]
+    assert [r.timestamp for r in decoded.readings] == \
+        [datetime(2024, 6, 10, 6, 13, 20, tzinfo=timezone.utc)] * 2
+
+
+@pytest.mark.parametrize('record', [
+    {'type': 'voltage', 'value': {'volts': 230}},
+    {'type': 'voltage', 'value': [230]},
+    {'type': 'voltage', 'value': 'high'},
+    {'type': 'voltage', 'value': 230, 'quality': None},
+    {'type': 'voltage', 'value': 230, 'ts': 10 ** 20},
+    {'type': 'voltage', 'value': 230, 'ts': [1718000000]},
+    {'type': 'voltage', 'value': 230, 'ts': 'yesterday'},
+])
+def test_malformed_records_raise_value_error(record):
+    with pytest.raises(ValueError):
+        decode_batch(batch(record))
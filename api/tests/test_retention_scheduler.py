@@ -0,0 +1,28 @@
+"""
+Tests for the background retention scheduler
+"""
+import time
+from services.retention_scheduler import RetentionScheduler
+
+
+def test_unexpected_error_does_not_stop_scheduler(app, monkeypatch):
+    app.config.update(RETENTION_INTERVAL=0.01)
+    scheduler = RetentionScheduler(app)
+    calls = []
+
+    def run_once():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        return []
+    monkeypatch.setattr(scheduler, 'run_once', run_once)
+
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(calls) >= 2
+        assert scheduler._thread.is_alive()
+    finally:
+        scheduler.stop(timeout=5)
@@ -0,0 +1,68 @@
+"""
+Tests for the status tracker behind Device.record_readings
+"""
+from datetime import datetime, timedelta, timezone
+from models import db
+from models.device import Device, status_tracker
+from models.status_tracker import StatusTracker
+from models.metric import Metric
+from benchmarks.batch_insert import make_rows
+
+
+def test_unchanged_status_after_rebuild_on_sqlite(make_devices, metric_type):
+    device = make_devices(1)[0]
+    start = datetime.now(timezone.utc) - timedelta(minutes=5)
+    # Registered before the readings, which are older than "now"
+    device.last_seen = start - timedelta(minutes=1)
+    db.session.commit()
+    rows = make_rows(device.id, metric_type.id, 3, start)
+    for row in rows:
+        row['value'] = 230.0
+    Metric.batch_insert(rows)
+    assert Device.record_readings(rows)
+
+    Device.rebuild_status_tracker()
+    stored = db.session.get(Device, device.id)
+
+    def write_at(offset):
+        rows = make_rows(device.id, metric_type.id, 1, start + offset)
+        rows[0]['value'] = 230.0
+        Metric.batch_insert(rows)
+        return Device.record_readings(rows)
+
+    # Same status, last_seen moved less than the resolution: no write
+    assert write_at(timedelta(seconds=30)) == []
+    # Same status, last_seen moved past the resolution: last_seen only
+    updates = write_at(timedelta(minutes=2))
+    assert [update['id'] for update in updates] == [device.id]
+    assert updates[0].get('status', stored.status) == stored.status
+
+
+def test_rebuild_reads_naive_timestamps_as_utc():
+    tracker = StatusTracker(window=timedelta(minutes=30))
+    seen = datetime(2024, 7, 22, 12, 0)
+    tracker.rebuild([], [(1, 'on', seen)])
+
+    aware = seen.replace(tzinfo=timezone.utc)
+    assert not tracker.needs_write(1, 'on', aware + timedelta(seconds=30),
+                                   timedelta(minutes=1))
+    assert tracker.needs_write(1, 'on', aware + timedelta(minutes=2),
+                               timedelta(minutes=1))
+
+
+def test_late_readings_do_not_move_last_seen_back(make_devices, metric_type):
+    device = make_devices(1)[0]
+    now = datetime.now(timezone.utc)
+    current = make_rows(device.id, metric_type.id, 2, now)
+    Metric.batch_insert(current)
+    Device.record_readings(current)
+
+    # A replayed segment, written by a process that never saw the above
+    status_tracker.forget(device.id)
+    late = make_rows(device.id, metric_type.id, 2, now - timedelta(hours=2))
+    Metric.batch_insert(late)
+    assert Device.record_readings(late)
+
+    db.session.expire_all()
+    stored = db.session.get(Device, device.id)
+    assert stored.last_seen == current[-1]['timestamp']
@@ -0,0 +1,119 @@
+"""
+Tests shared by the Timescale and portable metric storage backends
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from models import db
+from models.metric import Metric
+from models.retention import RetentionRun, RetentionTier
+from models.aggregates import STATS_VIEWS, aggregate_registry
+from models.storage import TimescaleBackend, get_backend
+
+BACKENDS = pytest.mark.parametrize('app', ['portable', 'timescale'],
+                                   indirect=True)
+PLUS_TWO = timezone(timedelta(hours=2))
+
+
+def utc(hour, minute=0, day=22):
+    return datetime(2024, 7, day, hour, minute, tzinfo=timezone.utc)
+
+
+def insert(device, metric_type, readings):
+    """Write (timestamp, value) pairs through the ingest insert path"""
+    Metric.batch_insert([{
+        'device_id': device.id, 'metric_type_id': metric_type.id,
+        'timestamp': timestamp, 'value': value, 'quality': 1.0,
+        'metric_metadata': {}
+    } for timestamp, value in readings])
+
+
+def as_utc(moment):
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+@BACKENDS
+def test_backend_is_selected(app):
+    assert get_backend().name == app.config['METRIC_STORAGE_BACKEND']
+
+
+@BACKENDS
+def test_offset_timestamps_are_stored_as_utc(app, make_devices, metric_type):
+    device = make_devices(1)[0]
+    insert(device, metric_type, [
+        (utc(11), 1.0),
+        (datetime(2024, 7, 22, 12, 0, tzinfo=PLUS_TWO), 2.0),
+    ])
+    db.session.expire_all()
+
+    rows = Metric.query.order_by(Metric.timestamp).all()
+    assert [row.value for row in rows] == [2.0, 1.0]
+    assert rows[0].timestamp == utc(10)
+    assert rows[0].timestamp.tzinfo is not None
+    assert Metric.query.filter(
+        Metric.timestamp < datetime(2024, 7, 22, 12, 30, tzinfo=PLUS_TWO)
+    ).count() == 1
+
+
+@BACKENDS
+@pytest.mark.parametrize('interval, expected', [
+    ('1 hour', {utc(10): (3, 1.0, 3.0), utc(11): (1, 4.0, 4.0)}),
+    ('15 minutes', {utc(10): (1, 1.0, 1.0), utc(10, 30): (2, 2.0, 3.0),
+                    utc(11): (1, 4.0, 4.0)}),
+])
+def test_stats_select_buckets(app, make_devices, metric_type,
+                              interval, expected):
+    device = make_devices(1)[0]
+    insert(device, metric_type, [
+        (utc(10, 5), 1.0),
+        (datetime(2024, 7, 22, 12, 30, tzinfo=PLUS_TWO), 2.0),
+        (utc(10, 40), 3.0),
+        (utc(11, 10), 4.0),
+        (utc(9, 55), 9.0),  # before the range
+    ])
+
+    rows = db.session.execute(Metric.stats_select(
+        [device.id], [metric_type.id], utc(10), utc(12), interval))
+    buckets = {as_utc(r.bucket): (int(r.sample_count), float(r.min_value),
+                                  float(r.max_value)) for r in rows}
+    assert buckets == expected
+
+
+@BACKENDS
+def test_timerange_stats_average(app, make_devices, metric_type):
+    device = make_devices(1)[0]
+    insert(device, metric_type, [(utc(10, 5), 1.0), (utc(10, 40), 3.0)])
+
+    [result] = Metric.get_timerange_stats(device.id, metric_type.id,
+                                          utc(10), utc(11))
+    assert as_utc(result.timestamp) == utc(10)
+    assert result.value['avg'] == pytest.approx(2.0)
+    assert result.value['count'] == 2
+
+
+@BACKENDS
+def test_raw_retention_removes_expired_rows(app, make_devices, metric_type):
+    device = make_devices(1)[0]
+    now = datetime.now(timezone.utc)
+    insert(device, metric_type, [(now - timedelta(days=40), 1.0),
+                                 (now - timedelta(days=1), 2.0)])
+
+    run = RetentionRun.apply(RetentionTier('raw', timedelta(days=30)))
+
+    assert run.error is None and run.complete
+    assert run.rows_deleted + run.chunks_dropped >= 1
+    assert [m.value for m in Metric.query.all()] == [2.0]
+
+
+def test_recent_rows_are_left_to_the_refresh_policy():
+    for view in STATS_VIEWS:
+        aggregate_registry.register(view)
+    try:
+        now = datetime.now(timezone.utc)
+        # Inside every policy window: no refresh, so no connection either
+        assert TimescaleBackend().refresh_aggregates(
+            now, newer_than=now - timedelta(seconds=30)) == []
+    finally:
+        for view in STATS_VIEWS:
+            aggregate_registry.unregister(view.name)
@@ -48,6 +48,11 @@ unsigned long lastReading = 0;
 // Buffer for JSON document
 StaticJsonDocument<200> doc;
 
+// Buffer for batched readings (see publish_batch)
+StaticJsonDocument<384> batchDoc;
+const int BATCH_VERSION = 1;
+const uint16_t MQTT_BUFFER_SIZE = 512;
+
 void setup_wifi() {
   delay(10);
   Serial.println("Connecting to WiFi...");
@@ -117,22 +122,62 @@ void publish_metric(const char* metric_type, float value, float quality = 1.0) {
   }
 }
 
-void read_and_publish_sensors() {
-  // Read temperature
-  float temperature = dht.readTemperature();
+void add_reading(JsonArray records, const char* metric_type,
+                 unsigned long ts, float value, float quality) {
+  JsonArray record = records.createNestedArray();
+  record.add(metric_type);
+  record.add(ts);
+  record.add(value);
+  record.add(quality);
+}
+
+void publish_batch(float temperature, float humidity,
+                   float battery_voltage, float quality) {
+  if (!client.connected()) {
+    reconnect_mqtt();
+  }
+
+  // One MessagePack document for all readings, metadata sent once
+  batchDoc.clear();
+  batchDoc["v"] = BATCH_VERSION;
+
+  JsonObject metadata = batchDoc.createNestedObject("metadata");
+  metadata["firmware_version"] = "1.0.0";
+  metadata["wifi_strength"] = WiFi.RSSI();
+
+  // Records are compact [type, ts, value, quality] arrays
+  unsigned long ts = timeClient.getEpochTime();
+  JsonArray records = batchDoc.createNestedArray("records");
   if (!isnan(temperature)) {
-    publish_metric("temperature", temperature);
+    add_reading(records, "temperature", ts, temperature, quality);
   }
-  
-  // Read humidity
-  float humidity = dht.readHumidity();
   if (!isnan(humidity)) {
-    publish_metric("humidity", humidity);
+    add_reading(records, "humidity", ts, humidity, quality);
+  }
+  add_reading(records, "battery", ts, battery_voltage, 1.0);
+
+  uint8_t payload[MQTT_BUFFER_SIZE];
+  size_t length = serializeMsgPack(batchDoc, payload, sizeof(payload));
+
+  String topic = "devices/" + String(DEVICE_ID) + "/batch/msgpack";
+
+  if (client.publish(topic.c_str(), payload, length)) {
+    Serial.println("Published " + String(records.size()) + " readings to " + topic);
+  } else {
+    Serial.println("Failed to publish batch");
   }
+}
+
+void read_and_publish_sensors() {
+  float temperature = dht.readTemperature();
+  float humidity = dht.readHumidity();
   
   // Calculate sensor quality based on battery voltage
   float battery_voltage = analogRead(A0) * (3.3 / 1024.0);
   float quality = min(battery_voltage / 3.3, 1.0);  // Quality decreases with battery voltage
+
+  // Publish all readings in a single batch
+  publish_batch(temperature, humidity, battery_voltage, quality);
   
   // Publish device status
   doc.clear();
@@ -179,6 +224,7 @@ void setup() {
   // Configure MQTT
   client.setServer(MQTT_BROKER, MQTT_PORT);
   client.setCallback(callback);
+  client.setBufferSize(MQTT_BUFFER_SIZE);  // batches exceed the 256 byte default
   
   // Initialize time client
   timeClient.begin();
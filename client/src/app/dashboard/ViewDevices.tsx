@@ -3,10 +3,17 @@
 import React, { useEffect, useState } from "react";
 import axios from "axios";
 
+interface LatestMetric {
+  metric_type: string;
+  timestamp: string;
+  value: number;
+}
+
 interface Device {
   id: number;
   device_key: string;
   name: string;
+  latest_metrics?: LatestMetric[];
 }
 
 interface ViewDevicesProps {
@@ -21,7 +28,7 @@ const ViewDevices: React.FC<ViewDevicesProps> = ({ accessToken }) => {
       try {
         // Make the GET request to retrieve all devices for the user
         const response = await axios.get(
-          "http://web-01.koketsodiale.tech/api/devices",
+          "http://web-01.koketsodiale.tech/api/devices?include_metrics=true",
           {
             headers: {
               Authorization: `Bearer ${accessToken}`,
@@ -45,6 +52,11 @@ const ViewDevices: React.FC<ViewDevicesProps> = ({ accessToken }) => {
         <div key={device.id} className="bg-white shadow-md rounded-lg p-4">
           <h2 className="text-lg font-bold mb-2">{device.name}</h2>
           <p className="text-gray-700 mb-2">Device Key: {device.device_key}</p>
+          {device.latest_metrics?.map((metric) => (
+            <p key={metric.metric_type} className="text-gray-700 text-sm">
+              {metric.metric_type}: {metric.value}
+            </p>
+          ))}
         </div>
       ))}
     </div>
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import axios from "axios";
 
 interface Metric {
@@ -53,3 +53,37 @@ export function useDeviceData() {
 
   return { data, loading, error, getDeviceData };
 }
+
+export interface DeviceEvent {
+  event: "reading" | "status";
+  device_id: number;
+  metric_type_id?: number;
+  timestamp?: string;
+  value?: number;
+  status?: string | null;
+  last_seen?: string;
+}
+
+// Pushes readings as they are ingested instead of polling getDeviceData
+export function useDeviceEvents(
+  deviceIds: number[],
+  onEvent: (event: DeviceEvent) => void,
+) {
+  const key = deviceIds.join(",");
+
+  useEffect(() => {
+    const token = localStorage.getItem("access_token");
+    if (!token) return;
+
+    const params = new URLSearchParams({ token });
+    if (key) params.set("device_ids", key);
+    const source = new EventSource(`/api/events?${params.toString()}`);
+    const handle = (message: MessageEvent) =>
+      onEvent(JSON.parse(message.data) as DeviceEvent);
+    source.addEventListener("reading", handle);
+    source.addEventListener("status", handle);
+
+    return () => source.close();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [key]);
+}
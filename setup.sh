@@ -66,6 +66,28 @@ WantedBy=multi-user.target
 EOF
 check_status "Failed to create service file"
 
+# Optional: dedicated sharded ingest workers (set MQTT_INGEST_WORKERS in
+# the API .env too so the web workers stop ingesting themselves)
+sudo bash -c 'cat >  /etc/systemd/system/autoswitch-ingest.service' << EOF
+[Unit]
+Description=Loadshedding Autoswitch MQTT ingest workers
+After=network.target postgresql.service mosquitto.service
+
+[Service]
+User=ubuntu
+Group=ubuntu
+WorkingDirectory=/home/ubuntu/Loadshedding_Autoswitch_v1/api
+Environment=MQTT_INGEST_WORKERS=4
+ExecStart=/usr/bin/python3 -m services.ingest_supervisor
+KillSignal=SIGTERM
+TimeoutStopSec=60
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF
+check_status "Failed to create ingest service file"
+
 sudo systemctl daemon-reload
 check_status "Failed to reload systemd daemon"
 